@@ -0,0 +1,527 @@
+# benchmark.py
+# 性能計測用スクリプト
+# 使い方: python benchmark.py <サブコマンド> --help
+#
+#   analyze : analyze_item を大量に投げている間、他のAPIのレイテンシが保たれるかを計測する
+#             (起動中のサーバーに対して実行する。LLM_BACKEND=stub LLM_STUB_DELAY=2 で起動すると再現しやすい)
+#   startup : モジュールの import 時間と、uvicorn を起動してから最初のリクエストが返るまでの時間を計測する
+#             (サーバーは自分で起動する。--database-url を省略すると一時SQLiteを使う)
+#   throughput : DB_ASYNC=true / false それぞれでサーバーを起動し、高い同時接続数での requests/sec を比べる
+#             (同じく自分で起動する。Cloud SQL 相当の待ち時間を見るなら --database-url に検証用のMySQLを指定する)
+#   related : 商品ベクトルの近傍検索 (関連商品) の queries/sec を、既定 10万件の合成データで計測する (サーバー不要)
+#   search : 商品検索の転置インデックスと LIKE '%語%' の全件走査のレイテンシを比べる (一時SQLiteに既定 10万件を作る)
+#   recommend : おすすめ順の各段 (候補生成 / ランキング / 並べ替え / 読み込み) の所要時間を商品数を変えて計測する
+#             (商品数に関係なく一定になることの確認。一時SQLiteを使う)
+#   serialize : 商品一覧 (既定 1,000件) のJSON化にかかる時間とサイズを、返し方ごとに比べる (サーバー不要)
+#   artifact : 学習済みファイルの pickle 形式と npy 形式 (mmap) の読み込み時間・メモリを、ワーカー数を変えて比べる
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+
+def _summary(latencies):
+    if not latencies:
+        return "n=0"
+    ms = np.array(latencies) * 1000
+    return f"n={len(ms)} p50={np.percentile(ms, 50):.1f}ms p95={np.percentile(ms, 95):.1f}ms max={ms.max():.1f}ms"
+
+
+def _probe(url, count, interval):
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        requests.get(url, timeout=60)
+        latencies.append(time.perf_counter() - started)
+        time.sleep(interval)
+    return latencies
+
+
+def cmd_analyze(args):
+    base = args.base_url.rstrip("/")
+    probe_url = base + args.probe_path
+
+    print(f"ベースライン: {probe_url}")
+    print("  " + _summary(_probe(probe_url, args.probes, args.probe_interval)))
+
+    stop = threading.Event()
+    analyze_latencies = []
+    lock = threading.Lock()
+
+    def flood():
+        while not stop.is_set():
+            # 毎回違う入力にしてキャッシュに当たらないようにする
+            body = {"item_name": f"bench {uuid.uuid4()}", "item_description": "benchmark", "existing_channels": []}
+            started = time.perf_counter()
+            try:
+                requests.post(base + "/api/ai/analyze_item", json=body, timeout=120)
+            except requests.RequestException:
+                continue
+            with lock:
+                analyze_latencies.append(time.perf_counter() - started)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for _ in range(args.concurrency):
+            pool.submit(flood)
+        time.sleep(args.warmup)
+        print(f"analyze_item を {args.concurrency} 並列で実行中: {probe_url}")
+        print("  " + _summary(_probe(probe_url, args.probes, args.probe_interval)))
+        stop.set()
+    print(f"analyze_item: {_summary(analyze_latencies)}")
+
+
+def _import_seconds(module, env):
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def cmd_startup(args):
+    env = dict(os.environ)
+    env["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/benchmark_startup.db"
+    env.setdefault("LLM_BACKEND", "stub")
+
+    for module in args.modules:
+        samples = [_import_seconds(module, env) for _ in range(args.repeat)]
+        print(f"import {module}: {_summary(samples)}")
+
+    base = f"http://127.0.0.1:{args.port}"
+    for run in range(args.repeat):
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            # 応答が返るまでポーリング (= 起動完了までの時間)
+            while True:
+                if server.poll() is not None:
+                    raise RuntimeError("uvicorn が起動直後に終了しました")
+                try:
+                    requests.get(base + args.ready_path, timeout=5)
+                    break
+                except requests.ConnectionError:
+                    time.sleep(0.02)
+            ready = time.perf_counter() - started
+            line = f"起動 {run + 1}: 受付開始まで {ready * 1000:.0f}ms"
+            for path in args.paths:
+                t = time.perf_counter()
+                requests.get(base + path, timeout=120)
+                line += f" / 最初の {path} {(time.perf_counter() - t) * 1000:.0f}ms"
+            print(line)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def _start_server(env, port, ready_path):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    while True:
+        if server.poll() is not None:
+            raise RuntimeError("uvicorn が起動直後に終了しました")
+        try:
+            requests.get(f"http://127.0.0.1:{port}{ready_path}", timeout=5)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.05)
+
+
+def _seed_items(database_url, n_items):
+    """ベンチマーク用の商品を作る (既にあれば作らない)"""
+    os.environ["DATABASE_URL"] = database_url
+    from database import SessionLocal
+    from models import User, Channel, Item, init_db
+    init_db()
+    db = SessionLocal()
+    try:
+        if db.query(Item.id).first() is not None:
+            return
+        user = User(username="benchmark_user")
+        db.add(user)
+        db.flush()
+        channel = Channel(user_id=user.id, name="benchmark")
+        db.add(channel)
+        db.flush()
+        db.add_all([Item(channel_id=channel.id, title=f"bench item {i}", description="benchmark", price=1000 + i,
+                         category_code="other", image_data="https://example.com/item.jpg")
+                    for i in range(n_items)])
+        db.commit()
+    finally:
+        db.close()
+
+
+def cmd_throughput(args):
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/benchmark_throughput.db"
+    _seed_items(database_url, args.items)
+    env = dict(os.environ, DATABASE_URL=database_url, LLM_BACKEND="stub", MODEL_PRELOAD="1")
+    base = f"http://127.0.0.1:{args.port}"
+
+    for mode in args.modes:
+        server = _start_server(dict(env, DB_ASYNC=mode), args.port, "/api/metrics")
+        try:
+            for path in args.paths: # 初回の読み込み (モデル等) を計測に含めない
+                requests.get(base + path, timeout=120)
+            stop = threading.Event()
+            latencies, errors = [], [0]
+            lock = threading.Lock()
+
+            def client(n):
+                session = requests.Session()
+                local = []
+                while not stop.is_set():
+                    path = args.paths[n % len(args.paths)]
+                    n += 1
+                    started = time.perf_counter()
+                    try:
+                        ok = session.get(base + path, timeout=60).status_code < 500
+                    except requests.RequestException:
+                        ok = False
+                    if ok:
+                        local.append(time.perf_counter() - started)
+                    else:
+                        with lock:
+                            errors[0] += 1
+                with lock:
+                    latencies.extend(local)
+
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                for i in range(args.concurrency):
+                    pool.submit(client, i)
+                time.sleep(args.duration)
+                stop.set()
+            stats = requests.get(base + "/api/metrics", timeout=10).json()
+            pool_stats = stats.get("db_async_pool") or stats.get("db_pool")
+            print(f"DB_ASYNC={mode}: {len(latencies) / args.duration:.0f} req/s / エラー {errors[0]} / {_summary(latencies)}"
+                  f" / プール待ち max {pool_stats.get('wait_max_ms')}ms")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def _feed_rows(n_items):
+    """get_items が返すのと同じ形の辞書を作る"""
+    return [{
+        "id": i,
+        "title": f"ヴィンテージ デニムジャケット サイズM {i}",
+        "description": "数回着用しました。目立った傷や汚れはありません。" * 3,
+        "price": 1000 + i,
+        "image_data": f"https://api.example.com/api/items/{i}/image",
+        "thumbnail_url": f"https://api.example.com/api/items/{i}/image?size=thumb",
+        "status": "on_sale",
+        "category_code": "mens_jacket",
+        "category_name": "メンズ ジャケット",
+        "seller_id": i % 100,
+        "seller_name": f"user_{i % 100}",
+        "channel_id": i % 100,
+        "channel_name": f"channel_{i % 100}",
+    } for i in range(n_items)]
+
+
+SEARCH_BRANDS = ["ナイキ", "アディダス", "ユニクロ", "無印良品", "Apple", "ソニー", "任天堂", "ZARA", "GU", "コーチ", "シャネル", "ニューバランス"]
+SEARCH_KINDS = ["スニーカー", "ダウンジャケット", "Tシャツ", "iPhone ケース", "ヘッドホン", "ゲームソフト", "トートバッグ", "腕時計",
+                "ワンピース", "デニムパンツ", "キャップ", "リュック"]
+SEARCH_QUERIES = ["ナイキ", "ダウンジャケット", "iphone ケース", "ソニー ヘッドホン", "ニューバランス 574", "腕時計", "箱付き", "限定モデル"]
+
+
+def _seed_search_items(database_url, n_items):
+    from sqlalchemy import insert
+    from database import make_engine
+    from models import User, Channel, Item, init_db
+    engine = make_engine(database_url)
+    init_db(bind=engine)
+    rng = np.random.default_rng(0)
+    categories = ["mens_shoes", "womens_tops", "smartphone_case", "audio", "game", "bags", "watch", "other"]
+    with engine.begin() as conn:
+        if conn.execute(Item.__table__.select().limit(1)).first() is not None:
+            return
+        user_id = conn.execute(insert(User), {"username": "search_benchmark"}).inserted_primary_key[0]
+        channel_id = conn.execute(insert(Channel), {"user_id": user_id, "name": "search"}).inserted_primary_key[0]
+        for start in range(0, n_items, 10000):
+            conn.execute(insert(Item), [{
+                "channel_id": channel_id,
+                "title": f"{rng.choice(SEARCH_BRANDS)} {rng.choice(SEARCH_KINDS)} {rng.integers(1, 1000)}",
+                "description": "数回使用しました。" + ("箱付きです。" if rng.random() < 0.1 else "") +
+                               ("限定モデル。" if rng.random() < 0.01 else "") + "目立った傷や汚れはありません。" * 3,
+                "price": int(rng.integers(300, 50000)),
+                "status": "on_sale" if rng.random() < 0.8 else "sold",
+                "category_code": str(rng.choice(categories)),
+            } for _ in range(start, min(start + 10000, n_items))])
+
+
+def cmd_search(args):
+    import resource
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/search_benchmark.db"
+    _seed_search_items(database_url, args.items)
+    from sqlalchemy.orm import Session
+    from database import make_engine
+    from search_index import SearchIndex, like_search
+
+    db = Session(make_engine(database_url))
+    try:
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        index = SearchIndex()
+        index.load(db)
+        build_sec = time.perf_counter() - started
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(f"{len(index)}件: インデックス作成 {build_sec:.1f}秒 / ポスティング等 {index.nbytes / 1e6:.1f}MB"
+              f" / 最大RSSの増加 {(rss_after - rss_before) / 1024:.0f}MB")
+
+        filters = [{}, {"max_price": 5000}, {"category_code": "mens_shoes"}]
+        for name, run in (
+            ("転置インデックス", lambda q, f: index.search(q, limit=50, **f)),
+            ("LIKE 全件走査", lambda q, f: db.execute(like_search(q, **f).limit(50)).all()),
+        ):
+            latencies = []
+            for q in SEARCH_QUERIES:
+                for f in filters:
+                    for _ in range(args.repeat):
+                        started = time.perf_counter()
+                        run(q, f)
+                        latencies.append(time.perf_counter() - started)
+            print(f"  {name}: {_summary(latencies)}")
+    finally:
+        db.close()
+
+
+def cmd_recommend(args):
+    import asyncio
+    from sqlalchemy import insert, select
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from database import make_engine, make_async_engine
+    from models import User, UserCategoryAffinity
+    import main
+
+    rec_model, rec_index = main.get_recommender()
+    tmpdir = tempfile.mkdtemp()
+
+    async def measure(database_url, user_id):
+        engine = make_async_engine(database_url)
+        try:
+            async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+                latencies, stages = [], {}
+                for n in range(args.repeat + 1):
+                    timings = {}
+                    started = time.perf_counter()
+                    await main.build_items_page(db, "recommend", user_id, args.limit, None, timings)
+                    if n == 0:
+                        continue # 1回目は接続・キャッシュの準備を含むので除く
+                    latencies.append(time.perf_counter() - started)
+                    for stage, ms in timings.items():
+                        stages.setdefault(stage, []).append(ms)
+                return latencies, stages
+        finally:
+            await engine.dispose()
+
+    for n_items in args.sizes:
+        database_url = f"sqlite:///{tmpdir}/recommend_{n_items}.db"
+        _seed_search_items(database_url, n_items)
+        with make_engine(database_url).begin() as conn:
+            user_id = conn.execute(select(User.id).where(User.username == "search_benchmark")).scalar_one()
+            # いいね・閲覧の集計を持つユーザーとして計測する
+            conn.execute(insert(UserCategoryAffinity), [
+                {"user_id": user_id, "category_code": "mens_shoes", "like_count": 3, "view_count": 10},
+                {"user_id": user_id, "category_code": "watch", "like_count": 0, "view_count": 4},
+            ])
+        latencies, stages = asyncio.run(measure(database_url, user_id))
+        stage_text = " / ".join(f"{stage} {np.median(ms):.1f}ms" for stage, ms in stages.items())
+        print(f"{n_items}件: {_summary(latencies)} ({stage_text})")
+
+
+def cmd_serialize(args):
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, ORJSONResponse
+    from pydantic import TypeAdapter
+    from schemas import FeedItem
+    import main
+
+    rows = _feed_rows(args.items)
+    feed_adapter = TypeAdapter(list[FeedItem])
+    card = main.select_fields(FeedItem, None, "card")
+    cases = {
+        "dict + jsonable_encoder + json (変更前)": lambda: JSONResponse(jsonable_encoder(rows)).body,
+        "response_model 検証 + json": lambda: JSONResponse(feed_adapter.dump_python(feed_adapter.validate_python(rows), mode="json")).body,
+        "dict + orjson": lambda: ORJSONResponse(rows).body,
+        "view=card + orjson": lambda: ORJSONResponse(main.project(rows, card)).body,
+        "fields=id,title,price + orjson": lambda: ORJSONResponse(main.project(rows, ["id", "title", "price"])).body,
+    }
+    print(f"{args.items}件 / {args.repeat}回の中央値")
+    for name, render in cases.items():
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            body = render()
+            timings.append(time.perf_counter() - started)
+        print(f"  {name}: {np.median(timings) * 1000:.2f}ms / {len(body) / 1024:.1f}KB")
+
+
+# ワーカー1つ分: 読み込んで全ページに触れてから、標準入力が閉じられるまで待つ
+_ARTIFACT_WORKER = """
+import json, sys, time
+import numpy as np
+from recommender import load_artifact, PreferenceIndex
+
+def memory():
+    kb = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                kb[parts[0][:-1]] = int(parts[1])
+    return kb
+
+before = memory()
+started = time.perf_counter()
+model, index, _ = load_artifact(sys.argv[1])
+loaded = time.perf_counter() - started
+for name in PreferenceIndex.ARRAYS:
+    np.asarray(getattr(index, name)).sum() # 配列の全ページを読み込ませる (使い続けた状態)
+index.user_scores(int(index.user_ids[len(index.user_ids) // 2]))
+after = memory()
+print(json.dumps({"load_ms": loaded * 1000, "rss_mb": (after["Rss"] - before["Rss"]) / 1024}), flush=True)
+sys.stdin.read()
+"""
+
+
+def _pss_mb(pid):
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def cmd_artifact(args):
+    import json
+    from recommender import export
+
+    out_dir = tempfile.mkdtemp()
+    npy_path, index = export(args.src, os.path.join(out_dir, "recommender"))
+    print(f"{args.src}: {os.path.getsize(args.src) / 1e6:.1f}MB / npy: "
+          f"{sum(os.path.getsize(os.path.join(npy_path, f)) for f in os.listdir(npy_path)) / 1e6:.1f}MB ({len(index)}件)")
+
+    for name, path in (("pickle", args.src), ("npy", os.path.join(out_dir, "recommender"))):
+        for workers in args.workers:
+            procs = [subprocess.Popen([sys.executable, "-c", _ARTIFACT_WORKER, path], stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+                     for _ in range(workers)]
+            try:
+                results = [json.loads(p.stdout.readline()) for p in procs]
+                # 全ワーカーが読み込んだ状態での PSS (共有ページはワーカー数で割って数える) の合計
+                pss = sum(_pss_mb(p.pid) for p in procs)
+            finally:
+                for p in procs:
+                    p.stdin.close()
+                    p.wait()
+            load_ms = [r["load_ms"] for r in results]
+            rss = [r["rss_mb"] for r in results]
+            print(f"{name} x{workers}: 読み込み p50 {np.median(load_ms):.0f}ms / 1ワーカーの増分RSS {np.median(rss):.1f}MB"
+                  f" / 全ワーカーのPSS合計 {pss:.0f}MB")
+
+
+def cmd_related(args):
+    from item_embeddings import EmbeddingIndex, embed, encode_vector, decode_vector
+
+    rng = np.random.default_rng(0)
+    brands = ["ナイキ", "アディダス", "ユニクロ", "無印良品", "Apple", "ソニー", "任天堂", "ZARA", "GU", "コーチ"]
+    kinds = ["スニーカー", "ダウンジャケット", "Tシャツ", "iPhone ケース", "ヘッドホン", "ゲームソフト", "トートバッグ", "腕時計"]
+    titles = [f"{rng.choice(brands)} {rng.choice(kinds)} {rng.integers(1, 1000)} サイズ{rng.choice(['S', 'M', 'L'])}"
+              for _ in range(args.items)]
+
+    started = time.perf_counter()
+    vectors = [embed(title, "数回使用しました。目立った傷はありません。") for title in titles]
+    embed_sec = time.perf_counter() - started
+    stored = [encode_vector(vec) for vec in vectors]
+    started = time.perf_counter()
+    decoded = [decode_vector(text) for text in stored]
+    decode_sec = time.perf_counter() - started
+
+    index = EmbeddingIndex()
+    started = time.perf_counter()
+    index.add_many(np.arange(1, args.items + 1), decoded)
+    build_sec = time.perf_counter() - started
+    print(f"{args.items}件: ベクトル計算 {args.items / embed_sec:.0f}件/秒 / 保存形式から復元 {decode_sec:.2f}秒"
+          f" / 行列の構築 {build_sec:.2f}秒 / {index.nbytes / 1e6:.1f}MB (1件 {len(stored[0])}文字)")
+
+    queries = rng.integers(0, args.items, size=args.queries)
+    latencies = []
+    for q in queries:
+        started = time.perf_counter()
+        index.neighbors(vectors[q], args.k, exclude=int(q) + 1)
+        latencies.append(time.perf_counter() - started)
+    print(f"neighbors(k={args.k}): {len(latencies) / sum(latencies):.0f} queries/sec / {_summary(latencies)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="性能計測")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("analyze", help="analyze_item 実行中の他APIのレイテンシ")
+    p.add_argument("--base-url", default="http://localhost:8080")
+    p.add_argument("--concurrency", type=int, default=32, help="同時に投げる analyze_item の数")
+    p.add_argument("--probe-path", default="/api/metrics")
+    p.add_argument("--probes", type=int, default=50)
+    p.add_argument("--probe-interval", type=float, default=0.05)
+    p.add_argument("--warmup", type=float, default=1.0)
+    p.set_defaults(func=cmd_analyze)
+
+    p = sub.add_parser("startup", help="import時間 / 起動から最初のリクエストまでの時間")
+    p.add_argument("--database-url", default=None)
+    p.add_argument("--modules", nargs="+", default=["models", "main"])
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--ready-path", default="/api/metrics")
+    p.add_argument("--paths", nargs="+", default=["/api/items?sort=recommend", "/api/items?sort=new"])
+    p.set_defaults(func=cmd_startup)
+
+    p = sub.add_parser("throughput", help="DB_ASYNC=true / false の requests/sec 比較")
+    p.add_argument("--database-url", default=None)
+    p.add_argument("--modes", nargs="+", default=["true", "false"])
+    p.add_argument("--items", type=int, default=2000, help="一時DBに作る商品数")
+    p.add_argument("--concurrency", type=int, default=64, help="同時接続数")
+    p.add_argument("--duration", type=float, default=10.0, help="計測秒数")
+    p.add_argument("--port", type=int, default=8766)
+    p.add_argument("--paths", nargs="+", default=["/api/items?sort=new&limit=20", "/api/items/1/related", "/api/users/1/items"])
+    p.set_defaults(func=cmd_throughput)
+
+    p = sub.add_parser("related", help="関連商品 (ベクトル近傍検索) の queries/sec")
+    p.add_argument("--items", type=int, default=100000)
+    p.add_argument("--queries", type=int, default=500)
+    p.add_argument("-k", type=int, default=3)
+    p.set_defaults(func=cmd_related)
+
+    p = sub.add_parser("search", help="商品検索: 転置インデックスと LIKE 走査の比較")
+    p.add_argument("--database-url", default=None, help="省略時は一時SQLite (既にデータがあれば作らない)")
+    p.add_argument("--items", type=int, default=100000)
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=cmd_search)
+
+    p = sub.add_parser("recommend", help="おすすめ順の各段の所要時間 (商品数ごと)")
+    p.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000])
+    p.add_argument("--repeat", type=int, default=20)
+    p.add_argument("--limit", type=int, default=50)
+    p.set_defaults(func=cmd_recommend)
+
+    p = sub.add_parser("artifact", help="学習済みファイル: pickle と npy (mmap) の読み込み時間・メモリ")
+    p.add_argument("--src", default="recommender.pkl", help="比べる pickle 形式のファイル (npy 形式は一時ディレクトリに変換して作る)")
+    p.add_argument("--workers", nargs="+", type=int, default=[1, 4])
+    p.set_defaults(func=cmd_artifact)
+
+    p = sub.add_parser("serialize", help="一覧のJSON化の時間とサイズ")
+    p.add_argument("--items", type=int, default=1000)
+    p.add_argument("--repeat", type=int, default=50)
+    p.set_defaults(func=cmd_serialize)
+
+    args = parser.parse_args()
+    args.func(args)
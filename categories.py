@@ -0,0 +1,77 @@
+# hackathon-backend/categories.py
+# カテゴリの定義 (DB・LLM・学習済みモデルに依存しないので、どこから import しても軽い)
+
+# --- カテゴリ定義 (内部コード: 日本語表示名) ---
+CATEGORY_TRANSLATION = {
+    # --- 既存互換（レコメンドが効くエリア） ---
+    "accessories.bag": "バッグ",
+    "accessories.wallet": "財布・小物",
+    "apparel.costume": "コスプレ・衣装",
+    "apparel.dress": "ドレス・ワンピース",
+    "apparel.jacket": "ジャケット・アウター",
+    "apparel.jeans": "デニム・ジーンズ",
+    "apparel.shirt": "シャツ・ブラウス",
+    "apparel.shoes": "靴・シューズ",
+    "apparel.shoes.sneakers": "スニーカー", # 既存リストに合わせて調整
+    "apparel.tshirt": "Tシャツ・カットソー",
+    "appliances.environment.air_conditioner": "エアコン",
+    "appliances.kitchen.coffee_machine": "コーヒーメーカー",
+    "appliances.kitchen.microwave": "電子レンジ",
+    "appliances.kitchen.refrigerators": "冷蔵庫",
+    "appliances.personal.hair_dryer": "ドライヤー",
+    "appliances.personal.massager": "美容・健康家電", # 簡潔に
+    "computers.notebook": "ノートPC",
+    "computers.peripherals.monitor": "モニター",
+    "electronics.audio.headphone": "ヘッドフォン",
+    "electronics.audio.earphone": "イヤホン",
+    "electronics.camera.photo": "カメラ",
+    "electronics.smartphone": "スマートフォン",
+    "electronics.tablet": "タブレット",
+    "electronics.video.tv": "テレビ",
+    "furniture.living_room.sofa": "ソファ",
+    "furniture.living_room.table": "テーブル",
+    "kids.toys": "おもちゃ",
+    "sport.bicycle": "自転車",
+    
+    # --- ★新規拡充エリア（ここから下を追加） ---
+    
+    # エンタメ・ホビー
+    "hobby.idol_goods": "アイドルグッズ",
+    "hobby.anime_goods": "アニメ・コミックグッズ",
+    "hobby.trading_cards": "トレーディングカード",
+    "hobby.figures": "フィギュア",
+    "hobby.musical_instruments": "楽器・機材",
+    "hobby.art": "美術品・アート",
+    
+    # 書籍・メディア
+    "books.comic": "漫画・コミック",
+    "books.novel": "小説・文学",
+    "books.business": "ビジネス・経済",
+    "books.study_guide": "参考書・学習本",
+    "books.magazine": "雑誌",
+    "media.cd": "CD",
+    "media.dvd_bluray": "DVD/Blu-ray",
+    "media.game_software": "ゲームソフト",
+    "media.game_console": "ゲーム機本体",
+
+    # メンズ・レディース詳細
+    "fashion.mens.tops": "メンズトップス",
+    "fashion.mens.bottoms": "メンズパンツ",
+    "fashion.ladies.tops": "レディーストップス",
+    "fashion.ladies.skirt": "スカート",
+    
+    # その他
+    "tickets": "チケット",
+    "food": "食品・お菓子",
+    "handmade": "ハンドメイド",
+    "other": "その他"
+}
+
+
+def load_category_master(path="category_list.txt"):
+    """学習データ側のカテゴリ一覧 (recommender.pkl の prefs に出てくるコード)"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f.readlines() if line.strip()]
+    except OSError:
+        return []
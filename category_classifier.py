@@ -0,0 +1,192 @@
+# hackathon-backend/category_classifier.py
+# 商品名 -> カテゴリコード のローカル分類器 (文字n-gram TF-IDF + ロジスティック回帰)
+# 確信度が低いときだけ LLM に聞く、の一段目として使う。
+#
+# 使い方:
+#   python category_classifier.py train      # DBの items.title -> category_code で学習して保存
+#   python category_classifier.py evaluate   # ホールドアウトで精度 / LLM呼び出し率 / レイテンシを計測
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+# sklearn / joblib は重いので学習・読み込みのときだけ import する
+CLASSIFIER_PATH = "category_classifier.pkl"
+
+
+class LocalCategoryClassifier:
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.classes = list(pipeline.classes_)
+        # 1件ずつの推定は sklearn の入力チェック等が重いので、係数を直接使う
+        vectorizer, model = pipeline[0], pipeline[-1]
+        self._analyze = vectorizer.build_analyzer()
+        self._vocabulary = vectorizer.vocabulary_
+        self._idf = vectorizer.idf_
+        self._coef = np.ascontiguousarray(model.coef_.T)
+        self._intercept = model.intercept_
+
+    @classmethod
+    def train(cls, titles, labels):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.pipeline import make_pipeline
+        pipeline = make_pipeline(
+            # 日本語は分かち書きしないので文字n-gramで特徴量を作る
+            TfidfVectorizer(analyzer="char_wb", ngram_range=(1, 3), sublinear_tf=True, min_df=1),
+            LogisticRegression(max_iter=1000, C=10.0),
+        )
+        pipeline.fit(list(titles), list(labels))
+        return cls(pipeline)
+
+    @classmethod
+    def load(cls, path=CLASSIFIER_PATH):
+        import joblib
+        return cls(joblib.load(path))
+
+    def save(self, path=CLASSIFIER_PATH):
+        import joblib
+        joblib.dump(self.pipeline, path)
+
+    def predict(self, title):
+        """(カテゴリコード, 確信度) を返す (predict_many と同じ結果を数十μsで)"""
+        counts = Counter(i for i in map(self._vocabulary.get, self._analyze(title)) if i is not None)
+        scores = self._intercept.copy()
+        if counts:
+            idx = np.fromiter(counts.keys(), dtype=np.intp, count=len(counts))
+            tf = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+            # sublinear_tf + idf + L2正規化 (TfidfVectorizer と同じ計算)
+            values = (1.0 + np.log(tf)) * self._idf[idx]
+            values /= np.sqrt((values * values).sum())
+            scores = scores + values @ self._coef[idx]
+        if len(self.classes) == 2:
+            p = 1.0 / (1.0 + np.exp(-scores[0]))
+            probs = np.array([1.0 - p, p])
+        else:
+            scores = np.exp(scores - scores.max())
+            probs = scores / scores.sum()
+        best = int(probs.argmax())
+        return self.classes[best], float(probs[best])
+
+    def predict_many(self, titles):
+        probs = self.pipeline.predict_proba(list(titles))
+        best = probs.argmax(axis=1)
+        return [(self.classes[i], float(probs[n, i])) for n, i in enumerate(best)]
+
+
+_shared = None
+_shared_loaded = False
+_shared_lock = threading.Lock()
+
+
+def get_classifier(path=CLASSIFIER_PATH):
+    """アプリ共通の分類器を最初に呼ばれたときに読み込んで返す (無ければ None = LLMのみで分類)"""
+    global _shared, _shared_loaded
+    if not _shared_loaded:
+        with _shared_lock:
+            if not _shared_loaded:
+                try:
+                    _shared = LocalCategoryClassifier.load(path)
+                    print(f"カテゴリ分類器読み込み完了 ✅ ({len(_shared.classes)}カテゴリ)")
+                except Exception as e:
+                    print(f"カテゴリ分類器なし (LLMのみで分類します): {e}")
+                _shared_loaded = True
+    return _shared
+
+
+def training_pairs(db, Item, categories):
+    """DBの分類済み商品 + カテゴリの表示名 (コールドスタート用) を学習データにする"""
+    titles, labels = [], []
+    rows = db.query(Item.title, Item.category_code) \
+             .filter(Item.category_code.in_(list(categories))) \
+             .yield_per(1000)
+    for title, code in rows:
+        if title:
+            titles.append(title)
+            labels.append(code)
+    for code, name in categories.items():
+        titles.append(name)
+        labels.append(code)
+    return titles, labels
+
+
+def _percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000) if samples else 0.0
+
+
+def _load_training_pairs():
+    from categories import CATEGORY_TRANSLATION
+    from database import SessionLocal
+    from models import Item
+    db = SessionLocal()
+    try:
+        return training_pairs(db, Item, CATEGORY_TRANSLATION)
+    finally:
+        db.close()
+
+
+def cmd_train(args):
+    titles, labels = _load_training_pairs()
+    started = time.perf_counter()
+    clf = LocalCategoryClassifier.train(titles, labels)
+    clf.save(args.output)
+    print(f"学習完了 ✅ {len(titles)}件 / {len(clf.classes)}カテゴリ ({time.perf_counter() - started:.1f}秒) -> {args.output}")
+
+
+def cmd_evaluate(args):
+    titles, labels = _load_training_pairs()
+
+    pairs = list(zip(titles, labels))
+    random.Random(args.seed).shuffle(pairs)
+    n_test = max(1, int(len(pairs) * args.test_ratio))
+    test, train = pairs[:n_test], pairs[n_test:]
+    clf = LocalCategoryClassifier.train([t for t, _ in train], [l for _, l in train])
+
+    # --- ローカル分類器のみ ---
+    latencies, predictions = [], []
+    for title, _ in test:
+        started = time.perf_counter()
+        predictions.append(clf.predict(title))
+        latencies.append(time.perf_counter() - started)
+    correct = [code == label for (code, _), (_, label) in zip(predictions, test)]
+    print(f"テスト件数: {len(test)} (学習 {len(train)})")
+    print(f"ローカル分類器: 正解率 {np.mean(correct):.3f} / p50 {_percentile_ms(latencies, 50):.3f}ms / p95 {_percentile_ms(latencies, 95):.3f}ms")
+
+    # --- しきい値ごとの LLM 呼び出し率 (確信度 < しきい値 は LLM に回す) ---
+    for threshold in args.thresholds:
+        confident = [conf >= threshold for _, conf in predictions]
+        local_acc = np.mean([c for c, ok in zip(correct, confident) if ok]) if any(confident) else float("nan")
+        print(f"  しきい値 {threshold:.2f}: LLM呼び出し率 {1 - np.mean(confident):.3f} / ローカル回答分の正解率 {local_acc:.3f}")
+
+    # --- LLMのみの現行経路 (クォータを使うので件数を絞る) ---
+    if args.llm_sample:
+        import main
+        sample = list(zip(test, predictions))[:args.llm_sample]
+        llm_latencies, llm_correct, hybrid_correct = [], [], []
+        for (title, label), (code, conf) in sample:
+            started = time.perf_counter()
+            llm_code = main.predict_category_code_llm(title)
+            llm_latencies.append(time.perf_counter() - started)
+            llm_correct.append(llm_code == label)
+            hybrid_correct.append((code if conf >= main.CATEGORY_CONFIDENCE_THRESHOLD else llm_code) == label)
+        print(f"LLMのみ ({len(sample)}件): 正解率 {np.mean(llm_correct):.3f} / p50 {_percentile_ms(llm_latencies, 50):.1f}ms / p95 {_percentile_ms(llm_latencies, 95):.1f}ms")
+        print(f"ローカル+LLM (しきい値 {main.CATEGORY_CONFIDENCE_THRESHOLD}): 正解率 {np.mean(hybrid_correct):.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="カテゴリ分類器の学習 / 評価")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_train = sub.add_parser("train", help="DBの商品で学習して保存する")
+    p_train.add_argument("--output", default=CLASSIFIER_PATH)
+    p_train.set_defaults(func=cmd_train)
+    p_eval = sub.add_parser("evaluate", help="ホールドアウトで評価する")
+    p_eval.add_argument("--test-ratio", type=float, default=0.2)
+    p_eval.add_argument("--seed", type=int, default=0)
+    p_eval.add_argument("--thresholds", type=float, nargs="+", default=[0.3, 0.5, 0.6, 0.7, 0.9])
+    p_eval.add_argument("--llm-sample", type=int, default=0, help="LLMのみの経路と比較する件数 (0なら比較しない)")
+    p_eval.set_defaults(func=cmd_evaluate)
+    args = parser.parse_args()
+    args.func(args)
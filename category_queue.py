@@ -0,0 +1,135 @@
+# hackathon-backend/category_queue.py
+# 出品時のカテゴリ推定をバックグラウンドで行うキュー (asyncio + 同時実行数の上限つき)
+import asyncio
+import threading
+import time
+
+
+class CategoryQueue:
+    """(item_id, 商品名) を受け取り、classify で推定して store で保存する
+
+    - classify / store は同期関数 (スレッドで実行する)
+    - 同時に走る推定は concurrency 件まで
+    - 失敗したら retry_delay * 2^n 秒後に max_retries 回まで再試行し、
+      それでもダメなら fallback のカテゴリを保存する
+    - stop() のときは再試行待ちの分もすぐキューに戻し、それ以上は再試行せずに処理し切る
+    - submit はスレッドセーフ (同期エンドポイントから呼べる)
+    """
+
+    def __init__(self, classify, store, concurrency=4, maxsize=1000, max_retries=3, retry_delay=1.0, fallback="other"):
+        self._classify = classify
+        self._store = store
+        self.concurrency = concurrency
+        self.maxsize = maxsize
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.fallback = fallback
+        self._loop = None
+        self._queue = None
+        self._workers = []
+        self._retries = {} # (item_id, attempt) -> (call_later のハンドル, 商品名)
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._started_at = None
+        self._counters = {"submitted": 0, "rejected": 0, "succeeded": 0, "failed": 0, "retried": 0, "dropped": 0}
+        self._latency_total = 0.0
+
+    @property
+    def running(self):
+        return self._loop is not None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._started_at = time.time()
+        self._stopping = False
+        self._workers = [self._loop.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self, timeout=10.0):
+        if not self.running:
+            return
+        # 残っている分はできるだけ処理してから止める。再試行待ちの分は待たずにキューへ戻す (これが最後の試行)
+        # 以降の submit は False を返す (呼び出し側でその場で推定する)
+        with self._lock:
+            self._stopping = True
+        for (item_id, attempt), (handle, text) in list(self._retries.items()):
+            handle.cancel()
+            self._retry_now(item_id, text, attempt)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._counters["dropped"] += self._pending
+            print(f"カテゴリ推定キュー: {self._pending}件を残して停止します (カテゴリは未設定のまま。migrate.py で埋められます)")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        with self._lock:
+            self._loop = None
+
+    def submit(self, item_id, text):
+        """キューに積めたら True。停止中 / 満杯なら False (呼び出し側で同期処理する)"""
+        with self._lock:
+            if not self.running or self._stopping or self._pending >= self.maxsize:
+                self._counters["rejected"] += 1
+                return False
+            self._pending += 1
+            self._counters["submitted"] += 1
+            # ロックの中で積む (stop() が _loop を外すのと入れ違いにならない)
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, (item_id, text, 0))
+        return True
+
+    async def _worker(self):
+        while True:
+            item_id, text, attempt = await self._queue.get()
+            try:
+                await self._process(item_id, text, attempt)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, item_id, text, attempt):
+        started = time.perf_counter()
+        try:
+            code = await asyncio.to_thread(self._classify, text)
+            await asyncio.to_thread(self._store, item_id, code)
+        except Exception as e:
+            if attempt < self.max_retries and not self._stopping:
+                self._count("retried")
+                delay = self.retry_delay * (2 ** attempt)
+                # 待っている間はワーカーを塞がない。stop() で取り消せるようにハンドルを持っておく
+                handle = self._loop.call_later(delay, self._retry_now, item_id, text, attempt + 1)
+                self._retries[(item_id, attempt + 1)] = (handle, text)
+                return
+            print(f"Category Queue Error (item {item_id}): {e}")
+            self._count("failed")
+            try:
+                await asyncio.to_thread(self._store, item_id, self.fallback)
+            except Exception as store_error:
+                print(f"Category Queue Store Error (item {item_id}): {store_error}")
+        else:
+            self._count("succeeded")
+            with self._lock:
+                self._latency_total += time.perf_counter() - started
+        with self._lock:
+            self._pending -= 1
+
+    def _retry_now(self, item_id, text, attempt):
+        self._retries.pop((item_id, attempt), None)
+        self._queue.put_nowait((item_id, text, attempt))
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["pending"] = self._pending
+            done = stats["succeeded"]
+            stats["avg_latency_ms"] = round(self._latency_total / done * 1000, 1) if done else None
+        uptime = time.time() - self._started_at if self._started_at else 0
+        stats["throughput_per_min"] = round(stats["succeeded"] / uptime * 60, 2) if uptime else 0.0
+        stats["concurrency"] = self.concurrency
+        return stats
@@ -0,0 +1,131 @@
+# check_concurrency.py
+# 同時アクセスで壊れないかを確認するストレステスト (同時購入 / いいね・フォローの連打)
+# 使い方: python check_concurrency.py [--requests 20]
+# ローカルの一時SQLite (CHECK_DATABASE_URL で変更可) にデータを作り、
+# 同じ操作を複数のリクエスト (それぞれ別のセッション) から一斉に実行して結果を検証する。問題があれば終了コード1で終わる。
+# DB_ASYNC=true で非同期セッション側も確認できる。
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import warnings
+
+warnings.filterwarnings("ignore")
+
+_tmpdir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = os.getenv("CHECK_DATABASE_URL", f"sqlite:///{_tmpdir}/check_concurrency.db")
+
+from fastapi import HTTPException
+
+import main
+import database
+from database import SessionLocal, session_scope
+from models import User, Channel, Item, Like, ChannelFollow, UserCategoryAffinity, init_db
+
+
+async def run_parallel(n, func):
+    """func(i, db) を n 本同時に実行し、結果 (例外はそのまま) のリストを返す"""
+    barrier = asyncio.Barrier(n)
+
+    async def worker(i):
+        # 全員そろってから一斉に投げる (同期セッションは接続数までしか同時に開けないので、そろえるのはセッションを開く前)
+        await barrier.wait()
+        async with session_scope() as db:
+            return await func(i, db)
+
+    return await asyncio.gather(*(worker(i) for i in range(n)), return_exceptions=True)
+
+
+def setup():
+    db = SessionLocal()
+    try:
+        seller = User(username="check_seller")
+        db.add(seller)
+        db.flush()
+        channel = Channel(user_id=seller.id, name="check")
+        db.add(channel)
+        db.flush()
+        item = Item(channel_id=channel.id, title="check item", price=1000, status="on_sale", category_code="other")
+        db.add(item)
+        db.commit()
+        return item.id
+    finally:
+        db.close()
+
+
+async def check_purchase(item_id, n):
+    results = await run_parallel(n, lambda i, db: main.purchase_item(item_id, main.PurchaseRequest(user_id=1000 + i), db=db))
+    succeeded = [r for r in results if isinstance(r, dict)]
+    conflicts = [r for r in results if isinstance(r, HTTPException) and r.status_code == 409]
+    errors = [r for r in results if r not in succeeded and r not in conflicts]
+
+    db = SessionLocal()
+    try:
+        item = db.query(Item).filter(Item.id == item_id).one()
+        buyer_ok = item.status == "sold" and len(succeeded) == 1 and item.buyer_id == 1000 + results.index(succeeded[0])
+    finally:
+        db.close()
+    ok = len(succeeded) == 1 and len(conflicts) == n - 1 and not errors and buyer_ok
+    print(f"{'OK ' if ok else 'NG '} purchase_item x{n}: 成功 {len(succeeded)} / 409 {len(conflicts)} / その他 {len(errors)}")
+    for e in errors[:3]:
+        print(f"    {e!r}")
+    return ok
+
+
+def count_rows(model, **filters):
+    db = SessionLocal()
+    try:
+        return db.query(model).filter_by(**filters).count()
+    finally:
+        db.close()
+
+
+async def check_double_submit(item_id, n):
+    """同じ いいね / フォロー を同時に連打しても重複行ができないこと"""
+    ok = True
+    user_id, channel_id = 2000, 1
+    req = main.PurchaseRequest(user_id=user_id)
+
+    await run_parallel(n, lambda i, db: main.like_item(item_id, req, db=db))
+    likes = count_rows(Like, user_id=user_id, item_id=item_id)
+    db = SessionLocal()
+    try:
+        affinity = db.query(UserCategoryAffinity.like_count).filter_by(user_id=user_id, category_code="other").scalar()
+    finally:
+        db.close()
+    ok &= likes == 1 and affinity == 1
+    print(f"{'OK ' if likes == 1 and affinity == 1 else 'NG '} like_item x{n}: likes {likes}行 / like_count {affinity}")
+
+    await run_parallel(n, lambda i, db: main.follow_channel(channel_id, req, db=db))
+    follows = count_rows(ChannelFollow, user_id=user_id, channel_id=channel_id)
+    ok &= follows == 1
+    print(f"{'OK ' if follows == 1 else 'NG '} follow_channel x{n}: follows {follows}行")
+
+    # トグルの連打: 結果の状態は問わないが、重複行ができないこと
+    for name, toggle, model, filters in [
+        ("toggle_like", lambda i, db: main.toggle_like(item_id, req, db=db), Like, {"user_id": user_id, "item_id": item_id}),
+        ("toggle_channel_follow", lambda i, db: main.toggle_channel_follow(channel_id, req, db=db), ChannelFollow, {"user_id": user_id, "channel_id": channel_id}),
+    ]:
+        await run_parallel(2, toggle)
+        rows = count_rows(model, **filters)
+        ok &= rows <= 1
+        print(f"{'OK ' if rows <= 1 else 'NG '} {name} x2: {rows}行")
+    return ok
+
+
+async def run(n):
+    init_db()
+    item_id = setup()
+    try:
+        checks = [await check_purchase(item_id, n), await check_double_submit(item_id, n)]
+    finally:
+        await database.dispose_async_engine()
+    return all(checks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="同時アクセスのストレステスト")
+    parser.add_argument("--requests", type=int, default=20, help="同時に投げるリクエスト数")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.requests)) else 1)
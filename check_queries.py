@@ -0,0 +1,205 @@
+# check_queries.py
+# APIが発行するSQLの本数を数えるチェック (N+1 の再発検知用)
+# 使い方: python check_queries.py [--explain]
+# ローカルの一時SQLiteにデータを作って各エンドポイントを直接呼び出し、
+# 発行されたSQL文の数が上限を超えたら終了コード1で終わる。
+# --explain を付けると各SQLの実行計画を調べ、フルスキャンがあっても終了コード1にする。
+# MySQLで確認するときは CHECK_DATABASE_URL に使い捨てのDBを指定する (データを書き込むので本番には向けないこと)。
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import warnings
+
+warnings.filterwarnings("ignore")
+
+_tmpdir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = os.getenv("CHECK_DATABASE_URL", f"sqlite:///{_tmpdir}/check_queries.db")
+
+from fastapi import Response
+from sqlalchemy import event
+
+import main
+import rebuild_affinity
+import database
+from database import SessionLocal, session_scope
+from models import User, Channel, Item, Like, View, ChannelFollow, init_db
+
+N_USERS = 20
+N_ITEMS = 300
+
+# エンドポイントごとのSQL本数の上限 (アイテム数に依存しないこと)
+QUERY_BUDGETS = {
+    "get_items(new)": 1,
+    "get_items(new, cached)": 0,
+    "get_items(following)": 1,
+    "get_items(recommend, anonymous)": 2,
+    "get_items(recommend, anonymous, cached)": 0,
+    "get_items(recommend, user)": 4,
+    "get_user_likes": 1,
+    "get_user_items": 1,
+    "get_following_channels": 1,
+    "get_related": 2,
+    "search_items": 1,
+    "toggle_like": 4,
+    "toggle_channel_follow": 2,
+    "like_item": 3,
+    "unlike_item": 3,
+    "follow_channel": 1,
+    "unfollow_channel": 1,
+    "record_view": 3,
+    "purchase_item": 1,
+}
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, None if executemany else parameters))
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+def seed(db):
+    categories = list(main.CATEGORY_TRANSLATION)
+    users = [User(username=f"check_user_{i}") for i in range(N_USERS)]
+    db.add_all(users)
+    db.flush()
+    channels = [Channel(user_id=u.id, name=f"ch_{u.id}") for u in users]
+    db.add_all(channels)
+    db.flush()
+    items = [
+        Item(channel_id=channels[i % N_USERS].id, title=f"item {i}", description="desc", price=100 + i,
+             category_code=categories[i % len(categories)])
+        for i in range(N_ITEMS)
+    ]
+    db.add_all(items)
+    db.flush()
+    me = users[0]
+    db.add_all([Like(user_id=me.id, item_id=it.id) for it in items[::5]])
+    db.add_all([View(user_id=me.id, item_id=it.id) for it in items[::3]])
+    db.add_all([ChannelFollow(user_id=me.id, channel_id=ch.id) for ch in channels[::2]])
+    db.commit()
+    rebuild_affinity.rebuild(db)
+    return me.id
+
+
+async def _one(coro):
+    return [await coro]
+
+
+async def _rows(coro):
+    """一覧は Response (JSON本体) で返るので中身を取り出す"""
+    result = await coro
+    return json.loads(result.body) if isinstance(result, Response) else result
+
+
+def full_scans(statement, parameters):
+    """実行計画からフルスキャンしているテーブルを返す"""
+    if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+        return []
+    # 主キー降順 + LIMIT のキーセットは先頭から LIMIT 件読んで止まるので対象外
+    bounded = "ORDER BY items.id DESC" in statement and "LIMIT" in statement
+    scans = []
+    with main.engine.connect() as conn:
+        if main.engine.dialect.name == "sqlite":
+            for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters or ()):
+                detail = row[-1]
+                # SCAN anon_N は LIMIT 付きサブクエリ (おすすめの候補生成) の結果を読んでいるだけなので対象外
+                if detail.startswith("SCAN ") and "USING" not in detail and not (bounded and detail == "SCAN items") \
+                        and not detail.startswith("SCAN anon_"):
+                    scans.append(detail)
+        else:
+            result = conn.exec_driver_sql("EXPLAIN " + statement, parameters or ())
+            for row in result.mappings():
+                derived = (row["table"] or "").startswith(("<derived", "<union"))
+                if row["type"] == "ALL" and not (bounded and row["table"] == "items") and not derived:
+                    scans.append(f"{row['table']} (type=ALL)")
+    return scans
+
+
+def api_engine():
+    """APIのセッションが使うエンジン (DB_ASYNC なら非同期エンジンの同期側)"""
+    return database.get_async_engine().sync_engine if database.DB_ASYNC else main.engine
+
+
+async def run(explain=False):
+    init_db()
+    seed_db = SessionLocal()
+    try:
+        user_id = seed(seed_db)
+    finally:
+        seed_db.close()
+    # 起動時 (lifespan) と同じく先に読み込んでおく
+    main.get_embedding_index()
+    main.get_search_index()
+
+    try:
+        async with session_scope() as db:
+            return await check_calls(db, user_id, explain)
+    finally:
+        await database.dispose_async_engine()
+
+
+async def check_calls(db, user_id, explain):
+    def get_items(sort, user_id=None):
+        return main.get_items(sort=sort, user_id=user_id, limit=200, cursor=None, if_none_match=None, db=db)
+
+    main.feed_cache.invalidate()
+    calls = {
+        "get_items(new)": lambda: _rows(get_items(sort="new")),
+        "get_items(new, cached)": lambda: _rows(get_items(sort="new")),
+        "get_items(following)": lambda: _rows(get_items(sort="following", user_id=user_id)),
+        "get_items(recommend, anonymous)": lambda: _rows(get_items(sort="recommend")),
+        "get_items(recommend, anonymous, cached)": lambda: _rows(get_items(sort="recommend")),
+        "get_items(recommend, user)": lambda: _rows(get_items(sort="recommend", user_id=user_id)),
+        "get_user_likes": lambda: _rows(main.get_user_likes(user_id, db=db)),
+        "get_user_items": lambda: _rows(main.get_user_items(user_id, db=db)),
+        "get_following_channels": lambda: main.get_following_channels(user_id, db=db),
+        "get_related": lambda: main.get_related(1, db=db),
+        "search_items": lambda: _rows(main.search_items("item 1", category=None, min_price=None, max_price=None, include_sold=False,
+                                                        limit=50, cursor=None, db=db)),
+        "toggle_like": lambda: _one(main.toggle_like(2, main.PurchaseRequest(user_id=user_id), db=db)),
+        "toggle_channel_follow": lambda: _one(main.toggle_channel_follow(2, main.PurchaseRequest(user_id=user_id), db=db)),
+        "like_item": lambda: _one(main.like_item(4, main.PurchaseRequest(user_id=user_id), db=db)),
+        "unlike_item": lambda: _one(main.unlike_item(4, main.PurchaseRequest(user_id=user_id), db=db)),
+        "follow_channel": lambda: _one(main.follow_channel(4, main.PurchaseRequest(user_id=user_id), db=db)),
+        "unfollow_channel": lambda: _one(main.unfollow_channel(4, main.PurchaseRequest(user_id=user_id), db=db)),
+        "record_view": lambda: _one(main.record_view(2, main.PurchaseRequest(user_id=user_id), db=db)),
+        "purchase_item": lambda: _one(main.purchase_item(3, main.PurchaseRequest(user_id=user_id), db=db)),
+    }
+    failed = False
+    for name, call in calls.items():
+        db.sync_session.expire_all() # 前の呼び出しで読み込んだオブジェクトを使い回さない
+        with QueryCounter(api_engine()) as counter:
+            rows = await call()
+        budget = QUERY_BUDGETS[name]
+        status = "OK " if len(counter) <= budget else "NG "
+        failed |= len(counter) > budget
+        print(f"{status} {name}: {len(counter)} queries (budget {budget}) / {len(rows)} rows")
+        if explain:
+            for statement, parameters in counter.statements:
+                for scan in full_scans(statement, parameters):
+                    failed = True
+                    print(f"    NG フルスキャン: {scan}\n       {' '.join(statement.split())[:200]}")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="APIごとのSQL本数 / 実行計画のチェック")
+    parser.add_argument("--explain", action="store_true", help="実行計画を調べてフルスキャンを検出する")
+    args = parser.parse_args()
+    sys.exit(1 if asyncio.run(run(args.explain)) else 0)
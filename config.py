@@ -0,0 +1,63 @@
+# hackathon-backend/config.py
+# アプリの設定 (環境変数 / .env から読む)。DB接続の設定は database.py
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- 商品一覧のページング設定 ---
+ITEMS_PAGE_SIZE = 50
+ITEMS_PAGE_SIZE_MAX = 200
+RECOMMEND_CANDIDATE_LIMIT = 500 # おすすめ順でスコアリングする候補の上限
+
+# 画像URLの前に付けるAPIのURL (例: https://xxx.run.app)。空ならパスのみ返す
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+IMAGE_CACHE_CONTROL = "public, max-age=86400"
+
+# 新着順 / 未ログインのおすすめ順のページキャッシュ (他インスタンスでの変更は最大 TTL 秒遅れて反映)
+FEED_CACHE_SIZE = int(os.getenv("FEED_CACHE_SIZE", "256"))
+FEED_CACHE_TTL = int(os.getenv("FEED_CACHE_TTL", "30"))
+FEED_CACHE_CONTROL = "no-cache" # ブラウザには毎回 If-None-Match で確認させる
+
+# --- 学習済みモデル ---
+# .pkl なら joblib の pickle、ディレクトリなら npy 形式 (recommender.py export で変換。ワーカー間でメモリを共有できる)
+RECOMMENDER_PATH = os.getenv("RECOMMENDER_PATH", "recommender.pkl")
+# train_recommender.py で書き換えられたら読み込み直す。確認する間隔 (秒)
+RECOMMENDER_RELOAD_INTERVAL = float(os.getenv("RECOMMENDER_RELOAD_INTERVAL", "60"))
+# 起動時にバックグラウンドでモデルを読み込んでおく (0 なら最初に使うときまで読み込まない)
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "1") == "1"
+# ローカル分類器の確信度がこれ未満ならLLMに聞く
+CATEGORY_CONFIDENCE_THRESHOLD = float(os.getenv("CATEGORY_CONFIDENCE_THRESHOLD", "0.6"))
+
+# --- 関連商品 (商品ベクトルの近傍検索) ---
+# 次元を変えると保存済みの feature_vector は使えなくなる (読み込み時に計算し直す)。メモリは 件数 x 次元 x 4バイト
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "128"))
+EMBEDDING_REFRESH_INTERVAL = float(os.getenv("EMBEDDING_REFRESH_INTERVAL", "60")) # 他インスタンスで追加された商品を読み込む間隔 (秒)
+RELATED_ITEMS_LIMIT = 3
+
+# --- 商品検索 (文字 bigram の転置インデックス) ---
+SEARCH_DESCRIPTION_CHARS = int(os.getenv("SEARCH_DESCRIPTION_CHARS", "500")) # 説明文は先頭のこの文字数だけ索引する
+SEARCH_REFRESH_INTERVAL = float(os.getenv("SEARCH_REFRESH_INTERVAL", "60")) # 他インスタンスで追加された商品を読み込む間隔 (秒)
+# 関連商品・検索のインデックスは、読み込み済みの最大IDより この件数分 下のIDから読み直す
+# (IDは採番順にコミットされるとは限らないので、後からコミットされた小さいIDを拾う)
+INDEX_RESCAN_WINDOW = int(os.getenv("INDEX_RESCAN_WINDOW", "200"))
+
+# --- LLM (analyze_item) ---
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "2048"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH") or None
+
+# --- 閲覧ログ (VIEW_LOG_MODE=sync で従来どおり1件ずつ) ---
+VIEW_LOG_MODE = os.getenv("VIEW_LOG_MODE", "buffered")
+VIEW_BUFFER_SIZE = int(os.getenv("VIEW_BUFFER_SIZE", "10000"))
+VIEW_FLUSH_ROWS = int(os.getenv("VIEW_FLUSH_ROWS", "500"))
+VIEW_FLUSH_INTERVAL = float(os.getenv("VIEW_FLUSH_INTERVAL", "1.0"))
+# 1にすると、1回の書き込みの中で同じユーザー×商品の閲覧は1件にまとめる (既定は何度見ても履歴を残す)
+VIEW_COALESCE = os.getenv("VIEW_COALESCE", "0") == "1"
+
+# --- カテゴリ推定キュー ---
+CATEGORY_WORKERS = int(os.getenv("CATEGORY_WORKERS", "4"))
+CATEGORY_QUEUE_SIZE = int(os.getenv("CATEGORY_QUEUE_SIZE", "1000"))
@@ -0,0 +1,313 @@
+# hackathon-backend/database.py
+# DBエンジンの作成 (接続先・コネクションプールは環境変数で設定する)
+#
+#   DATABASE_URL            接続URL (未指定なら DB_USER / DB_PASS / DB_HOST / DB_NAME から MySQL のURLを組み立てる。
+#                           どちらも無ければエンジンを使う時点でエラーにする。既定の接続先は持たない)
+#   DB_POOL_SIZE            常時保持する接続数 (既定 5)
+#   DB_BACKGROUND_POOL_SIZE DB_ASYNC=true のときの同期エンジンの常時接続数 (既定 2。閲覧ログ・カテゴリ推定・インデックス更新用)
+#   DB_MAX_OVERFLOW         一時的に追加で開ける接続数 (既定 2)
+#   DB_POOL_TIMEOUT         接続が空くのを待つ秒数 (既定 10)
+#   DB_POOL_RECYCLE         この秒数より古い接続は張り直す (既定 1800。Cloud SQL のアイドル切断対策)
+#   DB_POOL_PRE_PING        貸し出し前に接続の生存確認をする (既定 true)
+#   DB_STATEMENT_TIMEOUT_MS SELECT の実行時間上限 (MySQL の MAX_EXECUTION_TIME。0 で無制限)
+#   DB_SQLITE_BUSY_TIMEOUT  SQLite のロック待ち秒数 (既定 30)
+#   DB_ASYNC                APIのDBアクセスを非同期ドライバで行う (既定 false = スレッドプールで同期Session。
+#                           true にするなら benchmark.py throughput で本番相当のDBに対して速くなることを確かめてから)
+#   ASYNC_DATABASE_URL      非同期用の接続URL (未指定なら DATABASE_URL のドライバを aiomysql / aiosqlite に置き換える)
+#
+# 1プロセスあたりの最大接続数 (ワーカー数を掛けたものが DB の max_connections に収まるようにする):
+#   DB_ASYNC=false  DB_POOL_SIZE + DB_MAX_OVERFLOW                       (同期エンジンだけ。既定 7)
+#   DB_ASYNC=true   DB_POOL_SIZE + DB_MAX_OVERFLOW                       (非同期エンジン: API)
+#                   + DB_BACKGROUND_POOL_SIZE + DB_MAX_OVERFLOW          (同期エンジン: バックグラウンド処理。既定 合計 11)
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from starlette.concurrency import run_in_threadpool
+
+load_dotenv()
+
+
+def _env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes", "on")
+
+
+def database_url():
+    url = os.getenv("DATABASE_URL")
+    if url:
+        return url
+    names = ("DB_USER", "DB_PASS", "DB_HOST", "DB_NAME")
+    missing = [name for name in names if not os.getenv(name)]
+    if missing:
+        raise RuntimeError(f"DB接続先が設定されていません: DATABASE_URL か {' / '.join(names)} を指定してください "
+                           f"(未設定: {', '.join(missing)})")
+    user, password, host, name = (os.environ[name] for name in names)
+    return f"mysql+mysqlconnector://{user}:{password}@{host}/{name}"
+
+
+class _TimedPoolMixin:
+    """接続の貸し出し待ち時間を計測する"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self.wait_stats = {"checkouts": 0, "wait_total_ms": 0.0, "wait_max_ms": 0.0, "timeouts": 0}
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with self._wait_lock:
+                self.wait_stats["timeouts"] += 1
+            raise
+        finally:
+            waited = (time.perf_counter() - started) * 1000
+            with self._wait_lock:
+                self.wait_stats["checkouts"] += 1
+                self.wait_stats["wait_total_ms"] += waited
+                self.wait_stats["wait_max_ms"] = max(self.wait_stats["wait_max_ms"], waited)
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def async_database_url(url=None):
+    """同期ドライバのURLを非同期ドライバのURLに置き換える"""
+    url = os.getenv("ASYNC_DATABASE_URL") or url or database_url()
+    scheme, rest = url.split("://", 1)
+    if scheme.startswith("mysql"):
+        scheme = "mysql+aiomysql"
+    elif scheme.startswith("sqlite"):
+        scheme = "sqlite+aiosqlite"
+    return f"{scheme}://{rest}"
+
+
+def _engine_options(url, poolclass, pool_size=None):
+    kwargs = {
+        "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+    if url.startswith("sqlite"):
+        kwargs["connect_args"] = {"check_same_thread": False, "timeout": float(os.getenv("DB_SQLITE_BUSY_TIMEOUT", "30"))}
+    if ":memory:" not in url: # インメモリSQLiteは接続ごとに別DBになるので既定のプールのまま
+        kwargs.update(
+            poolclass=poolclass,
+            pool_size=pool_size if pool_size is not None else int(os.getenv("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "2")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        )
+    return kwargs
+
+
+def _install_connect_hooks(engine, url):
+    statement_timeout_ms = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "10000"))
+    if engine.dialect.name == "mysql" and statement_timeout_ms > 0:
+        @event.listens_for(engine, "connect")
+        def _set_statement_timeout(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"SET SESSION MAX_EXECUTION_TIME = {statement_timeout_ms}")
+            cursor.close()
+    elif engine.dialect.name == "sqlite" and ":memory:" not in url:
+        @event.listens_for(engine, "connect")
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            # 読み込みと書き込みを並行できるようにする
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.close()
+
+
+def make_engine(url=None, pool_size=None):
+    url = url or database_url()
+    engine = create_engine(url, **_engine_options(url, TimedQueuePool, pool_size))
+    _install_connect_hooks(engine, url)
+    return engine
+
+
+def make_async_engine(url=None):
+    from sqlalchemy.ext.asyncio import create_async_engine
+    url = async_database_url(url)
+    options = _engine_options(url, TimedAsyncQueuePool)
+    if url.startswith("sqlite"):
+        options["connect_args"].pop("check_same_thread") # aiosqlite は専用スレッドで動く
+    engine = create_async_engine(url, **options)
+    # 接続時の設定は同期側のエンジンにイベントで付ける (非同期ドライバの接続もカーソルAPIで扱える)
+    _install_connect_hooks(engine.sync_engine, url)
+    return engine
+
+
+def pool_stats(engine):
+    pool = getattr(engine, "sync_engine", engine).pool
+    stats = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow(), checked_in=pool.checkedin())
+    wait_stats = getattr(pool, "wait_stats", None)
+    if wait_stats:
+        stats.update(wait_stats)
+        stats["wait_avg_ms"] = round(wait_stats["wait_total_ms"] / wait_stats["checkouts"], 3) if wait_stats["checkouts"] else None
+        stats["wait_total_ms"] = round(wait_stats["wait_total_ms"], 1)
+        stats["wait_max_ms"] = round(wait_stats["wait_max_ms"], 1)
+    return stats
+
+
+# --- アプリ共通のエンジン / セッション ---
+# engine / SessionLocal は最初に使うときに作る (接続先が未設定でも import だけならエラーにしない。
+# migrate.py のように自分でエンジンを作るスクリプトのため)
+# 同期エンジンはスクリプト / バックグラウンド処理 (閲覧ログの書き込み・カテゴリ推定) で使う
+Base = declarative_base()
+
+DB_ASYNC = _env_bool("DB_ASYNC", False)
+
+_lazy = {}
+_lazy_lock = threading.RLock() # SessionLocal を作るときに engine も作る
+
+
+def _make_default(name):
+    if name == "engine":
+        # 非同期モードではAPIは非同期エンジンを使うので、同期エンジンはバックグラウンド用に小さくする
+        pool_size = int(os.getenv("DB_BACKGROUND_POOL_SIZE", "2")) if DB_ASYNC else None
+        return make_engine(pool_size=pool_size)
+    if name == "SessionLocal":
+        return sessionmaker(autocommit=False, autoflush=False, bind=_default("engine"))
+    # 同期版もコミット後に属性を読み直さない (非同期版と同じ動きにする)
+    return sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=_default("engine"))
+
+
+def _default(name):
+    if name not in _lazy:
+        with _lazy_lock:
+            if name not in _lazy:
+                _lazy[name] = _make_default(name)
+    return _lazy[name]
+
+
+def __getattr__(name):
+    # from database import engine / SessionLocal で作られる
+    if name in ("engine", "SessionLocal"):
+        return _default(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_db():
+    db = _default("SessionLocal")()
+    try: yield db
+    finally: db.close()
+
+
+class SyncSessionAdapter:
+    """同期Sessionを AsyncSession と同じ呼び方 (await db.execute(...)) で使えるようにする
+
+    DB_ASYNC=false のときにAPIへ渡す。DBアクセスはスレッドプールで実行するのでイベントループは止まらない。
+    """
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    def _execute(self, statement, params):
+        result = self.sync_session.execute(statement, params)
+        if getattr(result, "returns_rows", True): # ORMのSELECT結果には returns_rows が無い
+            # AsyncSession と同じく行を読み切ってから返す (ループ側のスレッドでDBを読まない)
+            return result.freeze()()
+        return result
+
+    async def execute(self, statement, params=None):
+        return await run_in_threadpool(self._execute, statement, params)
+
+    async def scalar(self, statement, params=None):
+        return await run_in_threadpool(self.sync_session.scalar, statement, params)
+
+    async def scalars(self, statement, params=None):
+        return (await self.execute(statement, params)).scalars()
+
+    async def get(self, entity, ident):
+        return await run_in_threadpool(self.sync_session.get, entity, ident)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def refresh(self, instance):
+        await run_in_threadpool(self.sync_session.refresh, instance)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+_async_engine = None
+_AsyncSessionLocal = None
+_async_lock = threading.Lock()
+
+
+def get_async_engine():
+    """非同期エンジン (最初に使うときに作る。aiomysql / aiosqlite はこのとき import される)"""
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        with _async_lock:
+            if _async_engine is None:
+                from sqlalchemy.ext.asyncio import async_sessionmaker
+                engine_ = make_async_engine()
+                _AsyncSessionLocal = async_sessionmaker(engine_, autoflush=False, expire_on_commit=False)
+                _async_engine = engine_
+    return _async_engine
+
+
+_session_slots = None
+
+
+def _sync_session_slots():
+    global _session_slots
+    if _session_slots is None:
+        pool = _default("engine").pool
+        size = pool.size() + max(pool._max_overflow, 0) if isinstance(pool, QueuePool) else 1
+        _session_slots = asyncio.Semaphore(size)
+    return _session_slots
+
+
+@asynccontextmanager
+async def session_scope():
+    """APIで使うセッション。DB_ASYNC に応じて AsyncSession か SyncSessionAdapter を返す"""
+    if DB_ASYNC:
+        get_async_engine()
+        async with _AsyncSessionLocal() as db:
+            yield db
+    else:
+        # プールが空くのをスレッドの中で待つと、接続を持っている側が使うスレッドまで塞いで詰まるので
+        # 同時に使うセッション数をイベントループ側で接続数までに抑える
+        async with _sync_session_slots():
+            db = SyncSessionAdapter(_default("AdapterSessionLocal")())
+            try:
+                yield db
+            finally:
+                await db.close()
+
+
+async def get_session():
+    async with session_scope() as db:
+        yield db
+
+
+async def dispose_async_engine():
+    if _async_engine is not None:
+        await _async_engine.dispose()
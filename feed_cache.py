@@ -0,0 +1,90 @@
+# hackathon-backend/feed_cache.py
+# 誰が見ても同じになる商品一覧 (新着順 / 未ログインのおすすめ順) のページキャッシュ
+import asyncio
+import hashlib
+import threading
+
+from cachetools import TTLCache
+
+
+class FeedPage:
+    """シリアライズ済みのレスポンス本体と、その ETag / 次ページの cursor"""
+
+    __slots__ = ("body", "etag", "next_cursor")
+
+    def __init__(self, body, next_cursor):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.next_cursor = next_cursor
+
+    def matches(self, if_none_match):
+        return bool(if_none_match) and (if_none_match.strip() == "*" or self.etag in if_none_match)
+
+
+class FeedCache:
+    """一覧ページをバージョン付きでキャッシュする
+
+    - 商品・チャンネルが変わったら invalidate() でバージョンを上げ、古いページは一括で捨てる
+    - 組み立て中にバージョンが上がったページは保存しない (古い内容を新しいバージョンとして配らない)
+    - プロセスごとのキャッシュなので、他のインスタンスでの変更は ttl 秒以内に反映される
+    """
+
+    def __init__(self, maxsize=256, ttl=30):
+        self.ttl = ttl
+        self._pages = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._version = 0
+        self._counters = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0}
+        # 同じページの組み立ては同時に1つだけ (バージョンが上がった直後にDBへ殺到させない)
+        self._build_locks = [asyncio.Lock() for _ in range(16)]
+
+    @property
+    def version(self):
+        return self._version
+
+    def get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            self._counters["hits" if page is not None else "misses"] += 1
+            return page
+
+    def put(self, key, version, body, next_cursor):
+        page = FeedPage(body, next_cursor)
+        with self._lock:
+            if version == self._version:
+                self._pages[key] = page
+        return page
+
+    async def get_or_build(self, key, build):
+        """キャッシュにあればそれを、無ければ await build() -> (本体bytes, next_cursor) で作って返す"""
+        page = self.get(key)
+        if page is not None:
+            return page
+        async with self._build_locks[hash(key) % len(self._build_locks)]:
+            with self._lock:
+                page = self._pages.get(key) # 待っている間に他のリクエストが作っていればそれを使う
+            if page is not None:
+                return page
+            version = self._version
+            body, next_cursor = await build()
+            return self.put(key, version, body, next_cursor)
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._pages.clear()
+            self._counters["invalidations"] += 1
+
+    def count_not_modified(self):
+        with self._lock:
+            self._counters["not_modified"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._pages)
+            stats["version"] = self._version
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+        stats["ttl_sec"] = self.ttl
+        return stats
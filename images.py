@@ -0,0 +1,93 @@
+# hackathon-backend/images.py
+# 商品画像の保存用ユーティリティ (base64のデコード / サムネイル生成 / ETag)
+import base64
+import binascii
+import hashlib
+import io
+import re
+
+try:
+    from PIL import Image
+except ImportError: # Pillowが無い環境ではサムネイル = 元画像
+    Image = None
+
+THUMBNAIL_SIZE = (400, 400)
+THUMBNAIL_QUALITY = 80
+
+_MAGIC_TYPES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"RIFF", "image/webp"),
+]
+
+
+# このAPIの画像URL (models.image_path)。"/" 始まりだけで判定すると、プレフィックス無しのJPEGのbase64 ("/9j/...") も当てはまってしまう
+_API_IMAGE_PATH = re.compile(r"/api/items/\d+/image$")
+
+
+def is_api_image_path(value):
+    return bool(value) and _API_IMAGE_PATH.match(value) is not None
+
+
+def is_image_url(value):
+    """外部URL or このAPIの画像URLなら True (base64本体ではない)"""
+    return bool(value) and (value.startswith(("http://", "https://")) or is_api_image_path(value))
+
+
+def sniff_content_type(data):
+    for magic, content_type in _MAGIC_TYPES:
+        if data.startswith(magic):
+            return content_type
+    return "application/octet-stream"
+
+
+def decode_image_payload(value):
+    """フロントから送られた画像文字列を (bytes, content_type) にする
+
+    "data:image/png;base64,..." 形式と、プレフィックス無しのbase64の両方を受け付ける。
+    URLや空文字など画像本体でないものは None を返す。
+    """
+    if not value or is_image_url(value):
+        return None
+    content_type = None
+    payload = value
+    if value.startswith("data:"):
+        header, _, payload = value.partition(",")
+        if ";base64" not in header:
+            return None
+        content_type = header[len("data:"):].split(";")[0] or None
+    try:
+        data = base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if not data:
+        return None
+    return data, content_type or sniff_content_type(data)
+
+
+def make_thumbnail(data, content_type):
+    """一覧表示用の縮小画像を (bytes, content_type) で返す"""
+    if Image is None:
+        return data, content_type
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.thumbnail(THUMBNAIL_SIZE)
+            out = io.BytesIO()
+            if img.mode in ("RGBA", "LA", "P"):
+                img.save(out, format="PNG", optimize=True)
+                thumb = (out.getvalue(), "image/png")
+            else:
+                img.convert("RGB").save(out, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+                thumb = (out.getvalue(), "image/jpeg")
+    except Exception as e:
+        print(f"Thumbnail Error: {e}")
+        return data, content_type
+    # 縮小しても大きくなる場合は元画像を使う
+    if len(thumb[0]) >= len(data):
+        return data, content_type
+    return thumb
+
+
+def etag_for(data):
+    return hashlib.sha256(data).hexdigest()
@@ -0,0 +1,227 @@
+# hackathon-backend/item_embeddings.py
+# 関連商品用の商品ベクトル (タイトル・説明文の文字n-gramをハッシュで固定次元に落としたもの)
+#
+# - ベクトルはローカルで計算する (外部API・学習済みモデル不要)。同じ文字列なら常に同じベクトルになる
+# - items.feature_vector には float32 のバイト列を base64 で保存する (JSONの数値配列より小さく、読み込みも速い)
+# - 各ワーカーは全商品のベクトルを1つの行列 (件数 x 次元, float32) に持ち、コサイン類似度の上位k件を返す
+#
+# 使い方: python item_embeddings.py backfill [--chunk 1000]   # feature_vector が空の商品を埋める
+import argparse
+import base64
+import threading
+import time
+import unicodedata
+import zlib
+
+import numpy as np
+
+from config import EMBEDDING_DIM, EMBEDDING_REFRESH_INTERVAL, INDEX_RESCAN_WINDOW
+
+NGRAM_SIZES = (2, 3)
+DESCRIPTION_WEIGHT = 0.5 # 説明文はタイトルより弱く効かせる
+
+
+def _ngrams(text):
+    text = " " + " ".join(unicodedata.normalize("NFKC", text or "").lower().split()) + " "
+    for n in NGRAM_SIZES:
+        for i in range(len(text) - n + 1):
+            yield text[i:i + n]
+
+
+def embed(title, description="", dim=EMBEDDING_DIM):
+    """L2正規化済みの float32 ベクトルを返す"""
+    slots, weights = [], []
+    for weight, text in ((1.0, title), (DESCRIPTION_WEIGHT, description)):
+        for gram in _ngrams(text):
+            # Python の hash() はプロセスごとに変わるので crc32 を使う。最上位ビットを符号にして衝突の偏りを打ち消す
+            h = zlib.crc32(gram.encode("utf-8"))
+            slots.append(h % dim)
+            weights.append(weight if h & 0x80000000 else -weight)
+    vec = np.zeros(dim, dtype=np.float32)
+    if slots:
+        np.add.at(vec, slots, weights)
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec /= norm
+    return vec
+
+
+def encode_vector(vec):
+    return base64.b64encode(np.asarray(vec, dtype="<f4").tobytes()).decode("ascii")
+
+
+def decode_vector(text, dim=EMBEDDING_DIM):
+    """保存形式から戻す。空・次元が違う (EMBEDDING_DIM を変えた) ときは None"""
+    if not text:
+        return None
+    try:
+        raw = base64.b64decode(text)
+    except ValueError:
+        return None
+    if len(raw) != dim * 4:
+        return None
+    return np.frombuffer(raw, dtype="<f4").astype(np.float32)
+
+
+class EmbeddingIndex:
+    """商品ID -> ベクトル の行列。add() で1件ずつ追加でき、検索はロックの外で行う
+
+    行列は容量を倍々に確保しておき、追加は空いている行に書くだけにする。
+    検索側は (行列, 件数) をその時点で取り出して使うので、検索中に追加されても壊れない。
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, capacity=1024, refresh_interval=EMBEDDING_REFRESH_INTERVAL,
+                 rescan_window=INDEX_RESCAN_WINDOW):
+        self.dim = dim
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._rows = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        # load() で読み込み済みの最大ID。add() (このインスタンスでの出品) では進めない
+        # (進めると、その間に他のインスタンスで追加された小さいIDの商品を読み飛ばしてしまう)
+        self.loaded_max_id = 0
+        self.rescan_window = rescan_window
+        self.refresh_interval = refresh_interval
+        self._refreshed_at = time.monotonic()
+        self._refreshing = False
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        return self._ids.nbytes + self._matrix.nbytes
+
+    def add(self, item_id, vec):
+        self.add_many([item_id], [vec])
+
+    def add_many(self, item_ids, vectors):
+        if not len(item_ids):
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            needed = self._size + len(item_ids)
+            if needed > len(self._ids):
+                self._grow(max(needed, self._size * 2))
+            rows = []
+            for item_id in item_ids:
+                item_id = int(item_id)
+                row = self._rows.get(item_id)
+                if row is None:
+                    row = self._size
+                    self._ids[row] = item_id
+                    self._rows[item_id] = row
+                    self._size += 1
+                rows.append(row)
+            self._matrix[rows] = vectors
+
+    def _grow(self, capacity):
+        ids = np.zeros(capacity, dtype=np.int64)
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        ids[:self._size] = self._ids[:self._size]
+        matrix[:self._size] = self._matrix[:self._size]
+        # 検索中のスレッドは古い配列を見続けるので、書き換えずに差し替える
+        self._ids, self._matrix = ids, matrix
+
+    def __contains__(self, item_id):
+        return item_id in self._rows
+
+    def neighbors(self, vec, k, exclude=None):
+        """コサイン類似度の高い順に最大k件の商品IDを返す (ベクトルは正規化済みなので内積で計算する)"""
+        with self._lock:
+            ids, matrix, size = self._ids, self._matrix, self._size
+            skip = self._rows.get(exclude)
+        if size == 0 or k <= 0:
+            return []
+        scores = matrix[:size] @ vec
+        if skip is not None:
+            scores[skip] = -np.inf
+        k = min(k, size - (skip is not None))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [int(i) for i in ids[top]]
+
+    # --- DBからの読み込み ---
+    def load(self, db, chunk=5000):
+        """まだ持っていない商品を読み込む (最初は全件、以降は他のインスタンスで追加された分)。読み込んだ件数を返す
+
+        読み込み済みの最大IDより rescan_window 件分下から読み直し、後からコミットされた小さいIDも拾う
+        (持っている商品は飛ばす)。
+        """
+        from sqlalchemy import select
+        from models import Item
+        start = max(self.loaded_max_id - self.rescan_window, 0) if self.loaded_max_id else 0
+        rows = db.execute(
+            select(Item.id, Item.title, Item.description, Item.feature_vector)
+            .where(Item.id > start).order_by(Item.id)
+            .execution_options(yield_per=chunk)
+        )
+        loaded = 0
+        for batch in rows.partitions():
+            self.loaded_max_id = max(self.loaded_max_id, batch[-1].id)
+            batch = [row for row in batch if row.id not in self._rows]
+            if not batch:
+                continue
+            ids = [row.id for row in batch]
+            # 未保存 (backfill 前) の行はその場で計算する
+            vectors = [decode_vector(row.feature_vector, self.dim) if row.feature_vector else None for row in batch]
+            vectors = [vec if vec is not None else embed(row.title, row.description, self.dim) for vec, row in zip(vectors, batch)]
+            self.add_many(ids, vectors)
+            loaded += len(ids)
+        return loaded
+
+    def refresh_due(self):
+        """前回から refresh_interval 秒経っていれば True を返し、読み込み中の印を付ける"""
+        with self._lock:
+            if self._refreshing or time.monotonic() - self._refreshed_at < self.refresh_interval:
+                return False
+            self._refreshing = True
+            return True
+
+    def refresh(self, db):
+        try:
+            return self.load(db)
+        finally:
+            with self._lock:
+                self._refreshed_at = time.monotonic()
+                self._refreshing = False
+
+
+def backfill(chunk_size):
+    from sqlalchemy import select, update
+    from database import SessionLocal
+    from models import Item
+
+    started = time.time()
+    updated = 0
+    last_id = 0
+    db = SessionLocal()
+    try:
+        while True:
+            rows = db.execute(
+                select(Item.id, Item.title, Item.description)
+                .where(Item.feature_vector.is_(None), Item.id > last_id)
+                .order_by(Item.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            db.execute(update(Item), [{"id": row.id, "feature_vector": encode_vector(embed(row.title, row.description))} for row in rows])
+            db.commit()
+            updated += len(rows)
+            last_id = rows[-1].id
+            print(f"~ ID {last_id}: {updated}件")
+    finally:
+        db.close()
+    print(f"完了: {updated}件 / {time.time() - started:.1f}秒")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="商品ベクトルの保存")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("backfill", help="feature_vector が空の商品のベクトルを計算して保存する")
+    p.add_argument("--chunk", type=int, default=1000, help="1回のコミットで処理する件数")
+    args = parser.parse_args()
+    backfill(args.chunk)
@@ -0,0 +1,136 @@
+# hackathon-backend/llm.py
+# LLMクライアント (Gemini / テスト用スタブ) の差し替え口
+import asyncio
+import os
+import threading
+import time
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def _genai():
+    # google.generativeai は import だけで1秒近くかかるので、最初に呼ぶときまで読み込まない
+    global _configured
+    import google.generativeai as genai
+    with _configure_lock:
+        if not _configured:
+            genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+            _configured = True
+    return genai
+
+
+class GeminiClient:
+    def __init__(self, model_name, generation_config=None):
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = _genai().GenerativeModel(self.model_name, generation_config=self.generation_config)
+        return self._model
+
+    def generate(self, prompt):
+        return self.model.generate_content(prompt).text
+
+    async def generate_async(self, prompt):
+        response = await self.model.generate_content_async(prompt)
+        return response.text
+
+
+class StubClient:
+    """ネットワークに出ずに固定の応答を返すクライアント (ローカル / テスト用)"""
+
+    def __init__(self, response="", delay=0.0):
+        self.response = response
+        self.delay = delay
+        self.calls = 0
+
+    def generate(self, prompt):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.response
+
+    async def generate_async(self, prompt):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self.response
+
+
+class AsyncLLMGateway:
+    """イベントループを止めずにLLMを呼ぶ窓口
+
+    - 同時に投げるリクエストは max_concurrency 件まで (超えた分は待つ)
+    - 待ち時間を含めて timeout 秒で打ち切る
+    - is_disconnected (クライアント切断を返すコルーチン関数) を渡すと、切断時に呼び出しを取り消す
+    """
+
+    def __init__(self, client, max_concurrency=8, timeout=20.0, poll_interval=0.25):
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._semaphore = None
+        self._lock = threading.Lock()
+        self._counters = {"completed": 0, "errors": 0, "timeouts": 0, "cancelled": 0}
+        self._in_flight = 0
+
+    async def _call(self, prompt):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            with self._lock:
+                self._in_flight += 1
+            try:
+                return await self.client.generate_async(prompt)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+
+    async def generate(self, prompt, is_disconnected=None):
+        """LLMの応答テキストを返す。タイムアウトは asyncio.TimeoutError、切断は asyncio.CancelledError"""
+        task = asyncio.ensure_future(asyncio.wait_for(self._call(prompt), self.timeout))
+        try:
+            while is_disconnected is not None:
+                done, _ = await asyncio.wait({task}, timeout=self.poll_interval)
+                if done:
+                    break
+                if await is_disconnected():
+                    task.cancel()
+                    self._count("cancelled")
+                    raise asyncio.CancelledError("client disconnected")
+            result = await task
+        except asyncio.TimeoutError:
+            self._count("timeouts")
+            raise
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        except Exception:
+            self._count("errors")
+            raise
+        self._count("completed")
+        return result
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = self._in_flight
+        stats["max_concurrency"] = self.max_concurrency
+        stats["timeout_sec"] = self.timeout
+        return stats
+
+
+def make_client(model_name, generation_config=None, stub_response=""):
+    # LLM_BACKEND=stub でGeminiを呼ばずにスタブを使う
+    if os.getenv("LLM_BACKEND", "gemini") == "stub":
+        return StubClient(stub_response, delay=float(os.getenv("LLM_STUB_DELAY", "0")))
+    return GeminiClient(model_name, generation_config)
@@ -0,0 +1,115 @@
+# hackathon-backend/llm_cache.py
+# LLMの応答キャッシュ (プロセス内 TTL付きLRU + 任意で SQLite に永続化)
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from cachetools import TTLCache
+
+
+def normalize_text(value):
+    """全角/半角・大文字/小文字・空白の違いを吸収する"""
+    value = unicodedata.normalize("NFKC", value or "")
+    return " ".join(value.lower().split())
+
+
+def make_key(namespace, *parts):
+    payload = json.dumps([namespace] + [normalize_text(p) if isinstance(p, str) else p for p in parts], ensure_ascii=False)
+    return namespace + ":" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """get / set は同期 (スレッドから呼ぶ)。イベントループからは aget / aset を使う (SQLite の読み書きをスレッドで行う)
+
+    メモリ側のロック (_lock) は SQLite の読み書きの間は持たない。SQLite の接続は _db_lock で守る。
+    期限切れの行は開いたときと、その後 purge_interval 秒ごとの書き込みのついでに消す (ファイルが増え続けないように)。
+    """
+
+    def __init__(self, maxsize=2048, ttl=3600, db_path=None, purge_interval=None):
+        self.ttl = ttl
+        self.purge_interval = ttl if purge_interval is None else purge_interval
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "persistent_hits": 0, "purged": 0}
+        self._db = None
+        self._last_purge = 0.0
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_expires_at ON llm_cache (expires_at)")
+            self._db.commit()
+            with self._db_lock:
+                self._purge_expired()
+
+    def _purge_expired(self):
+        """期限切れの行を消す (_db_lock を持った状態で呼ぶ)"""
+        now = time.time()
+        deleted = self._db.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,)).rowcount
+        self._db.commit()
+        self._last_purge = now
+        with self._lock:
+            self._counters["purged"] += max(deleted, 0)
+
+    def _get_memory(self, key):
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None or self._db is None:
+                self._counters["hits" if value is not None else "misses"] += 1
+            return value
+
+    def _get_persistent(self, key):
+        with self._db_lock:
+            row = self._db.execute("SELECT value FROM llm_cache WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        value = json.loads(row[0]) if row else None
+        with self._lock:
+            if value is not None:
+                self._memory[key] = value
+                self._counters["persistent_hits"] += 1
+            self._counters["hits" if value is not None else "misses"] += 1
+        return value
+
+    def _set_persistent(self, key, value):
+        with self._db_lock:
+            self._db.execute("INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                             (key, json.dumps(value, ensure_ascii=False), time.time() + self.ttl))
+            self._db.commit()
+            if time.time() - self._last_purge >= self.purge_interval:
+                self._purge_expired()
+
+    def get(self, key):
+        value = self._get_memory(key)
+        if value is None and self._db is not None:
+            value = self._get_persistent(key)
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+        if self._db is not None:
+            self._set_persistent(key, value)
+
+    async def aget(self, key):
+        value = self._get_memory(key)
+        if value is None and self._db is not None:
+            value = await asyncio.to_thread(self._get_persistent, key)
+        return value
+
+    async def aset(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+        if self._db is not None:
+            await asyncio.to_thread(self._set_persistent, key, value)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._memory)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+        stats["persistent"] = self._db is not None
+        return stats
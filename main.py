@@ -1,226 +1,186 @@
 # hackathon-backend/main.py
-from fastapi import FastAPI, Depends, HTTPException
+# ★変更: 設定 (config.py) / DB (database.py, models.py) / リクエスト定義 (schemas.py) / カテゴリ (categories.py) を分離。
+#         学習済みモデル・Geminiは最初に使うとき (または起動時にバックグラウンドで) 読み込むので、import は軽い
+from fastapi import FastAPI, Depends, HTTPException, Query, Response, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, DateTime, func
-from sqlalchemy.dialects.mysql import LONGTEXT 
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
-import os
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select, update, delete, case, func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+import asyncio
 import json
-import math
+import threading
 from datetime import datetime
-import google.generativeai as genai
-from dotenv import load_dotenv
-import joblib
-import pandas as pd
+import time
 from passlib.context import CryptContext # ★追加
 from typing import List, Optional # ★追加
-
-# --- カテゴリ定義 (内部コード: 日本語表示名) ---
-CATEGORY_TRANSLATION = {
-    # --- 既存互換（レコメンドが効くエリア） ---
-    "accessories.bag": "バッグ",
-    "accessories.wallet": "財布・小物",
-    "apparel.costume": "コスプレ・衣装",
-    "apparel.dress": "ドレス・ワンピース",
-    "apparel.jacket": "ジャケット・アウター",
-    "apparel.jeans": "デニム・ジーンズ",
-    "apparel.shirt": "シャツ・ブラウス",
-    "apparel.shoes": "靴・シューズ",
-    "apparel.shoes.sneakers": "スニーカー", # 既存リストに合わせて調整
-    "apparel.tshirt": "Tシャツ・カットソー",
-    "appliances.environment.air_conditioner": "エアコン",
-    "appliances.kitchen.coffee_machine": "コーヒーメーカー",
-    "appliances.kitchen.microwave": "電子レンジ",
-    "appliances.kitchen.refrigerators": "冷蔵庫",
-    "appliances.personal.hair_dryer": "ドライヤー",
-    "appliances.personal.massager": "美容・健康家電", # 簡潔に
-    "computers.notebook": "ノートPC",
-    "computers.peripherals.monitor": "モニター",
-    "electronics.audio.headphone": "ヘッドフォン",
-    "electronics.audio.earphone": "イヤホン",
-    "electronics.camera.photo": "カメラ",
-    "electronics.smartphone": "スマートフォン",
-    "electronics.tablet": "タブレット",
-    "electronics.video.tv": "テレビ",
-    "furniture.living_room.sofa": "ソファ",
-    "furniture.living_room.table": "テーブル",
-    "kids.toys": "おもちゃ",
-    "sport.bicycle": "自転車",
-    
-    # --- ★新規拡充エリア（ここから下を追加） ---
-    
-    # エンタメ・ホビー
-    "hobby.idol_goods": "アイドルグッズ",
-    "hobby.anime_goods": "アニメ・コミックグッズ",
-    "hobby.trading_cards": "トレーディングカード",
-    "hobby.figures": "フィギュア",
-    "hobby.musical_instruments": "楽器・機材",
-    "hobby.art": "美術品・アート",
-    
-    # 書籍・メディア
-    "books.comic": "漫画・コミック",
-    "books.novel": "小説・文学",
-    "books.business": "ビジネス・経済",
-    "books.study_guide": "参考書・学習本",
-    "books.magazine": "雑誌",
-    "media.cd": "CD",
-    "media.dvd_bluray": "DVD/Blu-ray",
-    "media.game_software": "ゲームソフト",
-    "media.game_console": "ゲーム機本体",
-
-    # メンズ・レディース詳細
-    "fashion.mens.tops": "メンズトップス",
-    "fashion.mens.bottoms": "メンズパンツ",
-    "fashion.ladies.tops": "レディーストップス",
-    "fashion.ladies.skirt": "スカート",
-    
-    # その他
-    "tickets": "チケット",
-    "food": "食品・お菓子",
-    "handmade": "ハンドメイド",
-    "other": "その他"
-}
-
-
-load_dotenv()
+import orjson
+from config import (ITEMS_PAGE_SIZE, ITEMS_PAGE_SIZE_MAX, PUBLIC_BASE_URL, IMAGE_CACHE_CONTROL,
+                    FEED_CACHE_SIZE, FEED_CACHE_TTL, FEED_CACHE_CONTROL,
+                    RECOMMENDER_PATH, RECOMMENDER_RELOAD_INTERVAL, MODEL_PRELOAD, CATEGORY_CONFIDENCE_THRESHOLD, RELATED_ITEMS_LIMIT,
+                    LLM_MAX_CONCURRENCY, LLM_TIMEOUT, LLM_CACHE_SIZE, LLM_CACHE_TTL, LLM_CACHE_PATH,
+                    VIEW_LOG_MODE, VIEW_BUFFER_SIZE, VIEW_FLUSH_ROWS, VIEW_FLUSH_INTERVAL, VIEW_COALESCE,
+                    CATEGORY_WORKERS, CATEGORY_QUEUE_SIZE)
+from categories import CATEGORY_TRANSLATION, load_category_master
+from database import engine, SessionLocal, DB_ASYNC, get_session, get_async_engine, dispose_async_engine, pool_stats
+from models import (User, Channel, Item, ItemImage, Like, View, ChannelFollow, UserCategoryAffinity,
+                    init_db, image_path, build_item_image)
+from schemas import (PurchaseRequest, AnalysisRequest, ChannelCreate, ItemCreate, UserAuth,
+                     ChannelOut, ItemCard, ItemSummary, LikedItem, FeedItem)
+from images import decode_image_payload, etag_for, is_image_url, is_api_image_path
+from llm import make_client, AsyncLLMGateway
+from category_queue import CategoryQueue
+from category_classifier import get_classifier
+from llm_cache import ResponseCache, make_key
+from feed_cache import FeedCache
+from item_embeddings import EmbeddingIndex, embed, encode_vector
+from search_index import SearchIndex, like_search
+from recommend_pipeline import default_pipeline
+from recommender import ArtifactWatcher
+from view_buffer import ViewBuffer
 
 # --- パスワードハッシュ化設定 ---
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # --- Gemini設定 ---
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+# ★変更: LLM_BACKEND=stub でGeminiの代わりにスタブを使える (llm.py)
 generation_config = {"temperature": 0.2, "response_mime_type": "application/json"}
-ai_model = genai.GenerativeModel('gemini-2.0-flash', generation_config=generation_config)
-text_model = genai.GenerativeModel('gemini-2.0-flash')
+STUB_ANALYSIS = json.dumps({"is_valid": True, "reason": "スタブ応答", "suggested_channel": "null", "new_channel_suggestion": "その他"}, ensure_ascii=False)
+ai_model = make_client('gemini-2.0-flash', generation_config, stub_response=STUB_ANALYSIS)
+text_model = make_client('gemini-2.0-flash', stub_response="other")
+# ★追加: analyze_item 用の非同期呼び出し (同時実行数 / タイムアウト / 切断時キャンセル)
+ai_gateway = AsyncLLMGateway(ai_model, max_concurrency=LLM_MAX_CONCURRENCY, timeout=LLM_TIMEOUT)
 
-# --- モデル読み込み ---
-try:
-    print("学習済みモデルを読み込んでいます...")
-    rec_data = joblib.load('recommender.pkl')
-    rec_model = rec_data['model'] 
-    rec_prefs = rec_data['prefs'] 
-    print("モデル読み込み完了 ✅")
-except Exception as e:
-    print(f"モデル読み込み失敗: {e}")
-    rec_model = None
-    rec_prefs = None
-
-try:
-    with open("category_list.txt", "r", encoding="utf-8") as f:
-        CATEGORY_MASTER = [line.strip() for line in f.readlines() if line.strip()]
-except:
-    CATEGORY_MASTER = []
-
-# --- Cloud SQL接続設定 ---
-DB_USER = "benihiko"
-DB_PASS = "Hide-1213"
-DB_HOST = "136.119.203.142"
-DB_NAME = "hackathon"
-
-DATABASE_URL = f"mysql+mysqlconnector://{DB_USER}:{DB_PASS}@{DB_HOST}/{DB_NAME}"
-
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-# --- DBモデル ---
-class User(Base):
-    __tablename__ = "users"
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String(50), unique=True)
-    hashed_password = Column(String(100)) # ★追加: パスワード保存用
-    channels = relationship("Channel", back_populates="owner")
-
-class Channel(Base):
-    __tablename__ = "channels"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    name = Column(String(100))
-    owner = relationship("User", back_populates="channels")
-    items = relationship("Item", back_populates="channel")
-
-class Item(Base):
-    __tablename__ = "items"
-    id = Column(Integer, primary_key=True, index=True)
-    channel_id = Column(Integer, ForeignKey("channels.id"))
-    title = Column(String(200))
-    description = Column(Text)
-    price = Column(Integer)
-    status = Column(String(20), default="on_sale")
-    category_code = Column(String(100), nullable=True) 
-    feature_vector = Column(Text, nullable=True)
-    image_data = Column(LONGTEXT, nullable=True)
-    buyer_id = Column(Integer, ForeignKey("users.id"), nullable=True)
-    channel = relationship("Channel", back_populates="items")
-    likes = relationship("Like", back_populates="item")
-
-class Like(Base):
-    __tablename__ = "likes"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    item_id = Column(Integer, ForeignKey("items.id"))
-    created_at = Column(DateTime, default=datetime.now)
-    item = relationship("Item", back_populates="likes")
-
-class PurchaseRequest(BaseModel):
-    user_id: int
-
-class AnalysisRequest(BaseModel):
-    item_name: str
-    item_description: str
-    existing_channels: List[str] = [] # ユーザーが持っているチャンネル名のリスト
-
-class ChannelCreate(BaseModel):
-    name: str
-    user_id: int
-
-class ItemCreate(BaseModel):
-    title: str
-    description: str
-    price: int
-    image_data: str = ""
-    user_id: int
-    channel_id: int # ★修正: ユーザーが選択したチャンネルIDを必須にする
-
-# --- Viewモデル (閲覧履歴) ---
-class View(Base):
-    __tablename__ = "views"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    item_id = Column(Integer, ForeignKey("items.id"))
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-class ChannelFollow(Base):
-    __tablename__ = "channel_follows"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    channel_id = Column(Integer, ForeignKey("channels.id"))
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-# 最後にこれを忘れずに（テーブルが自動作成されます）
-Base.metadata.create_all(bind=engine)
+# ★追加: 同じ入力へのLLM応答をキャッシュする (LLM_CACHE_PATH を指定するとSQLiteにも保存)
+llm_cache = ResponseCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL, db_path=LLM_CACHE_PATH)
 
-# --- アプリ ---
-app = FastAPI()
-#origins = [
-#    "http://localhost:3000",
-#    "https://hackathon-frontend-h3av.vercel.app", # ←ここをあなたの実際のVercel URLに変えてください！
+# ★追加: おすすめ順の候補生成 / ランキング / 並べ替え
+recommend_pipeline = default_pipeline()
 
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+# ★追加: 新着順 / 未ログインのおすすめ順の一覧ページ (商品・チャンネルが変わったら invalidate する)
+feed_cache = FeedCache(maxsize=FEED_CACHE_SIZE, ttl=FEED_CACHE_TTL)
 
-def get_db():
+# --- モデル読み込み ---
+# ★変更: import 時には読み込まず、最初に使うときに1回だけ読み込む
+_recommender = None
+_recommender_lock = threading.Lock()
+_recommender_info = {}
+# ★追加: train_recommender.py がファイルを差し替えたら、再起動せずに新しいモデルへ切り替える
+recommender_watcher = ArtifactWatcher(RECOMMENDER_PATH, RECOMMENDER_RELOAD_INTERVAL)
+
+def _load_recommender():
+    from recommender import load_artifact
+    signature = recommender_watcher.signature()
+    rec_model, rec_index, info = load_artifact(RECOMMENDER_PATH, load_category_master() + list(CATEGORY_TRANSLATION))
+    recommender_watcher.mark_loaded(signature)
+    info["prefs"] = len(rec_index)
+    info["loaded_at"] = datetime.now().isoformat(timespec="seconds")
+    print(f"モデル読み込み完了 ✅ (version: {info['version'] or '-'}, prefs: {len(rec_index)}件, {rec_index.nbytes / 1e6:.1f}MB)")
+    return (rec_model, rec_index), info
+
+def get_recommender():
+    """(rec_model, rec_index) を返す。読み込めなければ (None, None)"""
+    global _recommender, _recommender_info
+    if _recommender is None:
+        with _recommender_lock:
+            if _recommender is None:
+                try:
+                    print("学習済みモデルを読み込んでいます...")
+                    _recommender, _recommender_info = _load_recommender()
+                except Exception as e:
+                    print(f"モデル読み込み失敗: {e}")
+                    _recommender = (None, None)
+    return _recommender
+
+def reload_recommender():
+    """書き換えられたファイルを読み込んで差し替える。失敗したら今のモデルを使い続ける"""
+    global _recommender, _recommender_info
+    try:
+        # 読み込みはロックの外 (その間も今のモデルで返す)。差し替えはタプルの代入1回
+        loaded, info = _load_recommender()
+        with _recommender_lock:
+            _recommender, _recommender_info = loaded, info
+        feed_cache.invalidate() # 古いモデルで組み立てたおすすめ順のページを配らない
+    except Exception as e:
+        print(f"モデル再読み込み失敗 (今のモデルを使い続けます): {e}")
+    finally:
+        recommender_watcher.done()
+
+def check_recommender_reload():
+    """ファイルが書き換えられていればバックグラウンドで読み込み直す (読み込み済みのときだけ)"""
+    if _recommender is not None and recommender_watcher.changed_due():
+        threading.Thread(target=reload_recommender, daemon=True).start()
+
+# ★追加: 関連商品用の商品ベクトル (全商品分を行列で持つ)
+_embedding_index = None
+_embedding_lock = threading.Lock()
+
+def get_embedding_index():
+    """EmbeddingIndex を返す。DBから読めなければ None (次に呼ばれたときにまた試す)"""
+    global _embedding_index
+    if _embedding_index is None:
+        with _embedding_lock:
+            if _embedding_index is None:
+                db = SessionLocal()
+                try:
+                    index = EmbeddingIndex()
+                    index.load(db)
+                    _embedding_index = index
+                    print(f"商品ベクトル読み込み完了 ✅ ({len(index)}件, {index.nbytes / 1e6:.1f}MB)")
+                except Exception as e:
+                    print(f"商品ベクトル読み込み失敗: {e}")
+                finally:
+                    db.close()
+    return _embedding_index
+
+# ★追加: 商品検索の転置インデックス
+_search_index = None
+_search_lock = threading.Lock()
+
+def get_search_index():
+    """SearchIndex を返す。DBから読めなければ None (次に呼ばれたときにまた試す)"""
+    global _search_index
+    if _search_index is None:
+        with _search_lock:
+            if _search_index is None:
+                db = SessionLocal()
+                try:
+                    index = SearchIndex()
+                    index.load(db)
+                    _search_index = index
+                    print(f"検索インデックス作成完了 ✅ ({len(index)}件, {index.nbytes / 1e6:.1f}MB)")
+                except Exception as e:
+                    print(f"検索インデックス作成失敗: {e}")
+                finally:
+                    db.close()
+    return _search_index
+
+def refresh_index(index):
+    """他のインスタンスで追加された商品を読み込む (EmbeddingIndex / SearchIndex)"""
     db = SessionLocal()
-    try: yield db
-    finally: db.close()
+    try:
+        index.refresh(db)
+    except Exception as e:
+        print(f"インデックス更新失敗 ({type(index).__name__}): {e}")
+    finally:
+        db.close()
 
-@app.on_event("startup")
-def startup_event():
+def load_models():
+    get_recommender()
+    get_classifier()
+    get_embedding_index()
+    get_search_index()
+
+# --- アプリ ---
+def init_database():
     try:
         # DB接続を試みる
         print("DB接続を開始します...")
-        Base.metadata.create_all(bind=engine)
+        init_db()
         print("DB接続成功")
 
         # デモユーザー作成など（もしあれば）
@@ -238,12 +198,86 @@ def startup_event():
         print(f"★警告: DB接続に失敗しました。アプリは起動しますがDB機能は使えません。エラー内容: {e}")
         pass
 
+# ★変更: 起動 / 終了処理は lifespan にまとめる
+@asynccontextmanager
+async def lifespan(app):
+    await asyncio.to_thread(init_database)
+    if MODEL_PRELOAD:
+        # リクエストの受付は止めずに裏で読み込む (間に合わなければ最初のリクエストが待つ)
+        app.state.model_loader = asyncio.create_task(asyncio.to_thread(load_models))
+    category_queue.start()
+    if VIEW_LOG_MODE == "buffered":
+        view_buffer.start()
+    yield
+    await category_queue.stop()
+    # 溜まっている閲覧ログを書き出してから終了する
+    await asyncio.to_thread(view_buffer.stop)
+    await dispose_async_engine()
+
+# ★変更: レスポンスのJSON化は orjson で行う (大きな一覧で標準の json より速い)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+#origins = [
+#    "http://localhost:3000",
+#    "https://hackathon-frontend-h3av.vercel.app", # ←ここをあなたの実際のVercel URLに変えてください！
+
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"], expose_headers=["X-Next-Cursor", "X-Total-Count", "ETag"])
+
 # --- ロジック ---
-def predict_category_code(item_name: str):
-    if not CATEGORY_MASTER: return "unknown"
-    
-    # ★修正: [:50]を削除して全件渡す & プロンプトを明確化
-def predict_category_code(item_name: str):
+def image_urls(item):
+    """一覧用に (画像URL, サムネイルURL) を返す。base64本体はレスポンスに載せない"""
+    value = item.image_data
+    if not value:
+        return "", ""
+    if is_api_image_path(value):
+        return PUBLIC_BASE_URL + value, PUBLIC_BASE_URL + value + "?size=thumb"
+    if is_image_url(value):
+        return value, value # 外部URLはそのまま
+    # 未移行 (base64のまま) の行も画像APIから配信する
+    url = PUBLIC_BASE_URL + image_path(item.id)
+    return url, url + "?size=thumb"
+
+def item_summary(item):
+    """一覧の1件分 (schemas.ItemSummary の形の辞書)"""
+    image_url, thumbnail_url = image_urls(item)
+    return {
+        "id": item.id,
+        "title": item.title,
+        "description": item.description,
+        "price": item.price,
+        "image_data": image_url, # ★変更: base64ではなく画像URL
+        "thumbnail_url": thumbnail_url,
+        "status": item.status,
+        "category_code": item.category_code,
+        "category_name": CATEGORY_TRANSLATION.get(item.category_code, item.category_code),
+    }
+
+# ★追加: 一覧APIの項目選択 (?fields=id,title,price / ?view=card でカード表示用の項目だけ返す)
+def select_fields(model, fields: Optional[str], view: Optional[str]):
+    """返す項目名のリスト。指定が無ければ None (全項目)"""
+    if fields:
+        wanted = {name.strip() for name in fields.split(",") if name.strip()}
+        unknown = wanted - set(model.model_fields)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"不明な項目です: {', '.join(sorted(unknown))}")
+        return [name for name in model.model_fields if name in wanted]
+    if view == "card":
+        return list(ItemCard.model_fields)
+    if view not in (None, "", "full"):
+        raise HTTPException(status_code=400, detail="view は full / card のどちらかです")
+    return None
+
+def project(rows, names):
+    if names is None:
+        return rows
+    return [{name: row[name] for name in names} for row in rows]
+
+def classify_category_llm(item_name: str):
+    """LLMでカテゴリコードを推定する (通信エラーは例外のまま投げる)"""
+    cache_key = make_key("category", item_name)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     # ファイル読み込みをやめて、辞書のキーを使う
     categories = list(CATEGORY_TRANSLATION.keys())
     
@@ -264,106 +298,273 @@ def predict_category_code(item_name: str):
     {categories_str}
     """
     
-    try:
-        response = text_model.generate_content(prompt)
-        prediction = response.text.strip()
-        
-        # 予測されたコードが辞書にあるか確認
-        if prediction in CATEGORY_TRANSLATION:
-            return prediction
-        
+    prediction = text_model.generate(prompt).strip()
+    
+    # 予測されたコードが辞書にあるか確認
+    cat_code = "other" # 見つからない場合はその他
+    if prediction in CATEGORY_TRANSLATION:
+        cat_code = prediction
+    else:
         # 部分一致で救済（AIが少し余計な文字をつけても拾えるように）
         for key in CATEGORY_TRANSLATION:
-            if key in prediction: return key
-            
-        return "other" # 見つからない場合はその他
+            if key in prediction:
+                cat_code = key
+                break
+    
+    llm_cache.set(cache_key, cat_code)
+    return cat_code
+
+def predict_category_code_llm(item_name: str):
+    try:
+        return classify_category_llm(item_name)
     except Exception as e:
         print(f"Category Prediction Error: {e}")
         return "other"
 
-# --- API ---
+category_stats = {"local": 0, "llm": 0}
+
+def classify_category(item_name: str):
+    # ★追加: まずローカル分類器で推定し、確信度が低いときだけLLMに聞く
+    category_classifier = get_classifier()
+    if category_classifier is not None:
+        cat_code, confidence = category_classifier.predict(item_name)
+        if confidence >= CATEGORY_CONFIDENCE_THRESHOLD:
+            category_stats["local"] += 1
+            return cat_code
+    category_stats["llm"] += 1
+    return classify_category_llm(item_name)
+
+def predict_category_code(item_name: str):
+    try:
+        return classify_category(item_name)
+    except Exception as e:
+        print(f"Category Prediction Error: {e}")
+        return "other"
+
+def store_category(item_id: int, cat_code: str):
+    db = SessionLocal()
+    try:
+        # 推定待ち (NULL) のときだけ上書きする
+        updated = db.query(Item).filter(Item.id == item_id, Item.category_code.is_(None)) \
+                    .update({Item.category_code: cat_code}, synchronize_session=False)
+        if updated:
+            # ★追加: カテゴリ未定の間のいいね・閲覧は好みに数えられていないので、同じトランザクションで足す
+            deltas = {}
+            for user_id, count in db.execute(select(Like.user_id, func.count()).where(Like.item_id == item_id).group_by(Like.user_id)):
+                deltas[(user_id, cat_code)] = (count, 0)
+            for user_id, count in db.execute(select(View.user_id, func.count()).where(View.item_id == item_id).group_by(View.user_id)):
+                deltas[(user_id, cat_code)] = (deltas.get((user_id, cat_code), (0, 0))[0], count)
+            upsert_affinity(db, deltas)
+        db.commit()
+        if updated:
+            feed_cache.invalidate() # カテゴリ名・おすすめ順が変わる
+            if _search_index is not None:
+                _search_index.set_category(item_id, cat_code)
+    finally:
+        db.close()
+
+def affinity_statements(deltas):
+    """deltas: {(user_id, category_code): (いいね数の増減, 閲覧数の増減)} を加算する文のリスト
+
+    増やすだけの分は1文の UPSERT にまとめる。減らす分 (いいね解除) は既存の行だけを UPDATE し、0 未満にはしない
+    (行が無ければ減らすものも無い)。
+    """
+    rows = [
+        {"user_id": user_id, "category_code": cat, "like_count": likes, "view_count": views}
+        for (user_id, cat), (likes, views) in deltas.items() if cat
+    ]
+    increments = [row for row in rows if row["like_count"] >= 0 and row["view_count"] >= 0]
+    statements = [affinity_upsert(increments)] if increments else []
+    table = UserCategoryAffinity.__table__
+    for row in rows:
+        if row["like_count"] >= 0 and row["view_count"] >= 0:
+            continue
+        values = {}
+        for name in ("like_count", "view_count"):
+            if row[name]:
+                total = table.c[name] + row[name]
+                values[name] = case((total < 0, 0), else_=total)
+        statements.append(
+            update(table).where(table.c.user_id == row["user_id"], table.c.category_code == row["category_code"]).values(values)
+        )
+    return statements
+
+def affinity_upsert(rows):
+    """増分の行 (user_id, category_code, like_count, view_count) を1文で加算する UPSERT"""
+    table = UserCategoryAffinity.__table__
+    if engine.dialect.name == "mysql":
+        stmt = mysql_insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update(
+            like_count=table.c.like_count + stmt.inserted.like_count,
+            view_count=table.c.view_count + stmt.inserted.view_count,
+        )
+    else:
+        stmt = sqlite_insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.category_code],
+            set_={"like_count": table.c.like_count + stmt.excluded.like_count,
+                  "view_count": table.c.view_count + stmt.excluded.view_count},
+        )
+    return stmt
+
+def upsert_affinity(conn, deltas):
+    for stmt in affinity_statements(deltas):
+        conn.execute(stmt)
+
+async def upsert_affinity_async(db, deltas):
+    for stmt in affinity_statements(deltas):
+        await db.execute(stmt)
+
+def insert_views(rows):
+    # 複数行を1回のINSERTで書き込み、カテゴリ別の閲覧数もまとめて加算する
+    with engine.begin() as conn:
+        conn.execute(View.__table__.insert(), rows)
+        item_ids = {row["item_id"] for row in rows}
+        categories = dict(conn.execute(select(Item.id, Item.category_code).where(Item.id.in_(item_ids))).all())
+        deltas = {}
+        for row in rows:
+            key = (row["user_id"], categories.get(row["item_id"]))
+            deltas[key] = (0, deltas.get(key, (0, 0))[1] + 1)
+        upsert_affinity(conn, deltas)
+
+# ★追加: 閲覧ログはバッファに溜めてまとめて書き込む (VIEW_LOG_MODE=sync で従来どおり1件ずつ)
+view_buffer = ViewBuffer(insert_views, maxsize=VIEW_BUFFER_SIZE, batch_size=VIEW_FLUSH_ROWS, flush_interval=VIEW_FLUSH_INTERVAL,
+                         coalesce_key=(lambda row: (row["user_id"], row["item_id"])) if VIEW_COALESCE else None)
+
+# ★追加: カテゴリ推定はバックグラウンドで行う (出品APIはLLMを待たない)
+category_queue = CategoryQueue(
+    classify_category,
+    store_category,
+    concurrency=CATEGORY_WORKERS,
+    maxsize=CATEGORY_QUEUE_SIZE,
+)
 
-# ★追加: ユーザー認証用モデル
-class UserAuth(BaseModel):
-    username: str
-    password: str
+# --- API ---
+# ★変更: APIは async def。DBは同期Sessionをスレッドプールで動かす (DB_ASYNC=true なら非同期セッション。database.py)
+# ハッシュ計算・画像処理・LLM呼び出しのような重い同期処理は run_in_threadpool に逃がす
 
 # ★追加: 新規登録API
 @app.post("/api/register")
-def register(user_data: UserAuth, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.username == user_data.username).first():
+async def register(user_data: UserAuth, db: AsyncSession = Depends(get_session)):
+    if await db.scalar(select(User.id).where(User.username == user_data.username)) is not None:
         raise HTTPException(status_code=400, detail="このユーザー名は既に使用されています")
     
-    hashed_pw = pwd_context.hash(user_data.password)
+    hashed_pw = await run_in_threadpool(pwd_context.hash, user_data.password)
     new_user = User(username=user_data.username, hashed_password=hashed_pw)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.flush() # IDを確定させる
     
     # チャンネルも自動作成
     default_ch = Channel(user_id=new_user.id, name="メインチャンネル")
     db.add(default_ch)
-    db.commit()
+    await db.commit()
     
     return {"id": new_user.id, "username": new_user.username, "message": "登録完了"}
 
 # ★追加: ログインAPI
 @app.post("/api/login")
-def login(user_data: UserAuth, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == user_data.username).first()
-    if not user or not user.hashed_password or not pwd_context.verify(user_data.password, user.hashed_password):
+async def login(user_data: UserAuth, db: AsyncSession = Depends(get_session)):
+    user = await db.scalar(select(User).where(User.username == user_data.username).limit(1))
+    if not user or not user.hashed_password or \
+       not await run_in_threadpool(pwd_context.verify, user_data.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="ユーザー名かパスワードが間違っています")
     
     return {"id": user.id, "username": user.username, "message": "ログイン成功"}
 
 # ★追加: 購入API
 @app.post("/api/items/{item_id}/purchase")
-def purchase_item(item_id: int, req: PurchaseRequest, db: Session = Depends(get_db)):
-    item = db.query(Item).filter(Item.id == item_id).first()
-    if not item:
-        raise HTTPException(status_code=404, detail="商品が見つかりません")
-    
-    if item.status == "sold":
-        raise HTTPException(status_code=400, detail="この商品は既に売り切れています")
-    
-    # ステータス更新と購入者記録
-    item.status = "sold"
-    item.buyer_id = req.user_id
-    db.commit()
-    
-    return {"message": "購入完了", "transaction_id": item.id}
+async def purchase_item(item_id: int, req: PurchaseRequest, db: AsyncSession = Depends(get_session)):
+    # ★変更: 「販売中なら売り切れにする」を1文で行う (同時購入で二重に売れないように)
+    result = await db.execute(
+        update(Item)
+        .where(Item.id == item_id, Item.status == "on_sale")
+        .values(status="sold", buyer_id=req.user_id)
+    )
+    await db.commit()
+    
+    if result.rowcount == 0:
+        if await db.scalar(select(Item.id).where(Item.id == item_id)) is None:
+            raise HTTPException(status_code=404, detail="商品が見つかりません")
+        raise HTTPException(status_code=409, detail="この商品は既に売り切れています")
+    
+    feed_cache.invalidate()
+    if _search_index is not None:
+        _search_index.set_status(item_id, "sold")
+    return {"message": "購入完了", "transaction_id": item_id}
+
+def insert_ignore(model, values):
+    """ユニーク制約にぶつかったら何もしない INSERT (追加されたら rowcount=1)"""
+    if engine.dialect.name == "mysql":
+        return mysql_insert(model.__table__).values(values).prefix_with("IGNORE")
+    return sqlite_insert(model.__table__).values(values).on_conflict_do_nothing()
+
+async def set_like(db: AsyncSession, user_id: int, item_id: int, liked: bool):
+    """いいね状態を指定どおりにする (1文で冪等に)。状態が変わったら True"""
+    if liked:
+        changed = (await db.execute(insert_ignore(Like, {"user_id": user_id, "item_id": item_id, "created_at": datetime.now()}))).rowcount == 1
+    else:
+        changed = (await db.execute(delete(Like).where(Like.user_id == user_id, Like.item_id == item_id))).rowcount > 0
+    if changed:
+        cat_code = await db.scalar(select(Item.category_code).where(Item.id == item_id))
+        await upsert_affinity_async(db, {(user_id, cat_code): (1 if liked else -1, 0)})
+    await db.commit()
+    return changed
+
+async def set_follow(db: AsyncSession, user_id: int, channel_id: int, following: bool):
+    """フォロー状態を指定どおりにする (1文で冪等に)。状態が変わったら True"""
+    if following:
+        stmt = insert_ignore(ChannelFollow, {"user_id": user_id, "channel_id": channel_id, "created_at": datetime.utcnow()})
+    else:
+        stmt = delete(ChannelFollow).where(ChannelFollow.user_id == user_id, ChannelFollow.channel_id == channel_id)
+    changed = (await db.execute(stmt)).rowcount > 0
+    await db.commit()
+    return changed
+
+# ★追加: いいね登録 / 解除API (何度送っても同じ結果になる)
+@app.put("/api/items/{item_id}/like")
+async def like_item(item_id: int, req: PurchaseRequest, db: AsyncSession = Depends(get_session)):
+    await set_like(db, req.user_id, item_id, True)
+    return {"liked": True}
+
+@app.delete("/api/items/{item_id}/like")
+async def unlike_item(item_id: int, req: PurchaseRequest, db: AsyncSession = Depends(get_session)):
+    await set_like(db, req.user_id, item_id, False)
+    return {"liked": False}
 
 # ★追加: いいね切替API
 @app.post("/api/items/{item_id}/like")
-def toggle_like(item_id: int, req: PurchaseRequest, db: Session = Depends(get_db)):
-    # 既にいいねしているか確認
-    existing = db.query(Like).filter(Like.user_id == req.user_id, Like.item_id == item_id).first()
-    
-    if existing:
-        # あれば削除 (いいね解除)
-        db.delete(existing)
-        db.commit()
+async def toggle_like(item_id: int, req: PurchaseRequest, db: AsyncSession = Depends(get_session)):
+    # 解除できたら「いいね解除」、何も消えなければ登録
+    if await set_like(db, req.user_id, item_id, False):
         return {"liked": False}
-    else:
-        # なければ作成 (いいね登録)
-        new_like = Like(user_id=req.user_id, item_id=item_id)
-        db.add(new_like)
-        db.commit()
-        return {"liked": True}
+    await set_like(db, req.user_id, item_id, True)
+    return {"liked": True}
     
 @app.post("/api/items/{item_id}/view")
-def record_view(item_id: int, req: PurchaseRequest, db: Session = Depends(get_db)):
+async def record_view(item_id: int, req: PurchaseRequest, db: AsyncSession = Depends(get_session)):
     # 閲覧履歴を保存（何度見ても履歴は残す）
+    if view_buffer.running:
+        # ★変更: バッファに積むだけですぐ返す (満杯なら捨てる)
+        accepted = view_buffer.add({"user_id": req.user_id, "item_id": item_id, "created_at": datetime.utcnow()})
+        return {"status": "ok" if accepted else "dropped"}
     new_view = View(user_id=req.user_id, item_id=item_id)
     db.add(new_view)
-    db.commit()
+    cat_code = await db.scalar(select(Item.category_code).where(Item.id == item_id))
+    await upsert_affinity_async(db, {(req.user_id, cat_code): (0, 1)})
+    await db.commit()
     return {"status": "ok"}
 
 # ★追加: いいね一覧取得API
-@app.get("/api/users/{user_id}/likes")
-def get_user_likes(user_id: int, db: Session = Depends(get_db)):
+@app.get("/api/users/{user_id}/likes", response_model=List[LikedItem])
+async def get_user_likes(user_id: int, fields: Optional[str] = None, view: Optional[str] = None,
+                         db: AsyncSession = Depends(get_session)):
+    names = select_fields(LikedItem, fields, view)
     # Likeテーブル経由でItemを取得
-    items = db.query(Item).join(Like).filter(Like.user_id == user_id).order_by(Like.created_at.desc()).all()
+    items = (await db.scalars(
+        select(Item).join(Like)
+        .options(joinedload(Item.channel).joinedload(Channel.owner))
+        .where(Like.user_id == user_id).order_by(Like.created_at.desc())
+    )).all()
     
     # 辞書型に変換（共通処理）
     result = []
@@ -371,38 +572,26 @@ def get_user_likes(user_id: int, db: Session = Depends(get_db)):
         seller_name = "不明"
         if item.channel and item.channel.owner:
             seller_name = item.channel.owner.username
-        
-        jp_category_name = CATEGORY_TRANSLATION.get(item.category_code, item.category_code)
-        
-        result.append({
-            "id": item.id,
-            "title": item.title,
-            "description": item.description,
-            "price": item.price,
-            "image_data": item.image_data,
-            "status": item.status,
-            "category_code": item.category_code,
-            "category_name": jp_category_name,
-            "seller_name": seller_name
-        })
-    return result
+        result.append({**item_summary(item), "seller_name": seller_name})
+    return ORJSONResponse(project(result, names))
 
 # ★追加: 取引ページ用情報取得API
 @app.get("/api/items/{item_id}/transaction")
-def get_transaction(item_id: int, db: Session = Depends(get_db)):
-    item = db.query(Item).filter(Item.id == item_id).first()
+async def get_transaction(item_id: int, db: AsyncSession = Depends(get_session)):
+    item = await db.get(Item, item_id)
     if not item: raise HTTPException(status_code=404)
     
-    seller = db.query(User).join(Channel).filter(Channel.id == item.channel_id).first()
+    seller = await db.scalar(select(User).join(Channel).where(Channel.id == item.channel_id).limit(1))
     
     # ★追加: itemオブジェクトを辞書に変換し、日本語カテゴリを入れる
     jp_category_name = CATEGORY_TRANSLATION.get(item.category_code, item.category_code)
+    image_url, _ = image_urls(item)
     
     item_dict = {
         "id": item.id,
         "title": item.title,
         "price": item.price,
-        "image_data": item.image_data,
+        "image_data": image_url,
         "description": item.description,
         "category_name": jp_category_name # ★ここが重要！
     }
@@ -413,22 +602,29 @@ def get_transaction(item_id: int, db: Session = Depends(get_db)):
     }
 
 # ★追加: ユーザーのチャンネル一覧取得
-@app.get("/api/users/{user_id}/channels")
-def get_user_channels(user_id: int, db: Session = Depends(get_db)):
-    return db.query(Channel).filter(Channel.user_id == user_id).all()
+@app.get("/api/users/{user_id}/channels", response_model=List[ChannelOut])
+async def get_user_channels(user_id: int, db: AsyncSession = Depends(get_session)):
+    return (await db.scalars(select(Channel).where(Channel.user_id == user_id))).all()
 
 # ★追加: 新規チャンネル作成
-@app.post("/api/channels")
-def create_channel(req: ChannelCreate, db: Session = Depends(get_db)):
+@app.post("/api/channels", response_model=ChannelOut)
+async def create_channel(req: ChannelCreate, db: AsyncSession = Depends(get_session)):
     new_ch = Channel(user_id=req.user_id, name=req.name)
     db.add(new_ch)
-    db.commit()
-    db.refresh(new_ch)
+    await db.commit()
+    await db.refresh(new_ch)
+    feed_cache.invalidate()
     return new_ch
 
 
 @app.post("/api/ai/analyze_item")
-async def analyze_item(request: AnalysisRequest):
+async def analyze_item(request: AnalysisRequest, http_request: Request):
+    # チャンネルの並び順は結果に影響しないのでキーでは並べ替える
+    cache_key = make_key("analyze", request.item_name, request.item_description, sorted(request.existing_channels))
+    cached = await llm_cache.aget(cache_key) # ★変更: SQLite の読み込みはスレッドで
+    if cached is not None:
+        return cached
+
     channels_str = ", ".join(request.existing_channels) if request.existing_channels else "なし"
     # ★修正: 「無関係なキーワードの羅列」を厳しくチェックするプロンプトに変更
     prompt = f"""
@@ -449,195 +645,314 @@ async def analyze_item(request: AnalysisRequest):
     - "new_channel_suggestion": (String) A recommended name for a NEW channel (e.g. "スニーカー", "家電") if existing ones don't fit.
     """
     try:
-        response = ai_model.generate_content(prompt)
+        # ★変更: イベントループを塞がないよう非同期APIで呼ぶ
+        response_text = await ai_gateway.generate(prompt, is_disconnected=http_request.is_disconnected)
         # マークダウン記法の除去
-        clean_text = response.text.replace("```json", "").replace("```", "").strip()
-        return json.loads(clean_text)
+        clean_text = response_text.replace("```json", "").replace("```", "").strip()
+        result = json.loads(clean_text)
+        await llm_cache.aset(cache_key, result) # エラー時の応答はキャッシュしない
+        return result
+    except asyncio.CancelledError:
+        # クライアントが切断した (返す相手がいない)
+        raise
+    except asyncio.TimeoutError:
+        print("AI Error: タイムアウト")
+        return {"suggested_channel": "不明", "is_valid": False, "reason": "AIの応答がタイムアウトしました", "new_channel_suggestion": "その他"}
     except Exception as e:
         print(f"AI Error: {e}")
         return {"suggested_channel": "不明", "is_valid": False, "reason": "AIエラーが発生しました", "new_channel_suggestion": "その他"}
 
 @app.post("/api/items")
-def create_item(item: ItemCreate, db: Session = Depends(get_db)):
+async def create_item(item: ItemCreate, db: AsyncSession = Depends(get_session)):
     # 指定されたチャンネルが存在するか確認
-    channel = db.query(Channel).filter(Channel.id == item.channel_id).first()
+    channel = await db.get(Channel, item.channel_id)
     if not channel:
         raise HTTPException(status_code=400, detail="無効なチャンネルIDです")
 
-    cat_code = predict_category_code(item.title)
+    # ★変更: base64画像は item_images に分けて保存する
+    image = await run_in_threadpool(decode_image_payload, item.image_data)
+    if item.image_data and not image and not is_image_url(item.image_data):
+        # URLでも画像としてデコードできるbase64でもないものは保存しない (保存すると画像URLが404になる)
+        raise HTTPException(status_code=400, detail="画像データを読み込めません")
+    vector = embed(item.title, item.description) # ★追加: 関連商品用のベクトル
     
     new_item = Item(
         channel_id=item.channel_id, # ★ここが変わりました
         title=item.title, 
         description=item.description,
         price=item.price, 
-        image_data=item.image_data, 
-        category_code=cat_code
+        image_data=None if image else item.image_data, 
+        category_code=None, # ★変更: カテゴリは推定待ち (バックグラウンドで埋める)
+        feature_vector=encode_vector(vector),
     )
     db.add(new_item)
-    db.commit()
+    if image:
+        await db.flush() # IDを確定させる
+        new_item.image_data = image_path(new_item.id)
+        db.add(await run_in_threadpool(build_item_image, new_item.id, *image)) # サムネイル作成
+    await db.commit()
+    feed_cache.invalidate()
+    if _embedding_index is not None: # 未読み込みなら読み込むときに入る
+        await run_in_threadpool(_embedding_index.add, new_item.id, vector)
+    if _search_index is not None:
+        await run_in_threadpool(_search_index.add, new_item.id, new_item.title, new_item.description, new_item.price, None,
+                                new_item.status or "on_sale")
+
+    # キューが止まっている / 満杯のときはその場で推定する
+    if not category_queue.submit(new_item.id, new_item.title):
+        await run_in_threadpool(lambda: store_category(new_item.id, predict_category_code(new_item.title)))
     return {"message": "登録完了", "id": new_item.id}
 
-@app.get("/api/users/{user_id}/items")
-def get_user_items(user_id: int, db: Session = Depends(get_db)):
+# ★追加: バックグラウンド処理の状況
+@app.get("/api/metrics")
+def get_metrics():
+    return {"category_queue": category_queue.stats(), "category_classifier": dict(category_stats),
+            "llm_cache": llm_cache.stats(),
+            "llm_async": ai_gateway.stats(),
+            "view_buffer": view_buffer.stats(),
+            "feed_cache": feed_cache.stats(),
+            "recommend_pipeline": recommend_pipeline.stats(),
+            "recommender": dict(_recommender_info),
+            "db_pool": pool_stats(engine),
+            "db_async_pool": pool_stats(get_async_engine()) if DB_ASYNC else None}
+
+# ★追加: 商品画像の配信 (size=thumb でサムネイル)
+@app.get("/api/items/{item_id}/image")
+async def get_item_image(item_id: int, size: str = Query("full", pattern="^(full|thumb)$"), if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_session)):
+    image = await db.get(ItemImage, item_id)
+    if image:
+        if size == "thumb":
+            data, content_type, etag = image.thumbnail, image.thumbnail_content_type, image.thumbnail_etag
+        else:
+            data, content_type, etag = image.data, image.content_type, image.etag
+    else:
+        # 未移行の行は items.image_data から直接返す
+        value = await db.scalar(select(Item.image_data).where(Item.id == item_id))
+        decoded = decode_image_payload(value)
+        if not decoded:
+            raise HTTPException(status_code=404, detail="画像が見つかりません")
+        data, content_type = decoded
+        etag = etag_for(data)
+
+    headers = {"ETag": f'"{etag}"', "Cache-Control": IMAGE_CACHE_CONTROL}
+    if if_none_match and etag in if_none_match:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=content_type, headers=headers)
+
+@app.get("/api/users/{user_id}/items", response_model=List[ItemSummary])
+async def get_user_items(user_id: int, fields: Optional[str] = None, view: Optional[str] = None,
+                         db: AsyncSession = Depends(get_session)):
+    names = select_fields(ItemSummary, fields, view)
     # Channel経由でItemを取得
-    items = db.query(Item).join(Channel).filter(Channel.user_id == user_id).order_by(Item.id.desc()).all()
+    items = (await db.scalars(select(Item).join(Channel).where(Channel.user_id == user_id).order_by(Item.id.desc()))).all()
     
     # ★追加: 日本語カテゴリ名などを付与して辞書リストにする
-    result = []
-    for item in items:
-        # 辞書から日本語名を取得
-        jp_category_name = CATEGORY_TRANSLATION.get(item.category_code, item.category_code)
-        
-        result.append({
-            "id": item.id,
-            "title": item.title,
-            "description": item.description,
-            "price": item.price,
-            "image_data": item.image_data,
-            "status": item.status,
-            "category_code": item.category_code,
-            "category_name": jp_category_name, # ★ここが重要！
-        })
-    return result
+    return ORJSONResponse(project([item_summary(item) for item in items], names))
+
+# ★追加: チャンネルフォロー / フォロー解除API (何度送っても同じ結果になる)
+@app.put("/api/channels/{channel_id}/follow")
+async def follow_channel(channel_id: int, req: PurchaseRequest, db: AsyncSession = Depends(get_session)):
+    await set_follow(db, req.user_id, channel_id, True)
+    return {"following": True}
+
+@app.delete("/api/channels/{channel_id}/follow")
+async def unfollow_channel(channel_id: int, req: PurchaseRequest, db: AsyncSession = Depends(get_session)):
+    await set_follow(db, req.user_id, channel_id, False)
+    return {"following": False}
 
 # ★追加: チャンネルフォロー切替API
 @app.post("/api/channels/{channel_id}/follow")
-def toggle_channel_follow(channel_id: int, req: PurchaseRequest, db: Session = Depends(get_db)):
-    existing = db.query(ChannelFollow).filter(
-        ChannelFollow.user_id == req.user_id, 
-        ChannelFollow.channel_id == channel_id
-    ).first()
-    
-    if existing:
-        db.delete(existing)
-        db.commit()
+async def toggle_channel_follow(channel_id: int, req: PurchaseRequest, db: AsyncSession = Depends(get_session)):
+    if await set_follow(db, req.user_id, channel_id, False):
         return {"following": False}
-    else:
-        new_follow = ChannelFollow(user_id=req.user_id, channel_id=channel_id)
-        db.add(new_follow)
-        db.commit()
-        return {"following": True}
+    await set_follow(db, req.user_id, channel_id, True)
+    return {"following": True}
 
 # ★追加: 自分がフォローしているチャンネルIDリストを取得
 @app.get("/api/users/{user_id}/following")
-def get_following_channels(user_id: int, db: Session = Depends(get_db)):
-    follows = db.query(ChannelFollow).filter(ChannelFollow.user_id == user_id).all()
-    return [f.channel_id for f in follows]
-
-@app.get("/api/items")
-def get_items(sort: str = "recommend", user_id: Optional[int] = None, db: Session = Depends(get_db)):
-    # チャンネルとユーザー情報を結合して取得
-    items = db.query(Item).outerjoin(Channel).outerjoin(User).all()
-    
+async def get_following_channels(user_id: int, db: AsyncSession = Depends(get_session)):
+    return (await db.scalars(select(ChannelFollow.channel_id).where(ChannelFollow.user_id == user_id))).all()
+
+@app.get("/api/items", response_model=List[FeedItem])
+async def get_items(
+    sort: str = "recommend",
+    user_id: Optional[int] = None,
+    limit: int = Query(ITEMS_PAGE_SIZE, ge=1, le=ITEMS_PAGE_SIZE_MAX),
+    cursor: Optional[int] = None,
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_session),
+):
+    # ★変更: 全件取得をやめてDB側でページングする
+    # cursor の意味: new / following は「前ページ最後のID」(キーセット)、recommend は「オフセット」
+    # 次ページの cursor はレスポンスヘッダ X-Next-Cursor で返す
+    names = select_fields(FeedItem, fields, view)
+    if sort == "recommend":
+        check_recommender_reload() # キャッシュから返すときも確認する
+    # ★追加: 新着順 / 未ログインのおすすめ順は誰が見ても同じなので、組み立て済みのページを共有する (ヒット時はDBに触れない)
+    if sort == "new" or (sort == "recommend" and not user_id):
+        async def build():
+            result, next_cursor = await build_items_page(db, sort, None, limit, cursor)
+            return orjson.dumps(project(result, names)), next_cursor
+
+        page = await feed_cache.get_or_build((sort, limit, cursor, tuple(names or ())), build)
+        headers = {"ETag": f'"{page.etag}"', "Cache-Control": FEED_CACHE_CONTROL}
+        if page.next_cursor is not None:
+            headers["X-Next-Cursor"] = str(page.next_cursor)
+        if page.matches(if_none_match):
+            feed_cache.count_not_modified()
+            return Response(status_code=304, headers=headers)
+        return Response(content=page.body, media_type="application/json", headers=headers)
+
+    timings = {}
+    result, next_cursor = await build_items_page(db, sort, user_id, limit, cursor, timings)
+    response = ORJSONResponse(project(result, names))
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    if timings:
+        response.headers["Server-Timing"] = ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in timings.items())
+    return response
+
+async def build_items_page(db: AsyncSession, sort: str, user_id: Optional[int], limit: int, cursor: Optional[int],
+                           timings: Optional[dict] = None):
+    """一覧の1ページ分を (辞書のリスト, 次ページの cursor) で返す。timings を渡すとおすすめ順の各段の所要時間 (ms) を入れる"""
     sorted_items_list = []
-
-    # --- パターンC: フォロー中のみ ---
-    if sort == "following":
-        if not user_id:
-            return []
-        followed_channel_ids = db.query(ChannelFollow.channel_id).filter(ChannelFollow.user_id == user_id).all()
-        target_ids = [f[0] for f in followed_channel_ids]
-        filtered_items = [i for i in items if i.channel_id in target_ids]
-        sorted_items_list = sorted(filtered_items, key=lambda x: x.id, reverse=True)
-
-    # --- パターンA: 新着順 ---
-    elif sort == "new":
-        sorted_items_list = sorted(items, key=lambda x: x.id, reverse=True)
-    
-    # --- パターンB: おすすめ順 (機械学習) ---
+    next_cursor = None
+
+    # --- パターンC: フォロー中のみ / パターンA: 新着順 ---
+    if sort in ("following", "new"):
+        query = select(Item).options(joinedload(Item.channel).joinedload(Channel.owner))
+        if sort == "following":
+            if not user_id:
+                return [], None
+            followed = select(ChannelFollow.channel_id).where(ChannelFollow.user_id == user_id)
+            query = query.where(Item.channel_id.in_(followed))
+        if cursor is not None:
+            query = query.where(Item.id < cursor)
+        # 1件多く取って次ページの有無を判定
+        page = (await db.scalars(query.order_by(Item.id.desc()).limit(limit + 1))).all()
+        sorted_items_list = page[:limit]
+        if len(page) > limit:
+            next_cursor = sorted_items_list[-1].id
+
+    # --- パターンB: おすすめ順 ---
+    # ★変更: 候補生成 -> ランキング -> 多様性の並べ替え (recommend_pipeline.py)。並べ替えは (id, カテゴリ) だけで行い、
+    #         表示するページの分だけ商品を読み込む
     else:
-        if rec_model is None or rec_prefs is None:
-            # モデルがない場合は新着順にフォールバック
-            sorted_items_list = sorted(items, key=lambda x: x.id, reverse=True)
-        else:
-            DEMO_USER_ID = 555696053 
-            
-            # --- 行動ログ（いいね・閲覧）の集計 ---
-            liked_categories = []
-            view_counts = {}
-            if user_id:
-                # いいね
-                liked_items = db.query(Item).join(Like).filter(Like.user_id == user_id).all()
-                liked_categories = [i.category_code for i in liked_items if i.category_code]
-                # 閲覧
-                try:
-                    views = db.query(Item.category_code, func.count(View.id)) \
-                            .join(View, Item.id == View.item_id) \
-                            .filter(View.user_id == user_id) \
-                            .group_by(Item.category_code).all()
-                    view_counts = {cat: count for cat, count in views}
-                except:
-                    pass
-
-            scored_items = []
-            for item in items:
-                # 基礎スコア (pkl由来)
-                user_cat_score = 0
-                if item.category_code:
-                    match = rec_prefs[(rec_prefs['user_id'] == DEMO_USER_ID) & (rec_prefs['category_code'] == item.category_code)]
-                    if not match.empty: 
-                        user_cat_score = float(match.iloc[0]['score'])
-                
-                # 行動ブースト (ここでリアルタイム性を出す)
-                if item.category_code in liked_categories:
-                    user_cat_score += 50.0 # いいねは強力
-                
-                v_count = view_counts.get(item.category_code, 0)
-                user_cat_score += min(v_count * 1.0, 10.0) # 閲覧は回数に応じて
-
-                # 確率計算
-                try:
-                    input_df = pd.DataFrame([[user_cat_score]], columns=['score'])
-                    # ロジスティック回帰モデルで確率を算出
-                    prob = float(rec_model.predict_proba(input_df)[0][1])
-                except:
-                    # モデルがエラーを吐いた場合はスコアをそのまま順位付けに使う
-                    prob = float(user_cat_score)
-
-                scored_items.append({"item": item, "prob": prob})
-            
-            # 【重要】ソート順: 確率(prob)の降順。確率が全く同じ場合のみ新着順。
-            scored_items.sort(key=lambda x: (x["prob"], x["item"].id), reverse=True)
-            sorted_items_list = [x["item"] for x in scored_items]
+        # 読み込み前ならスレッドプールで待つ (イベントループは止めない)
+        rec_model, rec_index = _recommender or await run_in_threadpool(get_recommender)
+        ranked = await recommend_pipeline.run(db, user_id, rec_model, rec_index)
+
+        offset = cursor or 0
+        if offset + limit < len(ranked.item_ids):
+            next_cursor = offset + limit
+        page_ids = ranked.item_ids[offset:offset + limit]
+
+        started = time.perf_counter()
+        items = {}
+        if page_ids:
+            items = {item.id: item for item in (await db.scalars(
+                select(Item).options(joinedload(Item.channel).joinedload(Channel.owner)).where(Item.id.in_(page_ids))
+            )).all()}
+        sorted_items_list = [items[i] for i in page_ids if i in items]
+        hydrate_ms = (time.perf_counter() - started) * 1000
+        recommend_pipeline.record("hydrate", hydrate_ms)
+        if timings is not None:
+            timings.update(ranked.timings, hydrate=hydrate_ms)
 
     # --- 結果の整形 ---
-    result = []
-    for item in sorted_items_list:
-        seller_name = "不明"
-        seller_id = -1
-        channel_name = "未設定チャンネル"
-        channel_id = -1
-
-        if item.channel:
-            channel_name = item.channel.name
-            channel_id = item.channel.id
-            if item.channel.owner:
-                seller_name = item.channel.owner.username
-                seller_id = item.channel.owner.id
-        
-        jp_category_name = CATEGORY_TRANSLATION.get(item.category_code, item.category_code)
-        
-        result.append({
-            "id": item.id,
-            "title": item.title,
-            "description": item.description,
-            "price": item.price,
-            "image_data": item.image_data,
-            "status": item.status,
-            "category_code": item.category_code,
-            "category_name": jp_category_name,
-            "seller_id": seller_id,
-            "seller_name": seller_name,
-            "channel_id": channel_id,
-            "channel_name": channel_name
-        })
+    return [feed_item(item) for item in sorted_items_list], next_cursor
+
+def feed_item(item):
+    """一覧 (schemas.FeedItem) の1件分。item.channel / owner は joinedload 済みであること"""
+    seller_name = "不明"
+    seller_id = -1
+    channel_name = "未設定チャンネル"
+    channel_id = -1
+
+    if item.channel:
+        channel_name = item.channel.name
+        channel_id = item.channel.id
+        if item.channel.owner:
+            seller_name = item.channel.owner.username
+            seller_id = item.channel.owner.id
     
-    return result
+    return {
+        **item_summary(item),
+        "seller_id": seller_id,
+        "seller_name": seller_name,
+        "channel_id": channel_id,
+        "channel_name": channel_name
+    }
 
 
-@app.get("/api/items/{item_id}/related")
-def get_related(item_id: int, db: Session = Depends(get_db)):
-    target = db.query(Item).filter(Item.id == item_id).first()
+@app.get("/api/items/{item_id}/related", response_model=List[ItemSummary])
+async def get_related(item_id: int, db: AsyncSession = Depends(get_session)):
+    target = await db.get(Item, item_id)
     if not target: return []
-    return db.query(Item).filter(Item.category_code == target.category_code, Item.id != item_id).limit(3).all()
\ No newline at end of file
+    # ★変更: 同じカテゴリの先頭3件ではなく、タイトル・説明文のベクトルが近い順に返す
+    index = _embedding_index or await run_in_threadpool(get_embedding_index)
+    if index is None:
+        # ベクトルを読み込めないときは同じカテゴリから
+        items = (await db.scalars(select(Item).where(Item.category_code == target.category_code, Item.id != item_id).limit(RELATED_ITEMS_LIMIT))).all()
+        # ★変更: ORMオブジェクトをそのまま返さない (base64画像などの全カラムがレスポンスに載っていた)
+        return [item_summary(item) for item in items]
+    if index.refresh_due():
+        threading.Thread(target=refresh_index, args=(index,), daemon=True).start()
+
+    vector = embed(target.title, target.description) # 保存済みのベクトルと同じ値になる
+    if item_id not in index:
+        await run_in_threadpool(index.add, item_id, vector) # 行列を広げるときのコピーでループを止めない
+    related_ids = await run_in_threadpool(index.neighbors, vector, RELATED_ITEMS_LIMIT, item_id)
+    if not related_ids:
+        return []
+    items = {item.id: item for item in (await db.scalars(select(Item).where(Item.id.in_(related_ids)))).all()}
+    return [item_summary(items[i]) for i in related_ids if i in items]
+
+
+# ★追加: 商品検索 (タイトル・説明文の文字 bigram の転置インデックス)
+# cursor は「オフセット」。次ページの cursor はヘッダ X-Next-Cursor、条件に合う件数は X-Total-Count で返す
+@app.get("/api/items/search", response_model=List[FeedItem])
+async def search_items(
+    q: str = Query(..., min_length=1, max_length=100),
+    category: Optional[str] = None,
+    min_price: Optional[int] = Query(None, ge=0),
+    max_price: Optional[int] = Query(None, ge=0),
+    include_sold: bool = False,
+    limit: int = Query(ITEMS_PAGE_SIZE, ge=1, le=ITEMS_PAGE_SIZE_MAX),
+    cursor: Optional[int] = Query(None, ge=0),
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+    db: AsyncSession = Depends(get_session),
+):
+    names = select_fields(FeedItem, fields, view)
+    offset = cursor or 0
+    total = None
+    index = _search_index or await run_in_threadpool(get_search_index)
+    if index is None:
+        # インデックスを作れないときは LIKE で探す (全件走査なので遅い)
+        stmt = like_search(q, category, min_price, max_price, include_sold).offset(offset).limit(limit + 1)
+        item_ids = (await db.scalars(stmt)).all()
+        has_next = len(item_ids) > limit
+        item_ids = item_ids[:limit]
+    else:
+        if index.refresh_due():
+            threading.Thread(target=refresh_index, args=(index,), daemon=True).start()
+        item_ids, total = await run_in_threadpool(index.search, q, category, min_price, max_price, include_sold, offset, limit)
+        has_next = offset + limit < total
+
+    items = {}
+    if item_ids:
+        items = {item.id: item for item in (await db.scalars(
+            select(Item).options(joinedload(Item.channel).joinedload(Channel.owner)).where(Item.id.in_(item_ids))
+        )).all()}
+    # 他のインスタンスで売れた商品はインデックスに反映されていないことがあるので、DBの状態でも確認する
+    result = [feed_item(items[i]) for i in item_ids if i in items and (include_sold or items[i].status == "on_sale")]
+
+    response = ORJSONResponse(project(result, names))
+    if has_next:
+        response.headers["X-Next-Cursor"] = str(offset + limit)
+    if total is not None:
+        response.headers["X-Total-Count"] = str(total)
+    return response
@@ -1,66 +1,149 @@
 # migrate.py
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from main import Item, Base  # main.pyからモデルを読み込む
-import google.generativeai as genai
+# カテゴリ未設定の商品にカテゴリを付けるバックフィル
+#
+# 使い方: python migrate.py [--database-url URL] [--chunk 200] [--batch 25] [--workers 4] [--reset]
+# - ID順にチャンク単位で読み込み、チャンクごとにコミットする
+# - 1回のプロンプトで複数の商品名をまとめて分類し、複数スレッドで並列に投げる
+# - 進捗はチェックポイントファイルに保存し、途中で止めても続きから再開できる
+# SQLite (開発用DB) / MySQL のどちらでも動く。
+import argparse
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import update, or_
+from sqlalchemy.orm import sessionmaker
+from models import Item, init_db
+from categories import CATEGORY_TRANSLATION
+from config import CATEGORY_CONFIDENCE_THRESHOLD
+from category_classifier import get_classifier
+from llm import make_client
+from database import make_engine
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Gemini設定
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel('gemini-2.0-flash')
+# Gemini設定 (JSONで返させる)
+model = make_client('gemini-2.0-flash', {"temperature": 0.0, "response_mime_type": "application/json"}, stub_response="{}")
 
-# DB接続
-SQLALCHEMY_DATABASE_URL = "sqlite:///./local_dev.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
-db = SessionLocal()
+DEFAULT_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./local_dev.db")
+CHECKPOINT_PATH = "migrate_checkpoint.json"
+MAX_RETRIES = 3
 
-def load_categories():
-    with open("category_list.txt", "r", encoding="utf-8") as f:
-        return [line.strip() for line in f.readlines() if line.strip()]
 
-def predict_category(item_name, categories):
-    # カテゴリリストを文字列化してプロンプトに埋め込む
+def predict_categories(titles, categories):
+    """複数の商品名をまとめて分類する。リストにないコードは "other" にする"""
     cat_str = "\n".join(categories)
+    numbered = "\n".join(f"{i}: {title}" for i, title in enumerate(titles))
     prompt = f"""
-    以下の商品に最も適したカテゴリを、リストの中から1つだけ選んで返してください。
-    余計な説明は不要です。リスト内の文字列そのものを返してください。
+    以下の各商品に最も適したカテゴリを、リストの中から1つずつ選んでください。
+    出力は {{"番号": "カテゴリコード"}} 形式のJSONオブジェクトのみとし、余計な説明は不要です。
 
     [商品名]
-    {item_name}
+    {numbered}
 
     [カテゴリリスト]
     {cat_str}
     """
+    for attempt in range(MAX_RETRIES):
+        try:
+            text = model.generate(prompt)
+            answer = json.loads(text.replace("```json", "").replace("```", "").strip())
+            # 幻覚防止: リストに存在するか確認
+            return [answer.get(str(i)) if answer.get(str(i)) in categories else "other" for i in range(len(titles))]
+        except Exception as e:
+            print(f"Error (試行 {attempt + 1}/{MAX_RETRIES}): {e}")
+            if attempt + 1 < MAX_RETRIES: # 最後の試行のあとは待たない
+                time.sleep(2 ** attempt)
+    return [None] * len(titles) # 失敗した分は未設定のまま残す
+
+
+def classify(rows, categories, batch_size, pool):
+    """[(id, title)] -> {id: category_code}。ローカル分類器で確信が持てるものはLLMに投げない"""
+    results = {}
+    remaining = []
+    category_classifier = get_classifier()
+    for item_id, title in rows:
+        if category_classifier is not None:
+            code, confidence = category_classifier.predict(title or "")
+            if confidence >= CATEGORY_CONFIDENCE_THRESHOLD:
+                results[item_id] = code
+                continue
+        remaining.append((item_id, title or ""))
+
+    batches = [remaining[i:i + batch_size] for i in range(0, len(remaining), batch_size)]
+    answers = pool.map(lambda b: predict_categories([t for _, t in b], categories), batches)
+    for batch, codes in zip(batches, answers):
+        for (item_id, _), code in zip(batch, codes):
+            if code is not None:
+                results[item_id] = code
+    return results
+
+
+def load_checkpoint(path):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"last_id": 0, "updated": 0}
+
+
+def save_checkpoint(path, checkpoint):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path) # 書き込み途中で落ちても壊れない
+
+
+def migrate(database_url, chunk_size, batch_size, workers, checkpoint_path, reset):
+    engine = make_engine(database_url)
+    init_db(bind=engine) # 新しいDBでもテーブルを作ってから読む
+    SessionLocal = sessionmaker(bind=engine)
+    categories = list(CATEGORY_TRANSLATION.keys())
+    checkpoint = {"last_id": 0, "updated": 0} if reset else load_checkpoint(checkpoint_path)
+    if checkpoint["last_id"]:
+        print(f"チェックポイントから再開: ID {checkpoint['last_id']} 以降")
+
+    started = time.time()
+    processed = 0
+    db = SessionLocal()
     try:
-        response = model.generate_content(prompt)
-        prediction = response.text.strip()
-        # 幻覚防止: リストに存在するか確認
-        if prediction in categories:
-            return prediction
-        else:
-            return "unknown"
-    except Exception as e:
-        print(f"Error: {e}")
-        return "unknown"
-
-def migrate():
-    categories = load_categories()
-    items = db.query(Item).filter((Item.category_code == None) | (Item.category_code == "")).all()
-    
-    print(f"対象アイテム数: {len(items)}件")
-    
-    for item in items:
-        print(f"処理中: {item.title} ...", end=" ")
-        cat = predict_category(item.title, categories)
-        item.category_code = cat
-        print(f"-> {cat}")
-    
-    db.commit()
-    print("マイグレーション完了！")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                rows = db.query(Item.id, Item.title) \
+                         .filter(or_(Item.category_code == None, Item.category_code == ""), Item.id > checkpoint["last_id"]) \
+                         .order_by(Item.id) \
+                         .limit(chunk_size).all()
+                if not rows:
+                    break
+
+                results = classify(rows, categories, batch_size, pool)
+                if results:
+                    db.execute(update(Item), [{"id": item_id, "category_code": code} for item_id, code in results.items()])
+                db.commit()
+
+                processed += len(rows)
+                checkpoint["last_id"] = rows[-1][0]
+                checkpoint["updated"] += len(results)
+                save_checkpoint(checkpoint_path, checkpoint)
+                elapsed = time.time() - started
+                print(f"~ ID {checkpoint['last_id']}: {processed}件処理 / {len(rows) - len(results)}件失敗 ({processed / max(elapsed, 1e-9):.1f}件/秒)")
+    finally:
+        db.close()
+
+    elapsed = time.time() - started
+    print(f"マイグレーション完了！ {processed}件 / {elapsed:.1f}秒 ({processed / max(elapsed, 1e-9):.1f}件/秒)")
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
 
 if __name__ == "__main__":
-    migrate()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="カテゴリ未設定の商品をLLMで分類する")
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL)
+    parser.add_argument("--chunk", type=int, default=200, help="1回のコミットで処理する件数")
+    parser.add_argument("--batch", type=int, default=25, help="1プロンプトにまとめる商品数")
+    parser.add_argument("--workers", type=int, default=4, help="並列に投げるプロンプト数")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--reset", action="store_true", help="チェックポイントを無視して最初からやり直す")
+    args = parser.parse_args()
+    migrate(args.database_url, args.chunk, args.batch, args.workers, args.checkpoint, args.reset)
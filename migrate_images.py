@@ -0,0 +1,60 @@
+# migrate_images.py
+# items.image_data に入っている base64 画像を item_images テーブルへ移すバックフィル
+# 使い方: python migrate_images.py [--chunk 100]
+# ID順に少しずつ読み込み、チャンクごとにコミットするので途中で止めても再実行できる。
+import argparse
+import time
+
+from sqlalchemy import or_
+
+from database import SessionLocal
+from models import Item, ItemImage, build_item_image, image_path
+from images import decode_image_payload
+
+
+def legacy_rows(db, after_id, chunk):
+    # URLが入っている行 (移行済み / 外部画像) は対象外
+    return db.query(Item.id, Item.image_data) \
+             .filter(Item.id > after_id,
+                     Item.image_data.isnot(None),
+                     Item.image_data != "",
+                     ~or_(Item.image_data.like("http://%"), Item.image_data.like("https://%"),
+                          Item.image_data.like("/api/items/%/image"))) \
+             .order_by(Item.id) \
+             .limit(chunk).all()
+
+
+def migrate(chunk):
+    db = SessionLocal()
+    last_id = 0
+    moved = skipped = 0
+    started = time.time()
+    try:
+        while True:
+            rows = legacy_rows(db, last_id, chunk)
+            if not rows:
+                break
+            for item_id, value in rows:
+                decoded = decode_image_payload(value)
+                if not decoded:
+                    print(f"スキップ: item {item_id} (画像としてデコードできません)")
+                    skipped += 1
+                    continue
+                if db.query(ItemImage.item_id).filter(ItemImage.item_id == item_id).first() is None:
+                    db.add(build_item_image(item_id, *decoded))
+                db.query(Item).filter(Item.id == item_id).update({Item.image_data: image_path(item_id)}, synchronize_session=False)
+                moved += 1
+            db.commit()
+            last_id = rows[-1][0]
+            elapsed = time.time() - started
+            print(f"~ item {last_id}: 移行 {moved}件 / スキップ {skipped}件 ({moved / max(elapsed, 1e-9):.1f}件/秒)")
+    finally:
+        db.close()
+    print(f"画像の移行完了！ 移行 {moved}件 / スキップ {skipped}件")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="items.image_data の base64 画像を item_images に移行する")
+    parser.add_argument("--chunk", type=int, default=100, help="1回のコミットで処理する件数")
+    args = parser.parse_args()
+    migrate(args.chunk)
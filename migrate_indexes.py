@@ -0,0 +1,91 @@
+# migrate_indexes.py
+# 既存DBにインデックス / ユニーク制約を追加するマイグレーション
+# 使い方: python migrate_indexes.py [--dry-run]
+# create_all は既存テーブルにインデックスを足さないので、models.py のモデル定義との差分をここで作る。
+# ユニークインデックスを張る前に、重複している いいね / フォロー を古い1件だけ残して削除する。
+# 既存のインデックス (MySQL が外部キーに自動で張るものなど) の先頭の列で足りるものは追加しない。
+import argparse
+
+from sqlalchemy import inspect, text
+
+from database import engine, Base, SessionLocal
+import models  # テーブル定義を Base に登録する
+import rebuild_affinity
+
+# ユニークインデックス名 -> (テーブル, 重複判定の列)
+DEDUPE = {
+    "uq_likes_user_item": ("likes", ("user_id", "item_id")),
+    "uq_channel_follows_user_channel": ("channel_follows", ("user_id", "channel_id")),
+}
+
+
+def remove_duplicates(conn, table, columns):
+    cols = ", ".join(columns)
+    # MySQLは削除対象と同じテーブルをサブクエリで直接参照できないので派生テーブルを挟む
+    result = conn.execute(text(
+        f"DELETE FROM {table} WHERE id NOT IN "
+        f"(SELECT id FROM (SELECT MIN(id) AS id FROM {table} GROUP BY {cols}) AS keep_rows)"
+    ))
+    return result.rowcount
+
+
+def covered_by(index, existing):
+    """同じ列で始まる既存のインデックスがあればその名前 (ユニークは同じ列のユニークだけで代わりになる)"""
+    columns = [c.name for c in index.columns]
+    for ix in existing:
+        if ix["column_names"][:len(columns)] != columns:
+            continue
+        if index.unique and not (ix.get("unique") and len(ix["column_names"]) == len(columns)):
+            continue
+        return ix["name"]
+    return None
+
+
+def migrate(dry_run=False):
+    inspector = inspect(engine)
+    missing = [t for t in Base.metadata.sorted_tables if not inspector.has_table(t.name)]
+    for table in missing:
+        print(f"テーブル作成: {table.name}")
+    if not dry_run:
+        Base.metadata.create_all(bind=engine) # 足りないテーブルを先に作る
+        inspector = inspect(engine)
+    removed_likes = 0
+    for table in Base.metadata.sorted_tables:
+        if table in missing:
+            continue # 作ったばかり (dry-run なら作る予定) のテーブルはインデックスも揃っている
+        existing = inspector.get_indexes(table.name)
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            if index.name in {ix["name"] for ix in existing}:
+                continue
+            covering = covered_by(index, existing)
+            if covering:
+                print(f"スキップ: {table.name}.{index.name} ({covering} で足りる)")
+                continue
+            print(f"追加: {table.name}.{index.name} ({', '.join(c.name for c in index.columns)})")
+            if dry_run:
+                continue
+            with engine.begin() as conn:
+                if index.name in DEDUPE:
+                    dup_table, columns = DEDUPE[index.name]
+                    n = remove_duplicates(conn, dup_table, columns)
+                    if n:
+                        print(f"  重複を削除: {dup_table} {n}件")
+                    if dup_table == "likes":
+                        removed_likes += n
+                index.create(bind=conn)
+
+    if removed_likes:
+        # いいねを消したので集計テーブルも作り直す
+        db = SessionLocal()
+        try:
+            rebuild_affinity.rebuild(db)
+        finally:
+            db.close()
+    print("インデックスの追加完了！" if not dry_run else "(dry-run のため変更していません)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="既存DBにインデックス / ユニーク制約を追加する")
+    parser.add_argument("--dry-run", action="store_true", help="追加されるインデックスを表示するだけ")
+    args = parser.parse_args()
+    migrate(args.dry_run)
@@ -0,0 +1,134 @@
+# hackathon-backend/models.py
+# DBモデル (ORM)。import してもDBには接続しない
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, LargeBinary, Index
+from sqlalchemy.dialects.mysql import LONGTEXT, LONGBLOB
+from sqlalchemy.orm import relationship, deferred
+
+from database import Base
+from images import make_thumbnail, etag_for
+
+# --- DBモデル ---
+class User(Base):
+    __tablename__ = "users"
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String(50), unique=True)
+    hashed_password = Column(String(100)) # ★追加: パスワード保存用
+    channels = relationship("Channel", back_populates="owner")
+
+class Channel(Base):
+    __tablename__ = "channels"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    name = Column(String(100))
+    owner = relationship("User", back_populates="channels")
+    __table_args__ = (
+        Index("ix_channels_user_id", "user_id"),
+    )
+    items = relationship("Item", back_populates="channel")
+
+class Item(Base):
+    __tablename__ = "items"
+    id = Column(Integer, primary_key=True, index=True)
+    channel_id = Column(Integer, ForeignKey("channels.id"))
+    title = Column(String(200))
+    description = Column(Text)
+    price = Column(Integer)
+    status = Column(String(20), default="on_sale")
+    category_code = Column(String(100), nullable=True) 
+    # ★変更: 関連商品用のベクトル (float32 のバイト列を base64 で。item_embeddings.py)。一覧では読まない
+    feature_vector = deferred(Column(Text, nullable=True))
+    # ★変更: 画像本体は item_images に保存し、ここには画像URL (外部URL or /api/items/{id}/image) だけを入れる
+    #         (移行前の古い行は base64 が入っている)
+    image_data = Column(Text().with_variant(LONGTEXT(), "mysql"), nullable=True) # ローカル(SQLite)ではText
+    buyer_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    channel = relationship("Channel", back_populates="items")
+    likes = relationship("Like", back_populates="item")
+    # ★追加: 一覧 / おすすめ / 関連商品の検索条件に合わせたインデックス (migrate_indexes.py)
+    __table_args__ = (
+        Index("ix_items_status_id", "status", "id"),              # おすすめ候補: status='on_sale' ORDER BY id DESC
+        Index("ix_items_channel_id_id", "channel_id", "id"),      # フォロー中 / 出品一覧
+        Index("ix_items_category_code_id", "category_code", "id"), # 関連商品
+        # おすすめの候補生成: カテゴリ別 / フォロー中チャンネルの販売中の商品を新しい順に LIMIT 件だけ読む
+        Index("ix_items_category_status_id", "category_code", "status", "id"),
+        Index("ix_items_channel_status_id", "channel_id", "status", "id"),
+    )
+
+# --- 商品画像 (一覧APIでは読まない) ---
+class ItemImage(Base):
+    __tablename__ = "item_images"
+    item_id = Column(Integer, ForeignKey("items.id"), primary_key=True)
+    content_type = Column(String(50))
+    etag = Column(String(64))
+    data = Column(LargeBinary().with_variant(LONGBLOB(), "mysql"))
+    thumbnail_content_type = Column(String(50))
+    thumbnail_etag = Column(String(64))
+    thumbnail = Column(LargeBinary().with_variant(LONGBLOB(), "mysql"))
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Like(Base):
+    __tablename__ = "likes"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    item_id = Column(Integer, ForeignKey("items.id"))
+    created_at = Column(DateTime, default=datetime.now)
+    item = relationship("Item", back_populates="likes")
+    __table_args__ = (
+        Index("uq_likes_user_item", "user_id", "item_id", unique=True), # 同じ商品へのいいねは1件だけ
+    )
+
+# --- Viewモデル (閲覧履歴) ---
+class View(Base):
+    __tablename__ = "views"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    item_id = Column(Integer, ForeignKey("items.id"))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_views_user_item", "user_id", "item_id"),
+    )
+
+class ChannelFollow(Base):
+    __tablename__ = "channel_follows"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    channel_id = Column(Integer, ForeignKey("channels.id"))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index("uq_channel_follows_user_channel", "user_id", "channel_id", unique=True),
+    )
+
+# ★追加: ユーザー×カテゴリのいいね数・閲覧数 (toggle_like / record_view で差分更新する)
+# rebuild_affinity.py で likes / views から作り直せる
+class UserCategoryAffinity(Base):
+    __tablename__ = "user_category_affinity"
+    user_id = Column(Integer, primary_key=True)
+    category_code = Column(String(100), primary_key=True)
+    like_count = Column(Integer, nullable=False, default=0)
+    view_count = Column(Integer, nullable=False, default=0)
+
+
+
+# --- 画像行の作成 (create_item / migrate_images.py) ---
+def image_path(item_id: int):
+    return f"/api/items/{item_id}/image"
+
+def build_item_image(item_id: int, data: bytes, content_type: str):
+    thumb, thumb_type = make_thumbnail(data, content_type)
+    return ItemImage(
+        item_id=item_id,
+        content_type=content_type,
+        etag=etag_for(data),
+        data=data,
+        thumbnail_content_type=thumb_type,
+        thumbnail_etag=etag_for(thumb),
+        thumbnail=thumb,
+    )
+
+# ★変更: テーブル作成は import 時ではなく起動時 (lifespan) やスクリプトから明示的に呼ぶ
+def init_db(bind=None):
+    if bind is None:
+        from database import engine
+        bind = engine
+    Base.metadata.create_all(bind=bind)
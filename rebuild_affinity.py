@@ -0,0 +1,61 @@
+# rebuild_affinity.py
+# user_category_affinity を likes / views テーブルから作り直す
+# 使い方: python rebuild_affinity.py [--user-id 123]
+# 差分更新がずれたとき (導入直後・手動でデータを直したとき) に実行する。
+import argparse
+import time
+
+from sqlalchemy import func
+
+from database import SessionLocal
+from models import Item, Like, View, UserCategoryAffinity, init_db
+
+INSERT_CHUNK = 1000
+
+
+def rebuild(db, user_id=None):
+    """集計し直して入れ替える (1トランザクション)。書き込んだ行数を返す"""
+    counts = {}
+    likes = db.query(Like.user_id, Item.category_code, func.count(Like.id)) \
+              .join(Item, Item.id == Like.item_id) \
+              .filter(Item.category_code.isnot(None))
+    views = db.query(View.user_id, Item.category_code, func.count(View.id)) \
+              .join(Item, Item.id == View.item_id) \
+              .filter(Item.category_code.isnot(None))
+    if user_id is not None:
+        likes = likes.filter(Like.user_id == user_id)
+        views = views.filter(View.user_id == user_id)
+
+    for uid, cat, n in likes.group_by(Like.user_id, Item.category_code).yield_per(INSERT_CHUNK):
+        counts.setdefault((uid, cat), [0, 0])[0] = n
+    for uid, cat, n in views.group_by(View.user_id, Item.category_code).yield_per(INSERT_CHUNK):
+        counts.setdefault((uid, cat), [0, 0])[1] = n
+
+    delete = db.query(UserCategoryAffinity)
+    if user_id is not None:
+        delete = delete.filter(UserCategoryAffinity.user_id == user_id)
+    delete.delete(synchronize_session=False)
+
+    rows = [
+        {"user_id": uid, "category_code": cat, "like_count": like_count, "view_count": view_count}
+        for (uid, cat), (like_count, view_count) in counts.items() if cat
+    ]
+    for i in range(0, len(rows), INSERT_CHUNK):
+        db.execute(UserCategoryAffinity.__table__.insert(), rows[i:i + INSERT_CHUNK])
+    db.commit()
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="user_category_affinity を likes / views から作り直す")
+    parser.add_argument("--user-id", type=int, default=None, help="指定したユーザーだけ作り直す")
+    args = parser.parse_args()
+
+    init_db() # 新しいDBでもテーブルを作ってから集計する
+    started = time.time()
+    db = SessionLocal()
+    try:
+        n = rebuild(db, args.user_id)
+    finally:
+        db.close()
+    print(f"再集計完了！ {n}行 ({time.time() - started:.1f}秒)")
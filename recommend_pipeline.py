@@ -0,0 +1,321 @@
+# hackathon-backend/recommend_pipeline.py
+# おすすめ順の一覧を「候補生成 -> ランキング -> 多様性の並べ替え」の3段で作る
+#
+# - 候補生成: 複数の CandidateSource (新着 / 嗜好カテゴリ / いいね・閲覧したカテゴリ / フォロー中チャンネル) の
+#   SELECT を UNION ALL で1本にまとめ、(id, カテゴリ, チャンネル) だけを数百件読む。商品の総数が増えても読む量は変わらない
+# - ランキング: Ranker が候補にまとめてスコアを付ける (既定は学習済みのロジスティック回帰 + ブースト)
+# - 並べ替え: Reranker が上位に同じカテゴリが続かないように並べ直す
+# 各段の所要時間はリクエストごとに RecommendResult.timings に入り、累計は stats() で見られる
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import select, union_all, literal
+
+from config import RECOMMEND_CANDIDATE_LIMIT
+from models import Item, ChannelFollow, UserCategoryAffinity
+
+DEMO_USER_ID = 555696053 # 学習データ (rec_prefs) のユーザー。嗜好が学習されていないユーザーはこの人の嗜好を使う
+
+
+class RecommendContext:
+    """1リクエスト分の入力 (ユーザーのカテゴリ嗜好など)。候補生成・ランキングの各部品はここから読む"""
+
+    def __init__(self, user_id, pref_scores, liked_categories=(), view_counts=None, followed_channels=()):
+        self.user_id = user_id
+        self.pref_scores = pref_scores                  # {category_code: score} (rec_prefs 由来)
+        self.liked_categories = set(liked_categories)
+        self.view_counts = view_counts or {}
+        self.followed_channels = list(followed_channels)
+
+    def category_score(self, category_code):
+        score = float(self.pref_scores.get(category_code, 0)) if category_code else 0.0
+        # 行動ブースト (ここでリアルタイム性を出す)
+        if category_code in self.liked_categories:
+            score += 50.0 # いいねは強力
+        score += min(self.view_counts.get(category_code, 0) * 1.0, 10.0) # 閲覧は回数に応じて
+        return score
+
+
+class Candidates:
+    """候補の列 (id の降順)。sources は商品ごとに、どの候補元から来たかのビット"""
+
+    def __init__(self, ids, category_codes, channel_ids, sources):
+        self.ids = ids
+        self.category_codes = category_codes
+        self.channel_ids = channel_ids
+        self.sources = sources
+
+    def __len__(self):
+        return len(self.ids)
+
+
+# --- 1段目: 候補生成 ---
+class CandidateSource:
+    """販売中の商品から候補を選ぶ SELECT を返す。None を返すとこのリクエストでは使わない"""
+    name = "source"
+
+    def __init__(self, limit):
+        self.limit = limit
+
+    def statement(self, ctx):
+        raise NotImplementedError
+
+    def _base(self):
+        return select(Item.id, Item.category_code, Item.channel_id).where(Item.status == "on_sale")
+
+    def _newest_per_key(self, column, keys, per_key):
+        """キーごとに新しい順 per_key 件。1キー1つの SELECT にして (キー, status, id) のインデックスで LIMIT 件だけ読ませる"""
+        parts = [self._base().where(column == key).order_by(Item.id.desc()).limit(per_key) for key in keys]
+        if not parts:
+            return None
+        return parts[0] if len(parts) == 1 else union_all(*[select(part.subquery()) for part in parts])
+
+
+class RecentSource(CandidateSource):
+    name = "recent"
+
+    def statement(self, ctx):
+        return self._base().order_by(Item.id.desc()).limit(self.limit)
+
+
+class CategorySource(CandidateSource):
+    """スコアの高いカテゴリから、それぞれ新しい順に per_category 件ずつ"""
+
+    def __init__(self, name, categories, top_categories=5, per_category=25):
+        super().__init__(top_categories * per_category)
+        self.name = name
+        self.categories = categories # ctx -> {category_code: score}
+        self.top_categories = top_categories
+        self.per_category = per_category
+
+    def statement(self, ctx):
+        scores = {cat: score for cat, score in self.categories(ctx).items() if cat and score > 0}
+        top = sorted(scores, key=scores.get, reverse=True)[:self.top_categories]
+        return self._newest_per_key(Item.category_code, top, self.per_category)
+
+
+class FollowedChannelSource(CandidateSource):
+    """最近フォローしたチャンネル (RecommendContext.followed_channels) から、それぞれ新しい順に per_channel 件ずつ"""
+    name = "followed"
+
+    def __init__(self, channels=20, per_channel=5):
+        super().__init__(channels * per_channel)
+        self.per_channel = per_channel
+
+    def statement(self, ctx):
+        # channel_id IN (サブクエリ) だと status のインデックスで全件をなめるプランになることがあるので、チャンネルごとに分ける
+        return self._newest_per_key(Item.channel_id, ctx.followed_channels, self.per_channel)
+
+
+def _pref_categories(ctx):
+    return ctx.pref_scores
+
+
+def _behavior_categories(ctx):
+    scores = {cat: 50.0 for cat in ctx.liked_categories}
+    for cat, views in ctx.view_counts.items():
+        scores[cat] = scores.get(cat, 0.0) + views
+    return scores
+
+
+# --- 2段目: ランキング ---
+class ModelRanker:
+    """カテゴリ嗜好スコア -> 学習済みモデルの確率 (1リクエスト1回の predict_proba) + フォロー中チャンネルのブースト"""
+
+    def __init__(self, followed_boost=0.05):
+        self.followed_boost = followed_boost
+        self._lock = threading.Lock()
+        self._errors = 0
+        self._last_error = None
+
+    def score(self, ctx, candidates, rec_model, followed_bit):
+        # 商品ごとではなく「ユニークなカテゴリ」ごとにスコアを計算する
+        category_index = {}
+        item_codes = np.fromiter((category_index.setdefault(c, len(category_index)) for c in candidates.category_codes),
+                                 dtype=np.int64, count=len(candidates))
+        category_scores = np.array([ctx.category_score(c) for c in category_index], dtype=np.float64)
+        scores = category_scores[item_codes]
+        probs = scores
+        if rec_model is not None and len(scores):
+            try:
+                if hasattr(rec_model, "probability"):
+                    probs = rec_model.probability(scores) # npy 形式 (LogisticScorer)。pandas を使わない
+                else:
+                    import pandas as pd # モデル読み込み時に import 済み
+                    probs = rec_model.predict_proba(pd.DataFrame({'score': scores}))[:, 1].astype(np.float64)
+            except Exception as e:
+                # モデルがエラーを吐いた場合はスコアをそのまま順位付けに使う (ログは最初の1回だけ。件数は stats() で見る)
+                with self._lock:
+                    self._errors += 1
+                    self._last_error = f"{type(e).__name__}: {e}"
+                    first = self._errors == 1
+                if first:
+                    print(f"ランキングモデルのエラー (スコアをそのまま使います): {self._last_error}")
+                probs = scores
+        elif rec_model is None:
+            probs = np.zeros(len(scores)) # モデルが無いときは新着順
+        followed = (candidates.sources & followed_bit) != 0
+        return probs + self.followed_boost * followed
+
+    def stats(self):
+        with self._lock:
+            return {"model_errors": self._errors, "last_model_error": self._last_error}
+
+
+# --- 3段目: 多様性の並べ替え ---
+class CategoryDiversityReranker:
+    """同じカテゴリの n 件目のスコアに decay^n を掛けて並べ直す (1件目はそのまま)"""
+
+    def __init__(self, decay=0.85):
+        self.decay = decay
+
+    def rerank(self, candidates, scores, order):
+        codes = [candidates.category_codes[i] for i in order]
+        seen = {}
+        repeat = np.empty(len(order), dtype=np.float64)
+        for n, code in enumerate(codes):
+            repeat[n] = seen.get(code, 0)
+            seen[code] = repeat[n] + 1
+        adjusted = scores[order] * np.power(self.decay, repeat)
+        # 同点は元の順 (スコア -> 新着) を保つ
+        return order[np.argsort(-adjusted, kind="stable")]
+
+
+class RecommendResult:
+    def __init__(self, item_ids, timings, n_candidates):
+        self.item_ids = item_ids
+        self.timings = timings
+        self.n_candidates = n_candidates
+
+
+class RecommendPipeline:
+    def __init__(self, sources, ranker, reranker=None, candidate_limit=RECOMMEND_CANDIDATE_LIMIT, followed_channels=20):
+        self.sources = sources
+        self.ranker = ranker
+        self.reranker = reranker
+        self.candidate_limit = candidate_limit
+        self.followed_channels = followed_channels
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    async def load_context(self, db, user_id, rec_index):
+        pref_scores = {}
+        if rec_index is not None:
+            # ★変更: train_recommender.py で学習したユーザーは本人の嗜好、それ以外 (未ログイン・新規) はデモユーザーの嗜好
+            pref_scores = (rec_index.user_scores(user_id) if user_id else {}) or rec_index.user_scores(DEMO_USER_ID)
+        if not user_id:
+            return RecommendContext(None, pref_scores)
+        # ★変更: 履歴を毎回集計せず、カテゴリ別の集計テーブルを読むだけにする
+        affinities = (await db.execute(
+            select(UserCategoryAffinity.category_code, UserCategoryAffinity.like_count, UserCategoryAffinity.view_count)
+            .where(UserCategoryAffinity.user_id == user_id)
+        )).all()
+        followed = (await db.scalars(
+            select(ChannelFollow.channel_id).where(ChannelFollow.user_id == user_id)
+            .order_by(ChannelFollow.id.desc()).limit(self.followed_channels)
+        )).all()
+        return RecommendContext(
+            user_id, pref_scores,
+            liked_categories=[cat for cat, likes, _ in affinities if likes > 0],
+            view_counts={cat: views for cat, _, views in affinities if views > 0},
+            followed_channels=followed,
+        )
+
+    async def candidates(self, db, ctx):
+        parts = []
+        for bit, source in enumerate(self.sources):
+            stmt = source.statement(ctx)
+            if stmt is not None:
+                sub = stmt.subquery()
+                parts.append(select(sub.c.id, sub.c.category_code, sub.c.channel_id, literal(1 << bit).label("source")))
+        if not parts:
+            return Candidates([], [], [], np.zeros(0, dtype=np.int64))
+        rows = (await db.execute(parts[0] if len(parts) == 1 else union_all(*parts))).all()
+        # 複数の候補元に出てきた商品は1件にまとめ、どこから来たかをビットで残す
+        merged = {}
+        for item_id, category_code, channel_id, source in rows:
+            if item_id in merged:
+                merged[item_id][2] |= source
+            else:
+                merged[item_id] = [category_code, channel_id, source]
+        ids = sorted(merged, reverse=True)[:self.candidate_limit]
+        return Candidates(
+            np.array(ids, dtype=np.int64),
+            [merged[i][0] for i in ids],
+            [merged[i][1] for i in ids],
+            np.array([merged[i][2] for i in ids], dtype=np.int64),
+        )
+
+    def source_bit(self, name):
+        for bit, source in enumerate(self.sources):
+            if source.name == name:
+                return 1 << bit
+        return 0
+
+    async def run(self, db, user_id, rec_model, rec_index):
+        timings = {}
+        started = time.perf_counter()
+        ctx = await self.load_context(db, user_id, rec_index)
+        timings["context"] = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        candidates = await self.candidates(db, ctx)
+        timings["candidates"] = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        scores = self.ranker.score(ctx, candidates, rec_model, self.source_bit("followed"))
+        # 【重要】ソート順: スコアの降順。スコアが全く同じ場合のみ新着順
+        order = np.lexsort((-candidates.ids, -scores))
+        timings["rank"] = (time.perf_counter() - started) * 1000
+
+        if self.reranker is not None:
+            started = time.perf_counter()
+            order = self.reranker.rerank(candidates, scores, order)
+            timings["rerank"] = (time.perf_counter() - started) * 1000
+
+        self._record(timings, len(candidates))
+        return RecommendResult([int(i) for i in candidates.ids[order]], timings, len(candidates))
+
+    def record(self, stage, ms):
+        self._record({stage: ms})
+
+    def _record(self, timings, n_candidates=None):
+        with self._lock:
+            for stage, ms in timings.items():
+                stat = self._stats.setdefault(stage, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+                stat["count"] += 1
+                stat["total_ms"] += ms
+                stat["max_ms"] = max(stat["max_ms"], ms)
+            if n_candidates is not None:
+                stat = self._stats.setdefault("candidate_count", {"count": 0, "total": 0, "max": 0})
+                stat["count"] += 1
+                stat["total"] += n_candidates
+                stat["max"] = max(stat["max"], n_candidates)
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for stage, stat in self._stats.items():
+                if stage == "candidate_count":
+                    stats[stage] = {"avg": round(stat["total"] / stat["count"], 1), "max": stat["max"]}
+                else:
+                    stats[stage] = {"count": stat["count"], "avg_ms": round(stat["total_ms"] / stat["count"], 3),
+                                    "max_ms": round(stat["max_ms"], 3)}
+        if hasattr(self.ranker, "stats"):
+            stats["ranker"] = self.ranker.stats()
+        return stats
+
+
+def default_pipeline():
+    # 候補は最大 150 + 125 + 125 + 100 = 500件 (重複はまとめる)
+    return RecommendPipeline(
+        sources=[
+            RecentSource(limit=150),
+            CategorySource("preferred", _pref_categories),      # rec_prefs の上位カテゴリ
+            CategorySource("behavior", _behavior_categories),   # いいね・閲覧したカテゴリ
+            FollowedChannelSource(channels=20, per_channel=5),
+        ],
+        ranker=ModelRanker(),
+        reranker=CategoryDiversityReranker(),
+    )
@@ -0,0 +1,261 @@
+# hackathon-backend/recommender.py
+# レコメンド用のユーザー×カテゴリ嗜好インデックスと、学習済みファイルの読み込み / 書き出し
+#
+# 学習済みファイルは2つの形式に対応する (RECOMMENDER_PATH がディレクトリなら npy 形式)
+# - pickle: joblib で保存した {"model": LogisticRegression, "prefs": DataFrame} (recommender.pkl)
+# - npy:    PreferenceIndex の配列を .npy で、ロジスティック回帰の係数を meta.json に書いたディレクトリ
+#           配列は np.load(mmap_mode="r") で開くので、同じホストのワーカー同士は OS のページキャッシュを共有する
+#           (pandas / sklearn も読み込まない)
+#
+# 使い方: python recommender.py export [--src recommender.pkl] [--out recommender]   # pickle -> npy 形式
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+
+class PreferenceIndex:
+    """(user_id, category_code) -> score を CSR 形式で保持するインデックス
+
+    - user_ids: ソート済みのユーザーID (int64)
+    - offsets:  user_ids[i] の行が cat_codes/scores の [offsets[i], offsets[i+1]) にある
+    - cat_codes: カテゴリの整数コード (int16)
+    - scores:   スコア (float32)
+    pandas の DataFrame (文字列カラム) を丸ごと持つより大幅に小さい。
+    """
+
+    ARRAYS = ("user_ids", "offsets", "cat_codes", "scores")
+
+    def __init__(self, categories, user_ids, offsets, cat_codes, scores):
+        self.categories = list(categories)
+        self.category_ids = {c: i for i, c in enumerate(self.categories)}
+        self.user_ids = user_ids
+        self.offsets = offsets
+        self.cat_codes = cat_codes
+        self.scores = scores
+
+    @classmethod
+    def from_frame(cls, prefs, categories=()):
+        # カテゴリ辞書: 既知のカテゴリ一覧 + prefs にだけ出てくるもの
+        vocab = list(dict.fromkeys(list(categories) + sorted(prefs['category_code'].dropna().unique())))
+        category_ids = {c: i for i, c in enumerate(vocab)}
+
+        frame = prefs[prefs['category_code'].notna()]
+        users = frame['user_id'].to_numpy(dtype=np.int64)
+        codes = frame['category_code'].map(category_ids).to_numpy(dtype=np.int16)
+        scores = frame['score'].to_numpy(dtype=np.float32)
+
+        # ユーザーID → カテゴリコードの順に並べて CSR を作る
+        order = np.lexsort((codes, users))
+        users, codes, scores = users[order], codes[order], scores[order]
+        user_ids, starts = np.unique(users, return_index=True)
+        offsets = np.append(starts, len(users)).astype(np.int64)
+        return cls(vocab, user_ids, offsets, codes, scores)
+
+    def __len__(self):
+        return len(self.scores)
+
+    @property
+    def nbytes(self):
+        return self.user_ids.nbytes + self.offsets.nbytes + self.cat_codes.nbytes + self.scores.nbytes
+
+    def _row(self, user_id):
+        pos = int(np.searchsorted(self.user_ids, user_id))
+        if pos >= len(self.user_ids) or self.user_ids[pos] != user_id:
+            return None
+        return slice(int(self.offsets[pos]), int(self.offsets[pos + 1]))
+
+    def has_user(self, user_id):
+        return self._row(user_id) is not None
+
+    def score(self, user_id, category_code, default=0.0):
+        row = self._row(user_id)
+        code = self.category_ids.get(category_code)
+        if row is None or code is None:
+            return default
+        codes = self.cat_codes[row]
+        # 1ユーザーのカテゴリ数はごく少数 & ソート済み
+        pos = int(np.searchsorted(codes, code))
+        if pos < len(codes) and codes[pos] == code:
+            return float(self.scores[row][pos])
+        return default
+
+    def user_scores(self, user_id):
+        """ユーザーのカテゴリ別スコアを {category_code: score} で返す"""
+        row = self._row(user_id)
+        if row is None:
+            return {}
+        return {self.categories[c]: float(s) for c, s in zip(self.cat_codes[row].tolist(), self.scores[row].tolist())}
+
+
+class LogisticScorer:
+    """ロジスティック回帰の予測だけを行う (npy 形式のモデル)。predict_proba は sklearn と同じ形で返す"""
+
+    def __init__(self, coef, intercept, features=("score",)):
+        self.coef_ = np.asarray(coef, dtype=np.float64).reshape(1, -1)
+        self.intercept_ = np.asarray([intercept], dtype=np.float64)
+        self.features = list(features)
+
+    @classmethod
+    def from_model(cls, model):
+        """学習済みの sklearn の LogisticRegression (2クラス) から係数だけを取り出す"""
+        features = getattr(model, "feature_names_in_", None)
+        return cls(np.ravel(model.coef_), float(np.ravel(model.intercept_)[0]),
+                   list(features) if features is not None else ["score"])
+
+    def probability(self, X):
+        """正例の確率 (特徴量1つなら1次元の配列をそのまま渡せる)"""
+        X = np.asarray(X, dtype=np.float64).reshape(len(X), -1)
+        return 1.0 / (1.0 + np.exp(-(X @ self.coef_[0] + self.intercept_[0])))
+
+    def predict_proba(self, X):
+        p = self.probability(X)
+        return np.column_stack([1.0 - p, p])
+
+    def to_dict(self):
+        return {"type": "logistic_regression", "features": self.features,
+                "coef": self.coef_[0].tolist(), "intercept": float(self.intercept_[0])}
+
+
+# --- 学習済みファイル ---
+# pickle: {"model": LogisticRegression, "prefs": DataFrame(user_id, category_code, score, label),
+#          "version": "20260101120000", "trained_at": "...", "stats": {...}}  (version 以降は train_recommender.py が付ける)
+# npy:    <dir>/user_ids.npy, offsets.npy, cat_codes.npy, scores.npy, meta.json
+#         (meta.json = {"format": 1, "version", "trained_at", "stats", "categories": [...], "model": LogisticScorer.to_dict()})
+NPY_FORMAT = 1
+
+
+def load_artifact(path, categories=()):
+    """(model, PreferenceIndex, info) を返す。info は version / trained_at などの付加情報"""
+    if os.path.isdir(path):
+        return load_npy(path)
+    import joblib
+    data = joblib.load(path)
+    # DataFrameは保持せず、ユーザー×カテゴリのインデックスに変換して持つ
+    index = PreferenceIndex.from_frame(data['prefs'], categories)
+    info = {"version": data.get("version"), "trained_at": data.get("trained_at"), "format": "pickle"}
+    model = data['model']
+    info["model"] = type(model).__name__
+    if info["model"] == "LogisticRegression" and np.ravel(model.intercept_).size == 1:
+        # 学習時と違うバージョンの sklearn だと predict_proba が失敗することがあるので、係数だけ取り出して使う
+        model = LogisticScorer.from_model(model)
+        info["model"] = "LogisticScorer (LogisticRegression から変換)"
+    return model, index, info
+
+
+def load_npy(path):
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("format") != NPY_FORMAT:
+        raise ValueError(f"対応していない形式です: {meta.get('format')}")
+    arrays = [np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in PreferenceIndex.ARRAYS]
+    index = PreferenceIndex(meta["categories"], *arrays)
+    model = meta["model"]
+    scorer = LogisticScorer(model["coef"], model["intercept"], model.get("features", ["score"]))
+    info = {"version": meta.get("version"), "trained_at": meta.get("trained_at"), "format": "npy"}
+    return scorer, index, info
+
+
+def export_npy(out_dir, model, index, version, trained_at=None, stats=None):
+    """npy 形式のディレクトリを書く。meta.json は最後に書く (meta.json があれば書き終わっている)"""
+    os.makedirs(out_dir)
+    for name in PreferenceIndex.ARRAYS:
+        np.save(os.path.join(out_dir, f"{name}.npy"), np.ascontiguousarray(getattr(index, name)))
+    scorer = model if isinstance(model, LogisticScorer) else LogisticScorer.from_model(model)
+    meta = {"format": NPY_FORMAT, "version": version, "trained_at": trained_at, "stats": stats or {},
+            "categories": index.categories, "model": scorer.to_dict()}
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return out_dir
+
+
+def versioned_path(target, version):
+    """recommender.pkl -> recommender-<version>.pkl / recommender -> recommender-<version>"""
+    stem, suffix = os.path.splitext(target)
+    return f"{stem}-{version}{suffix}"
+
+
+def publish(artifact_path, target):
+    """書き終わったファイル / ディレクトリを target として公開する (読み込み中のサーバーが途中の状態を見ないように差し替え)
+
+    ファイルはコピーしてから os.replace、ディレクトリは target をシンボリックリンクにして付け替える。
+    """
+    tmp = f"{target}.tmp"
+    if os.path.isdir(artifact_path):
+        if os.path.isdir(target) and not os.path.islink(target):
+            raise ValueError(f"{target} がディレクトリです。シンボリックリンクで置き換えられるように移動してください")
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(os.path.relpath(artifact_path, os.path.dirname(os.path.abspath(target))), tmp)
+    else:
+        shutil.copyfile(artifact_path, tmp)
+    os.replace(tmp, target)
+
+
+class ArtifactWatcher:
+    """学習済みファイルが書き換えられたかを interval 秒ごとに確認する (mtime とサイズで判定)"""
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self._loaded = None
+        self._checked_at = time.monotonic()
+        self._checking = False
+        self._lock = threading.Lock()
+
+    def signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size) # npy 形式はリンク先のディレクトリが変わる
+
+    def mark_loaded(self, signature):
+        """読み込む直前に取った signature() を渡す (読み込み中に書き換えられたら次の確認でもう一度読む)"""
+        with self._lock:
+            self._loaded = signature
+
+    def changed_due(self):
+        """前回の確認から interval 秒経っていて、ファイルが読み込んだときから変わっていれば True (読み込み中の印を付ける)"""
+        with self._lock:
+            if self._checking or time.monotonic() - self._checked_at < self.interval:
+                return False
+            self._checked_at = time.monotonic()
+            signature = self.signature()
+            if signature is None or signature == self._loaded:
+                return False
+            self._checking = True
+            return True
+
+    def done(self):
+        with self._lock:
+            self._checking = False
+
+
+def export(src, out):
+    """pickle 形式 (src) を npy 形式に変換して out に公開する"""
+    import joblib
+    data = joblib.load(src)
+    version = data.get("version") or datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    index = PreferenceIndex.from_frame(data["prefs"])
+    path = export_npy(versioned_path(out, version), data["model"], index, version,
+                      data.get("trained_at"), data.get("stats"))
+    publish(path, out)
+    return path, index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="学習済みファイルの変換")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("export", help="pickle 形式を npy 形式 (mmap で共有できる配列 + JSON の係数) に変換する")
+    p.add_argument("--src", default="recommender.pkl")
+    p.add_argument("--out", default="recommender", help="公開するパス (バージョン付きディレクトリへのシンボリックリンクになる)")
+    args = parser.parse_args()
+    started = time.time()
+    path, index = export(args.src, args.out)
+    print(f"変換完了: {path} -> {args.out} ({len(index)}件, {index.nbytes / 1e6:.1f}MB, {time.time() - started:.1f}秒)")
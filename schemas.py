@@ -0,0 +1,62 @@
+# hackathon-backend/schemas.py
+# APIのリクエストボディ / レスポンスの形 (Pydantic)
+from typing import List, Optional
+
+from pydantic import BaseModel, ConfigDict
+
+
+class PurchaseRequest(BaseModel):
+    user_id: int
+
+class AnalysisRequest(BaseModel):
+    item_name: str
+    item_description: str
+    existing_channels: List[str] = [] # ユーザーが持っているチャンネル名のリスト
+
+class ChannelCreate(BaseModel):
+    name: str
+    user_id: int
+
+class ItemCreate(BaseModel):
+    title: str
+    description: str
+    price: int
+    image_data: str = ""
+    user_id: int
+    channel_id: int # ★修正: ユーザーが選択したチャンネルIDを必須にする
+
+# ★追加: ユーザー認証用モデル
+class UserAuth(BaseModel):
+    username: str
+    password: str
+
+
+# --- レスポンス (一覧APIの形) ---
+class ChannelOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    name: Optional[str] = None
+    user_id: Optional[int] = None
+
+class ItemCard(BaseModel):
+    """カード表示 (一覧のサムネイル) に必要な最小限の項目"""
+    id: int
+    title: Optional[str] = None
+    price: Optional[int] = None
+    thumbnail_url: str = ""
+    status: Optional[str] = None
+
+class ItemSummary(ItemCard):
+    description: Optional[str] = None
+    image_data: str = "" # 画像URL (base64本体は載せない)
+    category_code: Optional[str] = None
+    category_name: Optional[str] = None
+
+class LikedItem(ItemSummary):
+    seller_name: str = "不明"
+
+class FeedItem(LikedItem):
+    seller_id: int = -1
+    channel_id: int = -1
+    channel_name: str = "未設定チャンネル"
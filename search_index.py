@@ -0,0 +1,269 @@
+# hackathon-backend/search_index.py
+# 商品検索 (/api/items/search) 用の転置インデックス
+#
+# - 日本語は分かち書きせず、文字 bigram (2文字ずつ) を単語の代わりにする。1文字の検索語はタイトルの1文字で引く
+# - ポスティング (その bigram を含む商品の行番号) は array('i') で持つ。商品は行番号の昇順に追加されるので常にソート済み
+# - 検索語のすべての bigram を含む商品を候補にし、タイトルでの一致を説明文の2倍 × idf で点数を付ける
+# - カテゴリ・価格・販売中かどうかは行ごとの配列で持ち、候補に NumPy でまとめて絞り込む
+# - カテゴリは出品後にキューで付くので、未設定で入った商品は refresh() のたびにDBで確認し直す
+import math
+import threading
+import time
+import unicodedata
+from array import array
+
+import numpy as np
+
+from config import SEARCH_DESCRIPTION_CHARS, SEARCH_REFRESH_INTERVAL, INDEX_RESCAN_WINDOW
+
+TITLE_WEIGHT = 2.0
+
+
+def normalize(text):
+    return " ".join(unicodedata.normalize("NFKC", text or "").lower().split())
+
+
+def bigrams(text):
+    """空白をまたがない bigram の集合"""
+    grams = set()
+    for word in normalize(text).split():
+        grams.update(word[i:i + 2] for i in range(len(word) - 1))
+    return grams
+
+
+def query_terms(q):
+    """検索語 -> (bigram の集合, 1文字の語の集合)"""
+    grams, chars = set(), set()
+    for word in normalize(q).split():
+        if len(word) == 1:
+            chars.add(word)
+        else:
+            grams.update(word[i:i + 2] for i in range(len(word) - 1))
+    return grams, chars
+
+
+class SearchIndex:
+    """商品ID -> 行番号 の転置インデックス。追加・状態変更はロックの中、検索はポスティングをコピーしてから行う"""
+
+    def __init__(self, capacity=1024, refresh_interval=SEARCH_REFRESH_INTERVAL, rescan_window=INDEX_RESCAN_WINDOW):
+        self._title_postings = {}   # bigram / 1文字 -> array('i') (タイトル)
+        self._body_postings = {}    # bigram -> array('i') (説明文)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._prices = np.zeros(capacity, dtype=np.int64)
+        self._categories = np.zeros(capacity, dtype=np.int32)
+        self._on_sale = np.zeros(capacity, dtype=bool)
+        self._category_ids = {None: 0}
+        self._rows = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._uncategorized = set() # カテゴリ未設定で入っている商品ID (refresh で確認し直す)
+        # load() で読み込み済みの最大ID。add() (このインスタンスでの出品) では進めない
+        self.loaded_max_id = 0
+        self.rescan_window = rescan_window
+        self.refresh_interval = refresh_interval
+        self._refreshed_at = time.monotonic()
+        self._refreshing = False
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        """ポスティングと行ごとの配列のおおよそのバイト数 (dict 自体のオーバーヘッドは含まない)"""
+        postings = sum(p.itemsize * len(p) for d in (self._title_postings, self._body_postings) for p in d.values())
+        return postings + self._ids.nbytes + self._prices.nbytes + self._categories.nbytes + self._on_sale.nbytes
+
+    def _category_id(self, category_code):
+        return self._category_ids.setdefault(category_code, len(self._category_ids))
+
+    def _grow(self, capacity):
+        for name in ("_ids", "_prices", "_categories", "_on_sale"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def add(self, item_id, title, description, price, category_code, status):
+        title_terms = bigrams(title) | set(normalize(title).replace(" ", ""))
+        body_terms = bigrams((description or "")[:SEARCH_DESCRIPTION_CHARS]) - title_terms
+        with self._lock:
+            row = self._rows.get(item_id)
+            if row is None:
+                if self._size == len(self._ids):
+                    self._grow(self._size * 2)
+                row = self._size
+                self._rows[item_id] = row
+                self._size += 1
+                # タイトル・説明文は変わらない前提なので、ポスティングは最初の1回だけ追加する
+                for postings, terms in ((self._title_postings, title_terms), (self._body_postings, body_terms)):
+                    for term in terms:
+                        postings.setdefault(term, array("i")).append(row)
+            self._ids[row] = item_id
+            self._prices[row] = price or 0
+            self._categories[row] = self._category_id(category_code)
+            self._on_sale[row] = status == "on_sale"
+            if category_code:
+                self._uncategorized.discard(item_id)
+            else:
+                self._uncategorized.add(item_id)
+
+    def set_status(self, item_id, status):
+        with self._lock:
+            row = self._rows.get(item_id)
+            if row is not None:
+                self._on_sale[row] = status == "on_sale"
+
+    def set_category(self, item_id, category_code):
+        with self._lock:
+            row = self._rows.get(item_id)
+            if row is not None:
+                self._categories[row] = self._category_id(category_code)
+                if category_code:
+                    self._uncategorized.discard(item_id)
+
+    def search(self, q, category_code=None, min_price=None, max_price=None, include_sold=False, offset=0, limit=50):
+        """(商品IDのリスト, 条件に合う件数) を点数の高い順 (同点は新しい順) で返す"""
+        grams, chars = query_terms(q)
+        with self._lock:
+            n_docs = max(self._size, 1)
+            terms = [(self._title_postings.get(g, ()), self._body_postings.get(g, ())) for g in grams]
+            terms += [(self._title_postings.get(c, ()), ()) for c in chars]
+            # 検索中に追加されても壊れないように、必要な分だけコピーしておく
+            terms = [(np.array(t, dtype=np.int32), np.array(b, dtype=np.int32)) for t, b in terms]
+            ids, prices, on_sale = self._ids, self._prices, self._on_sale
+            categories = self._categories
+            category_id = self._category_ids.get(category_code) if category_code else None
+        if not terms or (category_code and category_id is None):
+            return [], 0
+
+        # 出現数の少ない語から絞り込む
+        terms.sort(key=lambda tb: len(tb[0]) + len(tb[1]))
+        candidates = None
+        for title_rows, body_rows in terms:
+            rows = np.union1d(title_rows, body_rows)
+            candidates = rows if candidates is None else np.intersect1d(candidates, rows, assume_unique=True)
+            if len(candidates) == 0:
+                return [], 0
+
+        mask = np.ones(len(candidates), dtype=bool)
+        if not include_sold:
+            mask &= on_sale[candidates]
+        if category_id is not None:
+            mask &= categories[candidates] == category_id
+        if min_price is not None:
+            mask &= prices[candidates] >= min_price
+        if max_price is not None:
+            mask &= prices[candidates] <= max_price
+        candidates = candidates[mask]
+        if len(candidates) == 0:
+            return [], 0
+
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        for title_rows, body_rows in terms:
+            idf = math.log(1.0 + n_docs / max(len(title_rows) + len(body_rows), 1))
+            scores += idf * np.where(np.isin(candidates, title_rows, assume_unique=True), TITLE_WEIGHT, 1.0)
+        order = np.lexsort((-ids[candidates], -scores))
+        page = candidates[order[offset:offset + limit]]
+        return [int(i) for i in ids[page]], len(candidates)
+
+    # --- DBからの読み込み ---
+    def load(self, db, chunk=5000):
+        """まだ持っていない商品を読み込む (最初は全件、以降は他のインスタンスで追加された分)。読み込んだ件数を返す
+
+        読み込み済みの最大IDより rescan_window 件分下から読み直し、後からコミットされた小さいIDも拾う (持っている商品は飛ばす)。
+        """
+        from sqlalchemy import select
+        from models import Item
+        start = max(self.loaded_max_id - self.rescan_window, 0) if self.loaded_max_id else 0
+        rows = db.execute(
+            select(Item.id, Item.title, Item.description, Item.price, Item.category_code, Item.status)
+            .where(Item.id > start).order_by(Item.id)
+            .execution_options(yield_per=chunk)
+        )
+        loaded = 0
+        for row in rows:
+            self.loaded_max_id = max(self.loaded_max_id, row.id)
+            if row.id in self._rows:
+                continue
+            self.add(row.id, row.title, row.description, row.price, row.category_code, row.status)
+            loaded += 1
+        return loaded
+
+    def sync_uncategorized(self, db, chunk=500):
+        """カテゴリ未設定で入っている商品のカテゴリ・状態をDBから読み直す (他のインスタンスで推定された分)。更新した件数を返す"""
+        from sqlalchemy import select
+        from models import Item
+        with self._lock:
+            item_ids = sorted(self._uncategorized)
+        updated = 0
+        for i in range(0, len(item_ids), chunk):
+            rows = db.execute(
+                select(Item.id, Item.category_code, Item.status).where(Item.id.in_(item_ids[i:i + chunk]))
+            ).all()
+            for item_id, category_code, status in rows:
+                self.set_status(item_id, status)
+                if category_code:
+                    self.set_category(item_id, category_code)
+                    updated += 1
+        return updated
+
+    def sync_sold(self, db, chunk=5000):
+        """販売中でなくなった商品 (他のインスタンスで購入された分) を販売中から外す。外した件数を返す"""
+        from sqlalchemy import select
+        from models import Item
+        updated = 0
+        last_id = 0
+        while True:
+            item_ids = db.scalars(
+                select(Item.id).where(Item.status != "on_sale", Item.id > last_id, Item.id <= self.loaded_max_id)
+                .order_by(Item.id).limit(chunk)
+            ).all()
+            if not item_ids:
+                return updated
+            with self._lock:
+                for item_id in item_ids:
+                    row = self._rows.get(item_id)
+                    if row is not None and self._on_sale[row]:
+                        self._on_sale[row] = False
+                        updated += 1
+            last_id = item_ids[-1]
+
+    def refresh_due(self):
+        """前回から refresh_interval 秒経っていれば True を返し、読み込み中の印を付ける"""
+        with self._lock:
+            if self._refreshing or time.monotonic() - self._refreshed_at < self.refresh_interval:
+                return False
+            self._refreshing = True
+            return True
+
+    def refresh(self, db):
+        try:
+            self.sync_uncategorized(db)
+            self.sync_sold(db)
+            return self.load(db)
+        finally:
+            with self._lock:
+                self._refreshed_at = time.monotonic()
+                self._refreshing = False
+
+
+def like_search(q, category_code=None, min_price=None, max_price=None, include_sold=False):
+    """インデックスを使わない検索 (LIKE '%語%' の全件走査)。インデックスが無いときの代わりと、ベンチマークの比較用
+
+    インデックスと同じ結果になるように、説明文は先頭 SEARCH_DESCRIPTION_CHARS 文字だけを見る。
+    """
+    from sqlalchemy import select, or_, func, Text
+    from models import Item
+    description = func.substr(Item.description, 1, SEARCH_DESCRIPTION_CHARS, type_=Text)
+    stmt = select(Item.id)
+    for word in normalize(q).split():
+        stmt = stmt.where(or_(Item.title.contains(word, autoescape=True), description.contains(word, autoescape=True)))
+    if not include_sold:
+        stmt = stmt.where(Item.status == "on_sale")
+    if category_code:
+        stmt = stmt.where(Item.category_code == category_code)
+    if min_price is not None:
+        stmt = stmt.where(Item.price >= min_price)
+    if max_price is not None:
+        stmt = stmt.where(Item.price <= max_price)
+    return stmt.order_by(Item.id.desc())
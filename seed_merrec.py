@@ -1,22 +1,15 @@
-import google.generativeai as genai
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from main import Base, Item, Channel, User, get_db
+from models import Item, Channel, User, init_db
+from database import make_engine
 import os
 import random
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# DB接続 (main.pyの設定を利用)
-# ※ main.pyのDATABASE_URLと同じ設定にしてください
-DB_USER = "benihiko"
-DB_PASS = "Hide-1213"
-DB_HOST = "136.119.203.142"
-DB_NAME = "hackathon"
-DATABASE_URL = f"mysql+mysqlconnector://{DB_USER}:{DB_PASS}@{DB_HOST}/{DB_NAME}"
-
-engine = create_engine(DATABASE_URL)
+# DB接続 (database.py の設定を利用。環境変数 DATABASE_URL などで変更できる)
+engine = make_engine()
+init_db(bind=engine) # 新しいDBでもテーブルを作っておく
 SessionLocal = sessionmaker(bind=engine)
 db = SessionLocal()
 
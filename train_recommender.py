@@ -0,0 +1,282 @@
+# train_recommender.py
+# likes / views / items から recommender.pkl (ユーザー×カテゴリの嗜好スコア + ロジスティック回帰) を作り直す
+# 使い方: python train_recommender.py [--chunk 50000] [--out-dir models] [--no-publish] [--keep-versions 5] [--format npy|pickle]
+#
+# - 各テーブルは id の順に chunk 件ずつ読み、(ユーザー, カテゴリ) ごとの件数を NumPy の配列で数える (全件をメモリに載せない)
+# - 嗜好スコア = いいね数 x LIKE_WEIGHT + 閲覧数。ラベル = そのカテゴリの商品を買ったか (items.buyer_id)
+#   購入が無い / 全員が買っている (ラベルが1種類) ときは、元の学習データと同じく スコア >= POSITIVE_SCORE を正例にする
+# - recommender-<version>.pkl (npy 形式なら recommender-<version>/) を書いてから RECOMMENDER_PATH に置き換える。動いているサーバーは
+#   RECOMMENDER_RELOAD_INTERVAL 秒以内に読み込み直す (再起動不要)。複数インスタンスなら共有ストレージに置く
+import argparse
+import os
+import re
+import resource
+import shutil
+import time
+from datetime import datetime, timezone
+from glob import glob
+
+import numpy as np
+from sqlalchemy import select
+
+from config import RECOMMENDER_PATH
+from database import SessionLocal
+from models import Item, Like, View
+from recommend_pipeline import DEMO_USER_ID
+from recommender import PreferenceIndex, export_npy, load_artifact, publish, versioned_path
+
+LIKE_WEIGHT = 5     # いいね1件 = 閲覧5回分
+POSITIVE_SCORE = 5  # 購入ラベルが使えないときの正例の閾値 (元の学習データと同じ)
+CATEGORY_BITS = 16  # (ユーザー, カテゴリ) を user_id << 16 | カテゴリ番号 の1つの整数にして数える
+
+
+class PairCounts:
+    """(ユーザー, カテゴリ) ごとの件数。chunk ごとの集計を溜めておき、ある程度溜まったらまとめる"""
+
+    def __init__(self, merge_every=1_000_000):
+        self.merge_every = merge_every
+        self._keys = []
+        self._counts = []
+        self._pending = 0
+
+    def add(self, user_ids, category_ids):
+        keys = (user_ids.astype(np.int64) << CATEGORY_BITS) | category_ids.astype(np.int64)
+        keys, counts = np.unique(keys, return_counts=True)
+        self._keys.append(keys)
+        self._counts.append(counts.astype(np.int64))
+        self._pending += len(keys)
+        if self._pending >= self.merge_every:
+            self._merge()
+
+    def _merge(self):
+        if len(self._keys) > 1:
+            keys, inverse = np.unique(np.concatenate(self._keys), return_inverse=True)
+            counts = np.bincount(inverse, weights=np.concatenate(self._counts)).astype(np.int64)
+            self._keys, self._counts = [keys], [counts]
+        self._pending = 0
+
+    def result(self):
+        """(キーの昇順の配列, 件数の配列)"""
+        self._merge()
+        if not self._keys:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return self._keys[0], self._counts[0]
+
+
+def stream(db, id_column, columns, chunk, *where):
+    """id の順に chunk 件ずつ読む (キーセットページング)。(id, *columns) の列ごとのタプルを返す"""
+    conn = db.connection() # ORM の行オブジェクトを作らないぶん速い
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(id_column, *columns).where(id_column > last_id, *where).order_by(id_column).limit(chunk)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        yield tuple(zip(*rows))
+
+
+def load_items(db, chunk, purchases):
+    """商品ID -> カテゴリ番号 の対応 (ID の昇順の配列) を作りながら、購入を purchases に数える"""
+    categories = {}
+    item_ids, item_categories = [], []
+    for ids, codes, buyers in stream(db, Item.id, (Item.category_code, Item.buyer_id), chunk):
+        ids = np.array(ids, dtype=np.int64)
+        cats = np.array([categories.setdefault(c, len(categories)) if c else -1 for c in codes], dtype=np.int32)
+        buyers = np.array([b or 0 for b in buyers], dtype=np.int64)
+        item_ids.append(ids)
+        item_categories.append(cats)
+        bought = (buyers > 0) & (cats >= 0)
+        if bought.any():
+            purchases.add(buyers[bought], cats[bought])
+    if len(categories) >= 1 << CATEGORY_BITS:
+        raise ValueError(f"カテゴリが多すぎます ({len(categories)})")
+    vocab = [None] * len(categories)
+    for code, i in categories.items():
+        vocab[i] = code
+    if not item_ids:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32), vocab
+    return np.concatenate(item_ids), np.concatenate(item_categories), vocab
+
+
+def count_events(db, model, chunk, item_ids, item_categories, counts):
+    """likes / views を読み、商品のカテゴリに置き換えて (ユーザー, カテゴリ) ごとに数える。読んだ行数を返す"""
+    total = 0
+    for _, users, items in stream(db, model.id, (model.user_id, model.item_id), chunk,
+                                  model.user_id.isnot(None), model.item_id.isnot(None)):
+        users = np.array(users, dtype=np.int64)
+        items = np.array(items, dtype=np.int64)
+        total += len(users)
+        if not len(item_ids):
+            continue
+        pos = np.minimum(np.searchsorted(item_ids, items), len(item_ids) - 1)
+        cats = item_categories[pos]
+        valid = (item_ids[pos] == items) & (cats >= 0)
+        if valid.any():
+            counts.add(users[valid], cats[valid])
+    return total
+
+
+def _lookup(keys, source):
+    """keys (昇順) の各キーの件数を source から引く (無ければ 0)"""
+    src_keys, src_counts = source
+    out = np.zeros(len(keys), dtype=np.int64)
+    if len(src_keys):
+        pos = np.minimum(np.searchsorted(src_keys, keys), len(src_keys) - 1)
+        hit = src_keys[pos] == keys
+        out[hit] = src_counts[pos[hit]]
+    return out
+
+
+def build_prefs(likes, views, purchases, vocab):
+    """(user_id, category_code, score, label) の DataFrame と、ラベルの付け方を返す"""
+    import pandas as pd
+    keys = np.unique(np.concatenate([likes[0], views[0], purchases[0]]))
+    like_counts, view_counts, purchase_counts = _lookup(keys, likes), _lookup(keys, views), _lookup(keys, purchases)
+    scores = like_counts * LIKE_WEIGHT + view_counts
+    labels = (purchase_counts > 0).astype(np.int64)
+    label_source = "purchase"
+    if len(np.unique(labels)) < 2:
+        labels = (scores >= POSITIVE_SCORE).astype(np.int64)
+        label_source = f"score>={POSITIVE_SCORE}"
+    category_ids = keys & ((1 << CATEGORY_BITS) - 1)
+    prefs = pd.DataFrame({
+        "user_id": keys >> CATEGORY_BITS,
+        "category_code": pd.Series(np.asarray(vocab, dtype=object)[category_ids] if len(keys) else [], dtype=object),
+        "score": scores,
+        "label": labels,
+    })
+    return prefs, label_source
+
+
+def fit_model(prefs, fallback_model):
+    """score -> label のロジスティック回帰。ラベルが1種類しか無ければ fallback_model (今のモデル) をそのまま使う"""
+    import pandas as pd
+    from sklearn.linear_model import LogisticRegression
+    if prefs["label"].nunique() < 2:
+        if fallback_model is None:
+            raise ValueError("ラベルが1種類しかなく、引き継ぐモデルもありません (likes / views / 購入が少なすぎます)")
+        print("ラベルが1種類しかないので、今のモデルを引き継ぎます")
+        return fallback_model, False
+    model = LogisticRegression()
+    model.fit(pd.DataFrame({"score": prefs["score"].astype(np.float64)}), prefs["label"])
+    return model, True
+
+
+def load_base(path, keep_users):
+    """今のファイル (pickle / npy 形式) から (モデル, 引き継ぐユーザーの prefs) を読む。無ければ (None, None)"""
+    import pandas as pd
+    try:
+        model, index, _ = load_artifact(path)
+    except Exception as e:
+        print(f"今のモデルは読み込めませんでした ({e})")
+        return None, None
+    rows = [(user_id, code, score) for user_id in keep_users for code, score in index.user_scores(user_id).items()]
+    prefs = pd.DataFrame(rows, columns=["user_id", "category_code", "score"])
+    prefs["label"] = (prefs["score"] >= POSITIVE_SCORE).astype(np.int64)
+    return model, prefs
+
+
+def prune_versions(out_dir, stem, suffix, keep, fmt, published=None):
+    """古いバージョンを消して新しい keep 件だけ残す
+
+    消すのはこの形式のもの (npy はディレクトリ、pickle はファイル) で、名前が stem-<14桁の日時>suffix のものだけ。
+    公開中のもの (published のリンク先) は残す。
+    """
+    name = re.compile(re.escape(stem) + r"-\d{14}" + re.escape(suffix) + "$")
+    is_format = os.path.isdir if fmt == "npy" else os.path.isfile
+    versions = sorted(path for path in glob(os.path.join(out_dir, f"{stem}-*{suffix}"))
+                      if name.match(os.path.basename(path)) and is_format(path) and not os.path.islink(path))
+    keep_paths = {os.path.realpath(published)} if published else set()
+    for path in versions[:-keep] if keep > 0 else []:
+        if os.path.realpath(path) in keep_paths:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def train(db, chunk, out_dir, publish_to, keep_users, keep_versions, fmt):
+    import joblib
+    import pandas as pd
+
+    timings = {}
+    started = time.perf_counter()
+    purchases = PairCounts()
+    item_ids, item_categories, vocab = load_items(db, chunk, purchases)
+    timings["items"] = time.perf_counter() - started
+    print(f"商品: {len(item_ids)}件 / カテゴリ {len(vocab)}種類 ({timings['items']:.1f}秒)")
+
+    likes, views = PairCounts(), PairCounts()
+    for name, model, counts in (("likes", Like, likes), ("views", View, views)):
+        t = time.perf_counter()
+        n = count_events(db, model, chunk, item_ids, item_categories, counts)
+        timings[name] = time.perf_counter() - t
+        print(f"{name}: {n}件 ({timings[name]:.1f}秒)")
+    del item_ids, item_categories
+
+    t = time.perf_counter()
+    prefs, label_source = build_prefs(likes.result(), views.result(), purchases.result(), vocab)
+    base_model, base_prefs = load_base(RECOMMENDER_PATH, keep_users)
+    model, fitted = fit_model(prefs, base_model)
+    # 未ログイン / 学習されていないユーザー用の嗜好 (DEMO_USER_ID) は今のファイルから引き継ぐ
+    if base_prefs is not None and len(base_prefs):
+        prefs = pd.concat([prefs, base_prefs[~base_prefs["user_id"].isin(prefs["user_id"])]], ignore_index=True)
+    timings["fit"] = time.perf_counter() - t
+
+    version = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    trained_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    stats = {
+        "rows": len(prefs), "users": int(prefs["user_id"].nunique()), "positives": int(prefs["label"].sum()),
+        "label_source": label_source, "fitted": fitted,
+        "coef": [float(c) for c in np.ravel(model.coef_)], "intercept": float(np.ravel(model.intercept_)[0]),
+    }
+
+    stem, suffix = os.path.splitext(os.path.basename(publish_to or RECOMMENDER_PATH))
+    os.makedirs(out_dir, exist_ok=True)
+    artifact_path = versioned_path(os.path.join(out_dir, stem + suffix), version)
+    t = time.perf_counter()
+    if fmt == "npy":
+        export_npy(artifact_path, model, PreferenceIndex.from_frame(prefs), version, trained_at, stats)
+    else:
+        joblib.dump({"model": model, "prefs": prefs, "version": version, "trained_at": trained_at, "stats": stats},
+                    artifact_path)
+    if publish_to:
+        publish(artifact_path, publish_to)
+    prune_versions(out_dir, stem, suffix, keep_versions, fmt, publish_to or RECOMMENDER_PATH)
+    timings["save"] = time.perf_counter() - t
+    return artifact_path, stats, timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="likes / views / items から recommender.pkl を学習し直す")
+    parser.add_argument("--chunk", type=int, default=50000, help="1回に読む行数")
+    parser.add_argument("--out-dir", default=os.path.dirname(RECOMMENDER_PATH) or ".", help="バージョン付きファイルの保存先")
+    parser.add_argument("--no-publish", action="store_true", help="RECOMMENDER_PATH を置き換えない (バージョン付きファイルだけ作る)")
+    parser.add_argument("--keep-users", type=int, nargs="*", default=[DEMO_USER_ID], help="今のファイルから嗜好を引き継ぐユーザー")
+    parser.add_argument("--keep-versions", type=int, default=5, help="残すバージョン付きファイルの数 (0 なら全部残す)")
+    parser.add_argument("--format", choices=["npy", "pickle"], default=None,
+                        help="保存形式 (省略時は RECOMMENDER_PATH が .pkl なら pickle、それ以外は npy)")
+    args = parser.parse_args()
+    fmt = args.format or ("pickle" if RECOMMENDER_PATH.endswith(".pkl") else "npy")
+
+    # ru_maxrss は Linux では KB 単位。import 済みのライブラリの分を引けるように開始時点も取っておく
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        path, stats, timings = train(db, args.chunk, args.out_dir, None if args.no_publish else RECOMMENDER_PATH,
+                                     args.keep_users, args.keep_versions, fmt)
+    finally:
+        db.close()
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"学習完了！ {path}")
+    print(f"  prefs {stats['rows']}行 / ユーザー {stats['users']}人 / 正例 {stats['positives']} (ラベル: {stats['label_source']})")
+    print(f"  係数 {stats['coef']} / 切片 {stats['intercept']:.3f}")
+    print("  時間: " + " / ".join(f"{k} {v:.1f}秒" for k, v in timings.items()) + f" / 合計 {time.perf_counter() - started:.1f}秒")
+    print(f"  メモリ: 最大RSS {max_rss:.0f}MB (開始時 {start_rss:.0f}MB, 学習で +{max_rss - start_rss:.0f}MB)")
+    if not args.no_publish:
+        print(f"  {RECOMMENDER_PATH} を置き換えました (サーバーは次の確認で読み込み直します)")
@@ -0,0 +1,138 @@
+# hackathon-backend/view_buffer.py
+# 閲覧ログの書き込みバッファ (受け付けはすぐ返し、まとめて一括INSERTする)
+import queue
+import threading
+import time
+
+
+class ViewBuffer:
+    """閲覧イベントをためて batch_size 件 or flush_interval 秒ごとに flush_rows(rows) へ渡す
+
+    - キューは maxsize 件まで。満杯ならすぐ捨てる (バックプレッシャー)。add() はイベントループから呼ぶので待たない
+      (スレッドから呼ぶ場合だけ put_timeout > 0 で空きを待てる)
+    - flush_rows が失敗したら max_retries 回までやり直し、それでもダメなら捨てて数える
+    - stop() で残りを全部書き出してから止まる。timeout までに書き切れずキューに残った分は lost に数える
+    - coalesce_key を渡すと、1バッチ内で同じキーの行は最初の1件だけ書く (まとめた件数は coalesced)
+    """
+
+    def __init__(self, flush_rows, maxsize=10000, batch_size=500, flush_interval=1.0, put_timeout=0.0, max_retries=3,
+                 coalesce_key=None):
+        self._flush_rows = flush_rows
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.coalesce_key = coalesce_key
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._counters = {"accepted": 0, "dropped": 0, "flushed": 0, "flushes": 0, "flush_errors": 0, "lost": 0,
+                          "coalesced": 0}
+        self._last_flush_ms = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="view-buffer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        # 書き出しが間に合わなかった分 (と停止と入れ違いに積まれた分) は捨てて数える
+        lost = 0
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+            lost += 1
+        if lost:
+            with self._lock:
+                self._counters["lost"] += lost
+
+    def add(self, row):
+        """受け付けたら True。満杯で捨てたら False"""
+        try:
+            if self.put_timeout > 0:
+                self._queue.put(row, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("accepted")
+        return True
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 and batch:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=max(remaining, 0.01)))
+                except queue.Empty:
+                    if self._stop.is_set() or batch:
+                        break
+                    deadline = time.monotonic() + self.flush_interval
+            if batch:
+                self._flush(batch)
+
+    def _coalesce(self, batch):
+        seen = set()
+        rows = []
+        for row in batch:
+            key = self.coalesce_key(row)
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append(row)
+        if len(rows) < len(batch):
+            with self._lock:
+                self._counters["coalesced"] += len(batch) - len(rows)
+        return rows
+
+    def _flush(self, batch):
+        if self.coalesce_key is not None:
+            batch = self._coalesce(batch)
+        for attempt in range(self.max_retries):
+            started = time.perf_counter()
+            try:
+                self._flush_rows(batch)
+            except Exception as e:
+                print(f"View Buffer Error (試行 {attempt + 1}/{self.max_retries}): {e}")
+                self._count("flush_errors")
+                if attempt < self.max_retries - 1:
+                    time.sleep(0.1 * (2 ** attempt))
+                continue
+            with self._lock:
+                self._counters["flushed"] += len(batch)
+                self._counters["flushes"] += 1
+                self._last_flush_ms = round((time.perf_counter() - started) * 1000, 1)
+            return
+        with self._lock:
+            self._counters["lost"] += len(batch)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["last_flush_ms"] = self._last_flush_ms
+        stats["queued"] = self._queue.qsize()
+        stats["running"] = self.running
+        return stats